@@ -0,0 +1,121 @@
+"""
+    Measure the cold start of importing a module of the wrangling package.
+
+    Each run imports the module in a fresh interpreter with -X importtime,
+    and reports the median cumulative import time and which of the
+    heavy optional dependencies were loaded by the import. With a baseline
+    revision, the same module is also imported from a git worktree of that
+    revision, and the two are compared.
+
+    Usage, from the repository root:
+        python benchmarks/import_time.py
+        python benchmarks/import_time.py --module src.wrangling.extract_data_pd --runs 5
+        python benchmarks/import_time.py --baseline-ref HEAD~1
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# dependencies that should only be imported once they are needed
+HEAVY_MODULES = ['pandas', 'numpy', 'matplotlib', 'pyarrow']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time(module: str, root=ROOT) -> tuple:
+    """
+    Import the module in a fresh interpreter.
+
+    Args:
+        module (str): dotted module name.
+        root (str): the tree the module is imported from, always from the
+                    repository root as the working directory, so that every
+                    tree finds the same data directory.
+
+    Returns:
+        tuple: cumulative import time of the module in microseconds,
+               and the heavy modules that were imported.
+
+    Raises:
+        RuntimeError: the module could not be imported.
+    """
+    code = (f"import sys; sys.path.insert(0, {root!r}); import {module}; "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                               cwd=ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        # e.g. an older revision that needs the data directory to import
+        error = completed.stderr.strip().splitlines()[-1:] or ['no error output']
+        raise RuntimeError(f"Import of {module} from {root} failed: {error[0]}")
+    cumulative = None
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            cumulative = int(fields[1])
+    loaded = [name for name in completed.stdout.strip().split(',') if name]
+    return cumulative, loaded
+
+
+def measure(module: str, runs: int, root=ROOT) -> tuple:
+    """
+    Returns:
+        list: cumulative import time of each cold import, in microseconds.
+        list: the heavy modules imported by the last.
+    """
+    timings = []
+    loaded = []
+    for _ in range(runs):
+        cumulative, loaded = import_time(module, root)
+        timings.append(cumulative)
+    return timings, loaded
+
+
+def measure_revision(module: str, runs: int, revision: str) -> tuple:
+    """
+    Measure the module as of a git revision, checked out in a temporary worktree.
+
+    Returns:
+        tuple: see measure.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        worktree = os.path.join(temp_dir, 'baseline')
+        subprocess.run(['git', 'worktree', 'add', '--detach', '--quiet', worktree, revision],
+                       cwd=ROOT, check=True)
+        try:
+            return measure(module, runs, worktree)
+        finally:
+            subprocess.run(['git', 'worktree', 'remove', '--force', worktree], cwd=ROOT,
+                           check=False)
+
+
+def report(label: str, timings: list, loaded: list):
+    print(f"{label}: median {statistics.median(timings) / 1000:.1f} ms, "
+          f"min {min(timings) / 1000:.1f} ms over {len(timings)} cold imports")
+    print(f"heavy modules imported: {', '.join(loaded) or 'none'}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Cold start import time of a module.")
+    parser.add_argument('--module', default='src.wrangling.extract_data_csv')
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--baseline-ref', default=None,
+                        help="git revision to compare against, e.g. HEAD~1 or main")
+    args = parser.parse_args(argv)
+
+    timings, loaded = measure(args.module, args.runs)
+    report(args.module, timings, loaded)
+    if args.baseline_ref:
+        baseline, baseline_loaded = measure_revision(args.module, args.runs, args.baseline_ref)
+        report(f"{args.module} at {args.baseline_ref}", baseline, baseline_loaded)
+        print(f"change: {statistics.median(baseline) / 1000:.1f} ms -> "
+              f"{statistics.median(timings) / 1000:.1f} ms "
+              f"({statistics.median(timings) / statistics.median(baseline):.2f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
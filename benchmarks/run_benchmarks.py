@@ -0,0 +1,243 @@
+"""
+    Time the loaders and every analysis of extract_data_csv and extract_data_pd
+    on a synthetic dataset, and emit the results as JSON.
+
+    For each benchmark the results record the time of the first (cold) call,
+    the median of the repeated calls, the throughput in dataset rows per
+    second and the peak memory allocated during a call.
+    Comparing against an earlier results file reports regressions.
+
+    Usage, from the repository root:
+        python benchmarks/run_benchmarks.py --rows 100000 --output results.json
+        python benchmarks/run_benchmarks.py --rows 100000 --baseline results.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic_data import generate_csv  # noqa: E402
+from src.wrangling import extract_data_csv, extract_data_pd  # noqa: E402
+from src.wrangling.aggregate_cache import invalidate_cache  # noqa: E402
+
+# generated datasets are kept here and reused by later runs
+DATA_DIR = os.path.join(ROOT, 'benchmarks', 'data')
+
+
+def _time_call(function) -> float:
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        function()
+        return time.perf_counter() - start
+
+
+def _peak_memory(function) -> int:
+    tracemalloc.start()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(name: str, group: str, function, rows: int, repeat: int, reset=None) -> dict:
+    """
+    Args:
+        name (str): name of the benchmark.
+        group (str): 'load', 'csv' or 'pd'.
+        function (function): called with no arguments.
+        rows (int): number of rows in the dataset, for the throughput.
+        repeat (int): number of timed calls after the cold call.
+        reset (function): called before the cold call, e.g. to empty a cache.
+
+    Returns:
+        dict: the benchmark result.
+    """
+    if reset is not None:
+        reset()
+    cold = _time_call(function)
+    timings = [_time_call(function) for _ in range(repeat)] or [cold]
+    median = statistics.median(timings)
+    return {'name': name, 'group': group,
+            'cold_seconds': cold,
+            'median_seconds': median,
+            'min_seconds': min(timings),
+            'rows_per_second': rows / median if median else None,
+            'peak_bytes': _peak_memory(function)}
+
+
+def run(file_path: str, rows: int, repeat=5, load_repeat=1) -> list:
+    """
+    Run every benchmark on a dataset.
+
+    Args:
+        file_path (str): path of the CSV file.
+        rows (int): number of rows in the file.
+        repeat (int): timed calls of each analysis after its cold call.
+        load_repeat (int): timed calls of each loader after its cold call.
+
+    Returns:
+        list: a result per benchmark, see measure.
+    """
+    data_path, file_name = os.path.split(file_path)
+    data_path = os.path.join(data_path, '')
+    results = []
+
+    def stream_all():
+        patient_headers, rows_stream = extract_data_csv.get_csv_data(
+            data_path, file_name, stream=True)
+        for _ in rows_stream:
+            pass
+
+    loaders = [
+        ('get_csv_data', lambda: extract_data_csv.get_csv_data(data_path, file_name)),
+        ('get_csv_data(stream=True)', stream_all),
+        ('get_csv_data(columnar=True)',
+         lambda: extract_data_csv.get_csv_data(data_path, file_name, columnar=True)),
+        ('load_lung_cancer_data',
+         lambda: extract_data_pd.load_lung_cancer_data(file_path, report=False)),
+        ('load_lung_cancer_data(cached=True)',
+         lambda: extract_data_pd.load_lung_cancer_data(file_path, cached=True, report=False)),
+    ]
+    for name, loader in loaders:
+        results.append(measure(name, 'load', loader, rows, load_repeat))
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        patient_headers, csv_reader = extract_data_csv.get_csv_data(data_path, file_name)
+    patient_ids = [str(patient_id) for patient_id in range(1, min(rows, 100) + 1)]
+    csv_queries = [
+        ('demographic_info', lambda: extract_data_csv.demographic_info(
+            '5', csv_reader, patient_headers)),
+        ('demographic_info_batch', lambda: extract_data_csv.demographic_info_batch(
+            patient_ids, csv_reader, patient_headers)),
+        ('medical_history', lambda: extract_data_csv.medical_history(
+            'asian', csv_reader, patient_headers)),
+        ('survival_treatment_details', lambda: extract_data_csv.survival_treatment_details(
+            100, csv_reader, patient_headers)),
+        ('hypertension_patients', lambda: extract_data_csv.hypertension_patients(
+            140, csv_reader, patient_headers)),
+    ]
+    for name, query in csv_queries:
+        results.append(measure(name, 'csv', query, rows, repeat))
+    del csv_reader
+
+    lung_cancer_df = extract_data_pd.load_lung_cancer_data(file_path, report=False)
+    pd_queries = [
+        ('patient_long_survival', lambda: extract_data_pd.patient_long_survival(
+            'asian', lung_cancer_df)),
+        ('treatment_white_blood_count', lambda: extract_data_pd.treatment_white_blood_count(
+            'asian', 'surgery', lung_cancer_df)),
+        ('lung_tumor_data', lambda: extract_data_pd.lung_tumor_data(
+            lung_cancer_df, 90, 15.0)),
+        ('survival_blood_pressure', lambda: extract_data_pd.survival_blood_pressure(
+            'male', lung_cancer_df)),
+        ('treatment_for_ethnicity', lambda: extract_data_pd.treatment_for_ethnicity(
+            'asian', lung_cancer_df)),
+        ('smoking_packs_cancer_stage', lambda: extract_data_pd.smoking_packs_cancer_stage(
+            lung_cancer_df, plot=False)),
+        ('blood_pressure_treatment', lambda: extract_data_pd.blood_pressure_treatment(
+            lung_cancer_df)),
+        ('insurer_treatment_data', lambda: extract_data_pd.insurer_treatment_data(
+            lung_cancer_df)),
+    ]
+    for name, query in pd_queries:
+        # the cold call runs without the cached aggregates of the earlier queries
+        results.append(measure(name, 'pd', query, rows, repeat,
+                               reset=lambda: invalidate_cache(lung_cancer_df)))
+    return results
+
+
+def compare(results: list, baseline: list, threshold: float) -> list:
+    """
+    Args:
+        results (list): the current results.
+        baseline (list): earlier results of the same benchmarks.
+        threshold (float): ratio of median times counted as a regression, e.g. 1.2
+
+    Returns:
+        list: (name, baseline seconds, current seconds) of each regression.
+    """
+    previous = {(result['group'], result['name']): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['group'], result['name']))
+        if before and before['median_seconds'] \
+                and result['median_seconds'] > before['median_seconds'] * threshold:
+            regressions.append((result['name'], before['median_seconds'],
+                                result['median_seconds']))
+    return regressions
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the lung cancer analyses.")
+    parser.add_argument('--rows', type=int, default=100_000,
+                        help="rows of synthetic data to benchmark on (default: %(default)s)")
+    parser.add_argument('--data', default=None,
+                        help="benchmark an existing CSV file instead of synthetic data")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="timed calls of each analysis after the cold call")
+    parser.add_argument('--load-repeat', type=int, default=1,
+                        help="timed calls of each loader after the cold call")
+    parser.add_argument('--output', default=None, help="write the JSON results to this file")
+    parser.add_argument('--baseline', default=None,
+                        help="earlier JSON results to report regressions against")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="slowdown ratio reported as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    file_path = args.data
+    if file_path is None:
+        file_path = os.path.join(DATA_DIR, f"lung_cancer_{args.rows}.csv")
+        if not os.path.exists(file_path):
+            generate_csv(file_path, args.rows)
+        rows = args.rows
+    else:
+        with open(file_path, 'rb') as fp:
+            rows = sum(1 for _ in fp) - 1
+
+    results = run(file_path, rows, args.repeat, args.load_repeat)
+    report = {'meta': {'rows': rows, 'file': os.path.relpath(file_path, ROOT),
+                       'file_bytes': os.path.getsize(file_path),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'commit': _git_commit(),
+                       'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')},
+              'results': results}
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as fp:
+            fp.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf8') as fp:
+            regressions = compare(results, json.load(fp)['results'], args.threshold)
+        for name, before, after in regressions:
+            print(f"regression: {name} {before * 1000:.2f} ms -> {after * 1000:.2f} ms "
+                  f"({after / before:.2f}x)", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+    Generate a synthetic lung cancer dataset, with the columns and value
+    distributions of Data/lung_cancer_data.csv, at any number of rows.
+
+    Rows are generated and written a chunk at a time with NumPy,
+    so very large files use constant memory.
+
+    Usage, from the repository root:
+        python benchmarks/synthetic_data.py --rows 100000 --output Data/lung_cancer_data.csv
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# label columns -> (values, relative frequency of each value)
+CATEGORIES = {
+    'Gender': (['Male', 'Female'], [0.5, 0.5]),
+    'Smoking_History': (['Never Smoked', 'Former Smoker', 'Current Smoker'], [0.34, 0.33, 0.33]),
+    'Tumor_Location': (['Upper Lobe', 'Middle Lobe', 'Lower Lobe'], [0.34, 0.33, 0.33]),
+    'Stage': (['Stage I', 'Stage II', 'Stage III', 'Stage IV'], [0.25, 0.25, 0.25, 0.25]),
+    'Treatment': (['Surgery', 'Chemotherapy', 'Radiation Therapy', 'Targeted Therapy'],
+                  [0.25, 0.25, 0.25, 0.25]),
+    'Ethnicity': (['Caucasian', 'African American', 'Asian', 'Hispanic', 'Other'],
+                  [0.2, 0.2, 0.2, 0.2, 0.2]),
+    'Insurance_Type': (['Private', 'Medicare', 'Medicaid', 'Other'], [0.25, 0.25, 0.25, 0.25]),
+}
+
+# yes/no flag columns, each 'Yes' with probability 0.5
+FLAGS = ['Family_History', 'Comorbidity_Diabetes', 'Comorbidity_Hypertension',
+         'Comorbidity_Heart_Disease', 'Comorbidity_Chronic_Lung_Disease',
+         'Comorbidity_Kidney_Disease', 'Comorbidity_Autoimmune_Disease', 'Comorbidity_Other']
+
+# whole number columns -> inclusive (low, high)
+INTEGERS = {'Age': (30, 79), 'Survival_Months': (1, 119), 'Performance_Status': (0, 4),
+            'Blood_Pressure_Systolic': (90, 179), 'Blood_Pressure_Diastolic': (60, 109),
+            'Blood_Pressure_Pulse': (60, 99)}
+
+# real number columns -> (low, high), rounded to two decimal places
+REALS = {'Tumor_Size_mm': (10.0, 100.0), 'Haemoglobin_Level': (10.0, 18.0),
+         'White_Blood_Cell_Count': (3.5, 10.0), 'Platelet_Count': (150.0, 450.0),
+         'Albumin_Level': (3.0, 5.0), 'Alkaline_Phosphatase_Level': (30.0, 120.0),
+         'Alanine_Aminotransferase_Level': (5.0, 40.0),
+         'Aspartate_Aminotransferase_Level': (10.0, 40.0), 'Creatinine_Level': (0.5, 1.5),
+         'LDH_Level': (100.0, 250.0), 'Calcium_Level': (8.5, 10.5),
+         'Phosphorus_Level': (2.5, 4.5), 'Glucose_Level': (70.0, 150.0),
+         'Potassium_Level': (3.5, 5.0), 'Sodium_Level': (135.0, 145.0),
+         'Smoking_Pack_Years': (0.5, 100.0)}
+
+# the column order of the original dataset
+COLUMNS = ['Patient_ID', 'Age', 'Gender', 'Smoking_History', 'Tumor_Size_mm',
+           'Tumor_Location', 'Stage', 'Treatment', 'Survival_Months', 'Ethnicity',
+           'Insurance_Type'] + FLAGS + \
+          ['Performance_Status', 'Blood_Pressure_Systolic', 'Blood_Pressure_Diastolic',
+           'Blood_Pressure_Pulse', 'Haemoglobin_Level', 'White_Blood_Cell_Count',
+           'Platelet_Count', 'Albumin_Level', 'Alkaline_Phosphatase_Level',
+           'Alanine_Aminotransferase_Level', 'Aspartate_Aminotransferase_Level',
+           'Creatinine_Level', 'LDH_Level', 'Calcium_Level', 'Phosphorus_Level',
+           'Glucose_Level', 'Potassium_Level', 'Sodium_Level', 'Smoking_Pack_Years']
+
+# rows generated and written at a time
+CHUNK_ROWS = 500_000
+
+
+def generate_chunk(rng: np.random.Generator, first_id: int, rows: int) -> pd.DataFrame:
+    """
+    Args:
+        rng (Generator): source of random values.
+        first_id (int): Patient_ID of the first row.
+        rows (int): number of rows.
+
+    Returns:
+        DataFrame: the rows, in the column order of the original dataset.
+    """
+    chunk = {'Patient_ID': np.arange(first_id, first_id + rows)}
+    for column, (values, weights) in CATEGORIES.items():
+        codes = rng.choice(len(values), size=rows, p=np.asarray(weights) / sum(weights))
+        chunk[column] = pd.Categorical.from_codes(codes, values)
+    for column in FLAGS:
+        chunk[column] = np.where(rng.random(rows) < 0.5, 'Yes', 'No')
+    for column, (low, high) in INTEGERS.items():
+        chunk[column] = rng.integers(low, high + 1, size=rows)
+    for column, (low, high) in REALS.items():
+        chunk[column] = np.round(rng.uniform(low, high, size=rows), 2)
+    return pd.DataFrame(chunk, columns=COLUMNS)
+
+
+def generate_csv(file_path: str, rows: int, seed=0, chunk_size=CHUNK_ROWS) -> int:
+    """
+    Write a synthetic dataset to a CSV file.
+    Uses the pyarrow CSV writer when it is installed, which is several
+    times faster than DataFrame.to_csv.
+
+    Args:
+        file_path (str): path of the CSV file, replaced if it exists.
+        rows (int): number of rows.
+        seed (int): the same seed always generates the same data.
+        chunk_size (int): number of rows generated and written at a time.
+
+    Returns:
+        int: size of the file in bytes.
+    """
+    rng = np.random.default_rng(seed)
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    chunks = (generate_chunk(rng, start + 1, min(chunk_size, rows - start))
+              for start in range(0, max(rows, 1), chunk_size))
+
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        with open(file_path, 'w', encoding='utf8', newline='') as fp:
+            for number, chunk in enumerate(chunks):
+                chunk.to_csv(fp, header=number == 0, index=False)
+    else:
+        # none of the generated values contain a delimiter or quote,
+        # the header is written separately as pyarrow always quotes it
+        options = pa_csv.WriteOptions(include_header=False, quoting_style='none')
+        with open(file_path, 'wb') as fp:
+            fp.write((",".join(COLUMNS) + "\n").encode('utf8'))
+            writer = None
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pa_csv.CSVWriter(fp, table.schema, write_options=options)
+                writer.write_table(table)
+            writer.close()
+    return os.path.getsize(file_path)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Generate a synthetic lung cancer dataset.")
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--output', default='Data/lung_cancer_data.csv')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    size = generate_csv(args.output, args.rows, args.seed)
+    print(f"{args.rows} rows, {size / 1e6:.1f} MB written to {args.output} "
+          f"in {time.perf_counter() - start:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
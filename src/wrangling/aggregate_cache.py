@@ -0,0 +1,159 @@
+import operator
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+
+from .instrumentation import count, span
+
+# comparison operators accepted in the 'where' filter of cached_aggregate
+COMPARISONS = {'>': operator.gt, '>=': operator.ge,
+                '<': operator.lt, '<=': operator.le,
+                '==': operator.eq, '!=': operator.ne}
+
+# id of the DataFrame -> its AggregationCache
+_frame_caches = {}
+
+
+class AggregationCache:
+    """
+    Least recently used cache of grouped aggregates for one DataFrame.
+
+    The cache is cleared when the frame's shape, columns or dtypes change.
+    Values edited in place, e.g. with df.loc[...] = value, are not detected;
+    call invalidate_cache after doing so.
+    """
+
+    def __init__(self, max_entries=32):
+        """
+        Args:
+            max_entries (int): number of results kept before the least
+                               recently used is evicted.
+        """
+        self.max_entries = max_entries
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def get(self, lung_cancer_df: pd.DataFrame, key: tuple, compute):
+        """
+        Args:
+            lung_cancer_df (DataFrame): the frame the result is computed from.
+            key (tuple): hashable description of the result.
+            compute (function): called with no arguments on a cache miss.
+
+        Returns:
+            the cached, or newly computed, result.
+        """
+        fingerprint = frame_fingerprint(lung_cancer_df)
+        if fingerprint != self.fingerprint:
+            self.clear()
+            self.fingerprint = fingerprint
+
+        if key in self._results:
+            self.hits += 1
+            count('aggregate_cache_hits')
+            self._results.move_to_end(key)
+            return self._results[key]
+
+        self.misses += 1
+        count('aggregate_cache_misses')
+        result = compute()
+        self._results[key] = result
+        if len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+        return result
+
+    def clear(self):
+        self._results.clear()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+
+def frame_fingerprint(lung_cancer_df: pd.DataFrame) -> tuple:
+    """ The shape, columns and dtypes of a frame, which change when it is replaced. """
+    return (lung_cancer_df.shape, tuple(lung_cancer_df.columns),
+            tuple(str(dtype) for dtype in lung_cancer_df.dtypes))
+
+
+def get_cache(lung_cancer_df: pd.DataFrame) -> AggregationCache:
+    """
+    Args:
+        lung_cancer_df (DataFrame): lung cancer data frame.
+
+    Returns:
+        AggregationCache: the cache belonging to the frame, created on first use
+                          and discarded when the frame is garbage collected.
+    """
+    frame_id = id(lung_cancer_df)
+    cache = _frame_caches.get(frame_id)
+    if cache is None:
+        cache = _frame_caches[frame_id] = AggregationCache()
+        weakref.finalize(lung_cancer_df, _frame_caches.pop, frame_id, None)
+    return cache
+
+
+def invalidate_cache(lung_cancer_df: pd.DataFrame):
+    """
+    Discard every cached result for the frame.
+
+    Args:
+        lung_cancer_df (DataFrame): lung cancer data frame.
+    """
+    cache = _frame_caches.get(id(lung_cancer_df))
+    if cache is not None:
+        cache.clear()
+
+
+def cached_aggregate(lung_cancer_df: pd.DataFrame, keys: list, columns, agg: str,
+                     where=None):
+    """
+    Memoized equivalent of:
+        lung_cancer_df[where].groupby(keys)[columns].agg()
+
+    The result is shared by every caller asking for the same keys, columns
+    and aggregation, so must not be modified in place.
+
+    Args:
+        lung_cancer_df (DataFrame): lung cancer data frame.
+        keys (list): columns to group by.
+        columns (str or list): column(s) to aggregate, None for group sizes.
+        agg (str): name of the GroupBy method e.g. 'mean', 'value_counts', 'size'.
+        where (tuple): optional row filter applied before grouping,
+                       (column, comparison, value) e.g. ('Survival_Months', '>', 100)
+
+    Returns:
+        Series or DataFrame: the aggregated result.
+    """
+    if columns is not None and not isinstance(columns, str):
+        columns = tuple(columns)
+    key = (tuple(keys), columns, agg, where)
+    return get_cache(lung_cancer_df).get(
+        lung_cancer_df, key,
+        lambda: _aggregate(lung_cancer_df, list(keys), columns, agg, where))
+
+
+def _aggregate(lung_cancer_df: pd.DataFrame, keys: list, columns, agg: str, where):
+    with span('pd.aggregate', keys=keys, columns=columns, agg=agg):
+        count('rows_scanned', len(lung_cancer_df))
+        return _group(lung_cancer_df, keys, columns, agg, where)
+
+
+def _group(lung_cancer_df: pd.DataFrame, keys: list, columns, agg: str, where):
+    if where is not None:
+        column, comparison, value = where
+        lung_cancer_df = lung_cancer_df.loc[
+            COMPARISONS[comparison](lung_cancer_df[column], value)]
+
+    grouped = lung_cancer_df.groupby(keys, observed=True)
+    if columns is None:
+        return getattr(grouped, agg)()
+    if isinstance(columns, tuple):
+        columns = list(columns)
+    result = getattr(grouped[columns], agg)()
+    if agg == 'value_counts':
+        # categorical columns also count the categories that never appear
+        result = result[result > 0]
+    return result
@@ -0,0 +1,228 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from .instrumentation import count, traced
+
+# the categorical dimensions the cube is grouped by
+CUBE_DIMENSIONS = ['Ethnicity', 'Gender', 'Treatment', 'Stage',
+                   'Tumor_Location', 'Insurance_Type']
+
+# the numeric measures summarised in each cell of the cube
+CUBE_MEASURES = ['Survival_Months', 'Smoking_Pack_Years', 'Tumor_Size_mm',
+                 'White_Blood_Cell_Count', 'Blood_Pressure_Systolic',
+                 'Blood_Pressure_Diastolic', 'Blood_Pressure_Pulse']
+
+# the statistics kept for each measure, all of which can be merged when rolling up,
+# the rounding error of each sum is kept with it, so that sums merged later stay exact
+CUBE_STATISTICS = ['sum', 'sum_error', 'count', 'min', 'max']
+
+# column of the cube holding the number of patients in each cell
+ROWS = ('rows', 'size')
+
+# how each statistic of two cubes over different rows is combined,
+# the sums and their errors are added together by _group_sums
+_MERGE_STATISTICS = {'count': 'sum', 'size': 'sum', 'min': 'min', 'max': 'max'}
+
+# rows of the CSV file summarised at a time by build_cube_from_csv
+CHUNK_ROWS = 250_000
+
+
+def build_cube(lung_cancer_df: pd.DataFrame, dimensions=CUBE_DIMENSIONS,
+               measures=CUBE_MEASURES) -> pd.DataFrame:
+    """
+    Summarise the dataset in a single grouped pass into one cell for every
+    combination of the dimensions present in the data.
+
+    Missing dimension values are kept as their own cells so that rolling up
+    to fewer dimensions gives the same counts as grouping the full table.
+
+    Args:
+        lung_cancer_df (DataFrame): lung cancer data frame.
+        dimensions (list): categorical columns to group by.
+        measures (list): numeric columns to summarise.
+
+    Returns:
+        DataFrame: indexed by the dimensions, with a (measure, statistic)
+                   column for each measure and statistic, and the
+                   number of patients in ROWS.
+    """
+    grouped = lung_cancer_df.groupby(dimensions, observed=True, dropna=False)
+    cube = grouped[measures].agg(['count', 'min', 'max'])
+    groups = grouped.ngroup()
+    for measure in measures:
+        cube[(measure, 'sum')], cube[(measure, 'sum_error')] = _group_sums(
+            lung_cancer_df[measure], groups, len(cube))
+    cube = cube[[(measure, statistic) for measure in measures for statistic in CUBE_STATISTICS]]
+    cube[ROWS] = grouped.size()
+    return cube
+
+
+def _group_sums(values: pd.Series, groups: pd.Series, group_count: int) -> tuple:
+    """
+    The sum of the values of each group, correctly rounded with math.fsum,
+    and the rounding error of the sum. Adding up the sums and errors of the
+    parts of a group gives the sum of the whole group, however it was split.
+    Missing values are skipped.
+
+    Args:
+        values (Series): the values.
+        groups (Series): the group number of each value, see GroupBy.ngroup,
+                         missing for values in no group.
+        group_count (int): number of groups.
+
+    Returns:
+        ndarray: the sum of each group, in group number order.
+        ndarray: the rounding error of each sum.
+    """
+    values = values.to_numpy(dtype=np.float64)
+    groups = groups.fillna(-1).to_numpy(dtype=np.int64)
+    kept = ~np.isnan(values) & (groups >= 0)
+    values, groups = values[kept], groups[kept]
+    order = np.argsort(groups, kind='stable')
+    bounds = np.searchsorted(groups[order], np.arange(group_count + 1)).tolist()
+    # summed as Python floats, which math.fsum reads much faster than NumPy's
+    values = values[order].tolist()
+
+    sums = np.zeros(group_count)
+    errors = np.zeros(group_count)
+    for group in range(group_count):
+        part = values[bounds[group]:bounds[group + 1]]
+        sums[group] = total = math.fsum(part)
+        part.append(-total)
+        errors[group] = math.fsum(part)
+    return sums, errors
+
+
+def merge_cubes(cubes: list) -> pd.DataFrame:
+    """
+    Combine cubes built from separate parts of the dataset into the cube
+    of the whole: sums and counts are added, minima and maxima compared.
+
+    Args:
+        cubes (list): cubes from build_cube, over the same dimensions and measures.
+
+    Returns:
+        DataFrame: the merged cube, sorted by the dimensions.
+    """
+    combined = pd.concat(cubes)
+    grouped = combined.groupby(level=list(range(combined.index.nlevels)),
+                               observed=True, dropna=False)
+    return _merge(combined, grouped, list(combined.columns))
+
+
+def _merge(cube: pd.DataFrame, grouped, columns: list) -> pd.DataFrame:
+    """ The given columns of the cells of each group combined, see merge_cubes. """
+    statistics = {column: _MERGE_STATISTICS[column[1]] for column in columns
+                  if column[1] in _MERGE_STATISTICS}
+    merged = dict(grouped.agg(statistics).items()) if statistics else {}
+    groups = pd.concat([grouped.ngroup()] * 2)
+    for measure, statistic in columns:
+        if statistic == 'sum':
+            merged[(measure, 'sum')], merged[(measure, 'sum_error')] = _group_sums(
+                pd.concat([cube[(measure, 'sum')], cube[(measure, 'sum_error')]]),
+                groups, grouped.ngroups)
+    return pd.DataFrame(merged, index=grouped.size().index)[columns]
+
+
+@traced('load.build_cube_from_csv')
+def build_cube_from_csv(file_path: str, dimensions=CUBE_DIMENSIONS, measures=CUBE_MEASURES,
+                        chunk_size=CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Build the cube of a CSV file too large to load into memory, a chunk of
+    rows at a time. Only the cube, and a single chunk of the dimension and
+    measure columns, are held in memory.
+
+    The measures are read at full precision and every sum is correctly
+    rounded, so the results rolled up from the cube do not depend on the
+    chunk size, and match grouping the table loaded by load_lung_cancer_data
+    wherever pandas' own compensated sum is correctly rounded.
+
+    Args:
+        file_path (str): path of the CSV file.
+        dimensions (list): categorical columns to group by.
+        measures (list): numeric columns to summarise.
+        chunk_size (int): number of rows read at a time.
+
+    Returns:
+        DataFrame: the cube, see build_cube.
+    """
+    cube = None
+    chunks = pd.read_csv(file_path, sep=',', encoding='utf8', usecols=dimensions + measures,
+                         chunksize=chunk_size)
+    with chunks:
+        for chunk in chunks:
+            count('rows_read', len(chunk))
+            # merged as it goes, so memory is bounded by the number of cells
+            cube = append_to_cube(cube, chunk, dimensions, measures)
+    if cube is None:
+        raise ValueError(f"Cube: '{file_path}' has no rows")
+    return cube
+
+
+def append_to_cube(cube, lung_cancer_df: pd.DataFrame, dimensions=CUBE_DIMENSIONS,
+                   measures=CUBE_MEASURES) -> pd.DataFrame:
+    """
+    Add rows to a cube, in time proportional to the rows added and the
+    number of cells, rather than the rows already summarised.
+
+    Args:
+        cube (DataFrame): cube of the earlier rows, None for no rows.
+        lung_cancer_df (DataFrame): the rows to add.
+        dimensions (list): categorical columns the cube is grouped by.
+        measures (list): numeric columns the cube summarises.
+
+    Returns:
+        DataFrame: the cube of both, see build_cube.
+    """
+    partial = build_cube(lung_cancer_df, dimensions, measures)
+    cube = partial if cube is None else merge_cubes([cube, partial])
+    # the dimensions become categoricals, as when the cube is built from an optimised frame
+    cube.index = pd.MultiIndex.from_frame(cube.index.to_frame(index=False).astype('category'))
+    return cube
+
+
+def rollup(cube: pd.DataFrame, dimensions: list, measures: list, agg='mean') -> pd.DataFrame:
+    """
+    Aggregate the cube up to fewer dimensions.
+
+    Args:
+        cube (DataFrame): cube from build_cube.
+        dimensions (list): dimensions to keep, the rest are summed over.
+        measures (list): measures to aggregate.
+        agg (str): 'mean', 'sum', 'count', 'min' or 'max'.
+
+    Returns:
+        DataFrame: indexed by the dimensions with a column for each measure,
+                   equivalent to lung_cancer_df.groupby(dimensions)[measures].agg()
+    """
+    grouped = cube.groupby(level=dimensions, observed=True)
+    if agg == 'mean':
+        sums = _merge(cube, grouped, [(measure, 'sum') for measure in measures])
+        counts = grouped[[(measure, 'count') for measure in measures]].sum()
+        result = sums.droplevel(1, axis=1) / counts.droplevel(1, axis=1)
+    elif agg in ('sum', 'count'):
+        result = _merge(cube, grouped, [(measure, agg) for measure in measures])
+        result = result.droplevel(1, axis=1)
+    elif agg in ('min', 'max'):
+        result = getattr(grouped[[(measure, agg) for measure in measures]], agg)()
+        result = result.droplevel(1, axis=1)
+    else:
+        raise ValueError(f"Aggregation: '{agg}' can not be rolled up from the cube")
+    result.columns.name = None
+    return result
+
+
+def rollup_counts(cube: pd.DataFrame, dimensions: list) -> pd.Series:
+    """
+    Args:
+        cube (DataFrame): cube from build_cube.
+        dimensions (list): dimensions to keep, the rest are summed over.
+
+    Returns:
+        Series: the number of patients in each group, named 'count'.
+    """
+    counts = cube[ROWS].groupby(level=dimensions, observed=True).sum()
+    counts.name = 'count'
+    return counts
@@ -0,0 +1,266 @@
+"""
+    Approximate answers to the grouped means of extract_data_pd, from a
+    stratified random sample, for exploratory work on very large tables.
+
+    The sample is stratified on the grouping columns, so every group is
+    sampled, however rare. Within each stratum the rows are kept in a random
+    order and a sample of n rows is the first n of them, so a larger sample
+    extends a smaller one, and a sample as large as a stratum is the whole
+    stratum. Each estimate comes with its confidence interval and the number
+    of sampled rows it was computed from.
+
+    The sample of a frame is built once, in a single pass, and reused by
+    every later estimate grouped by the same columns. For a file larger than
+    memory, StratifiedSample.from_csv keeps a bounded reservoir of each
+    stratum, read a chunk of the file at a time.
+
+    Usage:
+        estimate_means(lung_cancer_df, ['Ethnicity', 'Stage'], 'Smoking_Pack_Years')
+        for estimates in refine_means(lung_cancer_df, ['Ethnicity', 'Stage'],
+                                      'Smoking_Pack_Years'):
+            print(estimates)
+"""
+import weakref
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from .aggregate_cache import COMPARISONS, frame_fingerprint
+from .aggregate_cube import CHUNK_ROWS
+from .instrumentation import count, traced
+
+# rows drawn from each stratum unless another sample size is asked for
+SAMPLE_SIZE = 1000
+
+# confidence level of the intervals unless another is asked for
+CONFIDENCE = 0.95
+
+# how many times larger each sample of refine_means is than the last
+REFINE_GROWTH = 4
+
+# (id of the DataFrame, grouping columns) -> (frame fingerprint, its StratifiedSample)
+_frame_samples = {}
+
+
+class StratifiedSample:
+    """
+    The rows of a table in a random order within each stratum,
+    a stratum being one combination of the grouping column values.
+    Rows missing a grouping value belong to no stratum.
+
+    The sample refers to the rows of a frame weakly, so the frame must be
+    kept while estimates are drawn from it.
+    """
+
+    def __init__(self, rows: pd.DataFrame, strata: list, population=None, seed=0):
+        """
+        Args:
+            rows (DataFrame): the rows to sample, which are not copied.
+            strata (list): the grouping columns.
+            population (Series): the number of rows in each stratum of the table,
+                                 when rows are only a sample of it, indexed like
+                                 rows.groupby(strata).size()
+            seed (int): seed of the random order.
+        """
+        # referred to weakly, so that a frame's sample does not keep the frame alive
+        self._rows = weakref.ref(rows)
+        self.strata = list(strata)
+        grouped = rows.groupby(self.strata, observed=True)
+        kept = grouped.size()
+        self.groups = kept.index
+        codes = grouped.ngroup().to_numpy()
+        if len(kept) < np.iinfo(np.int16).max:
+            # small integer codes are radix sorted
+            codes = codes.astype(np.int16)
+
+        # a random permutation, stably sorted by stratum, is in a random order within each
+        permutation = np.random.default_rng(seed).permutation(len(rows))
+        order = permutation[np.argsort(codes[permutation], kind='stable')]
+        self._order = order[codes[order] >= 0]
+        # rows of each stratum held, and where they start in the order
+        self.kept = kept.to_numpy()
+        self._starts = np.cumsum(self.kept) - self.kept
+        self.population = self.kept if population is None else \
+            population.reindex(self.groups, fill_value=0).to_numpy()
+        self._columns = {}
+
+    @classmethod
+    @traced('load.sample_csv')
+    def from_csv(cls, file_path: str, strata: list, columns: list, capacity=10 * SAMPLE_SIZE,
+                 chunk_size=CHUNK_ROWS, seed=0):
+        """
+        Sample a CSV file too large to load into memory, a chunk of rows at
+        a time. Each row is given a random key and each stratum keeps the
+        rows with the lowest keys, a uniform random reservoir of up to
+        capacity rows, so only the reservoirs and one chunk are held at once.
+
+        Args:
+            file_path (str): path of the CSV file.
+            strata (list): the grouping columns.
+            columns (list): the value and condition columns to keep.
+            capacity (int): the most rows kept of each stratum.
+            chunk_size (int): rows read at a time.
+            seed (int): seed of the random keys.
+
+        Returns:
+            StratifiedSample: the sample, estimates from which are exact
+                              for the strata with no more than capacity rows.
+        """
+        rng = np.random.default_rng(seed)
+        reservoirs = None
+        population = None
+        for chunk in pd.read_csv(file_path, sep=',', encoding='utf8',
+                                 usecols=list(dict.fromkeys(strata + columns)),
+                                 chunksize=chunk_size):
+            count('rows_read', len(chunk))
+            chunk['_key'] = rng.random(len(chunk))
+            sizes = chunk.groupby(strata).size()
+            population = sizes if population is None else population.add(sizes, fill_value=0)
+            if reservoirs is not None:
+                chunk = pd.concat([reservoirs, chunk], ignore_index=True)
+            reservoirs = chunk.sort_values('_key').groupby(strata).head(capacity)
+        if reservoirs is None:
+            raise ValueError(f"Sample: '{file_path}' has no rows")
+
+        rows = reservoirs.drop(columns='_key').reset_index(drop=True)
+        sample = cls(rows, strata, population.astype('int64'), seed)
+        # the reservoirs belong to the sample alone
+        sample._reservoirs = rows
+        return sample
+
+    def _column(self, column: str) -> np.ndarray:
+        values = self._columns.get(column)
+        if values is None:
+            rows = self._rows()
+            if rows is None:
+                raise ReferenceError(f"Sample: the frame sampled has been freed, "
+                                     f"keep a reference to it to estimate '{column}'")
+            values = self._columns[column] = rows[column].to_numpy()
+        return values
+
+    def _draw(self, start: int, stop: int) -> tuple:
+        """
+        Returns:
+            ndarray: positions of the start-th up to the stop-th row of each stratum.
+            ndarray: the stratum of each position.
+        """
+        counts = np.clip(self.kept - start, 0, stop - start)
+        firsts = self._starts + np.minimum(start, self.kept)
+        strata = np.repeat(np.arange(len(self.kept)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self._order[np.repeat(firsts, counts) + offsets], strata
+
+
+def get_sample(lung_cancer_df, strata: list) -> StratifiedSample:
+    """
+    Args:
+        lung_cancer_df (DataFrame): lung cancer data frame, or a StratifiedSample.
+        strata (list): the grouping columns.
+
+    Returns:
+        StratifiedSample: the sample of the frame stratified on the columns,
+                          built on first use and rebuilt when the frame's
+                          shape, columns or dtypes change.
+    """
+    if isinstance(lung_cancer_df, StratifiedSample):
+        if lung_cancer_df.strata != list(strata):
+            raise ValueError(f"Sample: stratified on {', '.join(lung_cancer_df.strata)}, "
+                             f"not {', '.join(strata)}")
+        return lung_cancer_df
+
+    key = (id(lung_cancer_df), tuple(strata))
+    fingerprint = frame_fingerprint(lung_cancer_df)
+    cached = _frame_samples.get(key)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    if cached is None:
+        weakref.finalize(lung_cancer_df, _frame_samples.pop, key, None)
+    sample = StratifiedSample(lung_cancer_df, strata)
+    _frame_samples[key] = (fingerprint, sample)
+    return sample
+
+
+def refine_means(lung_cancer_df, strata: list, value_column: str, where=None,
+                 sample_size=SAMPLE_SIZE, confidence=CONFIDENCE, growth=REFINE_GROWTH):
+    """
+    Estimate the mean of a column for each group, from successively larger
+    samples, each extending the one before, until every row of every stratum
+    is used and the estimates are exact. Only the newly drawn rows are read
+    at each step.
+
+    Args:
+        lung_cancer_df (DataFrame): lung cancer data frame, or a StratifiedSample.
+        strata (list): the grouping columns.
+        value_column (str): the column averaged.
+        where (list): optional row filters applied before averaging,
+                      (column, comparison, value) e.g. ('Blood_Pressure_Pulse', '>', 90)
+        sample_size (int): rows drawn from each stratum for the first estimates.
+        confidence (float): confidence level of the intervals.
+        growth (int): how many times larger each sample is than the last.
+
+    Yields:
+        DataFrame: indexed by group, the estimated mean in value_column,
+                   the 'lower' and 'upper' bounds of its confidence interval,
+                   the 'sample_size' of sampled rows it was computed from,
+                   and the 'population' of rows in the stratum.
+                   Groups with no sampled rows matching the filters are left out.
+    """
+    sample = get_sample(lung_cancer_df, strata)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    groups = len(sample.kept)
+    totals = np.zeros(groups)
+    squares = np.zeros(groups)
+    matched = np.zeros(groups, dtype=np.int64)
+    largest = int(sample.kept.max()) if groups else 0
+
+    drawn = 0
+    while True:
+        size = min(sample_size, largest)
+        positions, position_strata = sample._draw(drawn, size)
+        count('rows_sampled', len(positions))
+        values = sample._column(value_column)[positions].astype(np.float64)
+        keep = ~np.isnan(values)
+        for column, comparison, target in where or ():
+            keep &= COMPARISONS[comparison](sample._column(column)[positions], target)
+        values = values[keep]
+        position_strata = position_strata[keep]
+        totals += np.bincount(position_strata, weights=values, minlength=groups)
+        squares += np.bincount(position_strata, weights=values * values, minlength=groups)
+        matched += np.bincount(position_strata, minlength=groups)
+        drawn = size
+
+        yield _estimates(sample, value_column, totals, squares, matched,
+                         np.minimum(drawn, sample.kept), z)
+        if drawn >= largest:
+            return
+        sample_size *= growth
+
+
+def estimate_means(lung_cancer_df, strata: list, value_column: str, where=None,
+                   sample_size=SAMPLE_SIZE, confidence=CONFIDENCE) -> pd.DataFrame:
+    """
+    Estimate the mean of a column for each group from a sample of each
+    stratum, see refine_means.
+
+    Returns:
+        DataFrame: the estimates, their confidence intervals and sample sizes.
+    """
+    return next(refine_means(lung_cancer_df, strata, value_column, where,
+                             sample_size, confidence))
+
+
+def _estimates(sample: StratifiedSample, value_column: str, totals, squares, matched,
+               drawn, z: float) -> pd.DataFrame:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = totals / matched
+        variances = np.maximum(squares - matched * means * means, 0) / (matched - 1)
+        # the finite population correction, which is zero once a stratum is used up
+        corrections = np.maximum(1 - drawn / sample.population, 0)
+        margins = z * np.sqrt(variances / matched * corrections)
+    margins[corrections == 0] = 0
+
+    estimates = pd.DataFrame({value_column: means, 'lower': means - margins,
+                              'upper': means + margins, 'sample_size': matched,
+                              'population': sample.population}, index=sample.groups)
+    return estimates[matched > 0]
@@ -0,0 +1,352 @@
+"""
+    Run the csv and pandas analyses unattended, from a file of query specs.
+
+    The dataset is loaded once, along with its indexes and aggregate cube,
+    and shared by every query in the batch. Each spec is a JSON object:
+
+        {"analysis": "medical_history", "args": {"ethnicity": "asian"},
+         "output": "asian_history.csv"}
+
+    where args are the keyword arguments of the analysis, other than the data.
+    An output ending in .csv, .jsonl or .parquet receives the result data,
+    one ending in .png, .svg or .pdf the chart of the result, see CHARTS,
+    any other output receives the printed text. Without an output the text
+    is printed.
+
+    Usage:
+        python -m src.wrangling.batch_runner specs.jsonl --data Data/lung_cancer_data.csv
+        python -m src.wrangling.batch_runner specs.jsonl --trace trace.jsonl --profile batch.prof
+        python -m src.wrangling.batch_runner specs.jsonl --result-cache
+"""
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from . import extract_data_csv, instrumentation, result_cache
+from .columnar_cache import CACHE_DIR
+from .export_data import EXPORT_FORMATS, export_frame
+from .secondary_index import build_indexes, build_frame_indexes
+
+# analysis name -> (data source, whether the analysis returns its result rather than printing it)
+ANALYSES = {'demographic_info': ('csv', False),
+            'medical_history': ('csv', False),
+            'survival_treatment_details': ('csv', False),
+            'hypertension_patients': ('csv', False),
+            'patient_long_survival': ('pd', False),
+            'treatment_white_blood_count': ('pd', False),
+            'lung_tumor_data': ('pd', False),
+            'survival_blood_pressure': ('pd', False),
+            'treatment_for_ethnicity': ('pd', True),
+            'smoking_packs_cancer_stage': ('pd', True),
+            'blood_pressure_treatment': ('pd', True),
+            'insurer_treatment_data': ('pd', True)}
+
+# analyses whose result can be drawn -> the chart, see plot_data.CHARTS
+CHARTS = {'treatment_for_ethnicity': 'treatment_proportion_for_ethnicity',
+          'smoking_packs_cancer_stage': 'smoking_packs_cancer_stage',
+          'blood_pressure_treatment': 'blood_pressure_treatment',
+          'insurer_treatment_data': 'insurer_treatment_data'}
+
+# file extensions of the charts, as plot_data.CHART_FORMATS without importing matplotlib
+CHART_FORMATS = {'.png', '.svg', '.pdf'}
+
+# pandas analyses answered from the aggregate cube alone, without loading the table
+OUT_OF_CORE_ANALYSES = {'smoking_packs_cancer_stage', 'blood_pressure_treatment',
+                        'insurer_treatment_data'}
+
+# data loaded by each worker process, see _init_worker
+_worker_sources = None
+
+
+def load_specs(spec_path: str) -> list:
+    """
+    Args:
+        spec_path (str): a JSON list of specs, or a JSON lines file
+                         with one spec per line.
+
+    Returns:
+        list: the query specs, each checked against ANALYSES.
+    """
+    with open(spec_path, encoding='utf8') as fp:
+        text = fp.read()
+    if text.lstrip().startswith('['):
+        specs = json.loads(text)
+    else:
+        specs = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    for number, spec in enumerate(specs, 1):
+        if spec.get('analysis') not in ANALYSES:
+            raise ValueError(f"Spec {number}: analysis '{spec.get('analysis')}' not supported, "
+                             f"expected one of {', '.join(ANALYSES)}")
+        output = spec.get('output')
+        if output is not None and os.path.splitext(output)[1].lower() in CHART_FORMATS \
+                and spec['analysis'] not in CHARTS:
+            raise ValueError(f"Spec {number}: analysis '{spec['analysis']}' has no chart, "
+                             f"charts are drawn for {', '.join(CHARTS)}")
+    return specs
+
+
+def load_sources(file_path: str, specs: list, columnar=False, out_of_core=False) -> dict:
+    """
+    Load the dataset once for every spec in the batch, only in the forms
+    the specs need, with the indexes and cube used to answer them.
+
+    Args:
+        file_path (str): path of the CSV file.
+        specs (list): the query specs.
+        columnar (bool): hold the csv rows in a ColumnStore.
+        out_of_core (bool): only build the aggregate cube, a chunk of the file
+                            at a time, for files larger than memory.
+                            Limited to the OUT_OF_CORE_ANALYSES.
+
+    Returns:
+        dict: the loaded data, keyed by the argument name the analyses use.
+    """
+    needed = {ANALYSES[spec['analysis']][0] for spec in specs}
+    sources = {}
+    if 'csv' in needed:
+        data_path, file_name = os.path.split(file_path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            patient_headers, csv_reader = extract_data_csv.get_csv_data(
+                os.path.join(data_path, ''), file_name, columnar=columnar)
+        sources['csv'] = {'csv_reader': csv_reader, 'patient_headers': patient_headers,
+                          'indexes': build_indexes(csv_reader, patient_headers)}
+    if 'pd' in needed and out_of_core:
+        _check_out_of_core(specs)
+        from .aggregate_cube import build_cube_from_csv
+
+        sources['pd'] = {'lung_cancer_df': None, 'cube': build_cube_from_csv(file_path)}
+    elif 'pd' in needed:
+        # pandas is only imported by batches with pandas analyses
+        from . import extract_data_pd
+        from .aggregate_cube import build_cube
+
+        lung_cancer_df = extract_data_pd.load_lung_cancer_data(
+            file_path, cached=True, report=False)
+        sources['pd'] = {'lung_cancer_df': lung_cancer_df,
+                         'cube': build_cube(lung_cancer_df),
+                         'indexes': build_frame_indexes(lung_cancer_df)}
+    return sources
+
+
+def _check_out_of_core(specs: list):
+    unsupported = {spec['analysis'] for spec in specs
+                   if ANALYSES[spec['analysis']][0] == 'pd'} - OUT_OF_CORE_ANALYSES
+    if unsupported:
+        raise ValueError(f"Out of core: {', '.join(sorted(unsupported))} "
+                         f"can not be answered without the full table")
+
+
+def run_spec(spec: dict, sources: dict, output_dir=None) -> dict:
+    """
+    Run a single query spec against the loaded data.
+
+    Args:
+        spec (dict): the query spec.
+        sources (dict): the loaded data, see load_sources.
+        output_dir (str): directory relative outputs are written to.
+
+    Returns:
+        dict: the spec's name and analysis, the output written to, the printed
+              text, the error message of a failed query and the time taken.
+              A query whose value is not found has failed.
+    """
+    source, returns_result = ANALYSES[spec['analysis']]
+    if source == 'csv':
+        function = getattr(extract_data_csv, spec['analysis'])
+    else:
+        from . import extract_data_pd
+        function = getattr(extract_data_pd, spec['analysis'])
+    parameters = inspect.signature(function).parameters
+
+    # text is normalised as the prompts and the result cache normalise it,
+    # the csv analyses expect it casefolded
+    kwargs = {name: result_cache.normalise_argument(value)
+              if name in result_cache.NORMALISED_ARGUMENTS else value
+              for name, value in spec.get('args', {}).items()}
+    # pass along the shared data, indexes and cube, where the analysis accepts them
+    kwargs.update({name: value for name, value in sources[source].items()
+                   if name in parameters})
+    if 'plot' in parameters:
+        kwargs['plot'] = False
+
+    output = spec.get('output')
+    if output is not None and output_dir is not None:
+        output = os.path.join(output_dir, output)
+    extension = os.path.splitext(output)[1].lower() if output is not None else None
+    export = extension in EXPORT_FORMATS
+    if export and 'export_path' in parameters:
+        kwargs['export_path'] = output
+    chart = CHARTS.get(spec['analysis']) if extension in CHART_FORMATS else None
+
+    result = {'name': spec.get('name', spec['analysis']), 'analysis': spec['analysis'],
+              'output': output, 'text': '', 'error': None}
+    start = time.perf_counter()
+    text = io.StringIO()
+    try:
+        with instrumentation.span('batch.run_spec', spec=result['name'],
+                                  analysis=spec['analysis']), \
+                contextlib.redirect_stdout(text):
+            returned = function(**kwargs)
+            if isinstance(returned, str):
+                # the analyses return a message when a value is not found
+                raise _NotFound(returned)
+            if returned is None and (returns_result or not text.getvalue()):
+                # and nothing at all for a value they do not answer, e.g. 'q' to quit
+                raise _NotFound(_no_result_message(spec['analysis'], kwargs))
+            if chart is not None:
+                # matplotlib is only imported by batches drawing charts
+                from .userInterface.visualise.plot_data import render_chart
+                # the pie chart is titled with the ethnic group it was asked for
+                args = (kwargs['ethnicity'].title(), returned) \
+                    if 'ethnicity' in kwargs else (returned,)
+                render_chart(chart, output, *args)
+            elif returns_result and export:
+                export_frame(returned, output)
+            elif returns_result:
+                print(returned.to_markdown())
+        if output is not None and not export and chart is None:
+            with open(output, 'w', encoding='utf8') as fp:
+                fp.write(text.getvalue())
+    except _NotFound as error:
+        result['error'] = str(error)
+    except Exception as error:
+        result['error'] = f"{type(error).__name__}: {error}"
+    result['text'] = text.getvalue()
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+class _NotFound(Exception):
+    """ A query the analysis answered with a message, or nothing, rather than a result. """
+
+
+def _no_result_message(analysis: str, kwargs: dict) -> str:
+    name = next((name for name in result_cache.NORMALISED_ARGUMENTS if name in kwargs), None)
+    if name is None:
+        return f"Analysis: '{analysis}' has no result"
+    return f"{name.capitalize()}: '{kwargs[name]}' not found"
+
+
+def run_batch(specs: list, file_path: str, workers=None, output_dir=None,
+              columnar=False, trace_path=None, out_of_core=False,
+              result_cache_dir=None) -> list:
+    """
+    Run every spec, loading the dataset once.
+    With workers, the specs are shared out between worker processes,
+    each of which loads the dataset once.
+
+    Args:
+        specs (list): the query specs, see load_specs.
+        file_path (str): path of the CSV file.
+        workers (int): number of worker processes, the specs run
+                       one after another in this process when omitted.
+        output_dir (str): directory relative outputs are written to, created if needed.
+        columnar (bool): hold the csv rows in a ColumnStore.
+        trace_path (str): with workers, each worker appends the trace of its
+                          specs to this file, see instrumentation.enable.
+        out_of_core (bool): answer the pandas analyses from a cube built
+                            a chunk at a time, see load_sources.
+        result_cache_dir (str): with workers, each worker keeps its results in
+                                this result cache, see result_cache.enable.
+
+    Returns:
+        list: the result of each spec, in the order of the specs, see run_spec.
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    if out_of_core:
+        _check_out_of_core(specs)
+
+    if not workers or workers < 2:
+        sources = load_sources(file_path, specs, columnar, out_of_core)
+        return [run_spec(spec, sources, output_dir) for spec in specs]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(file_path, specs, columnar, trace_path,
+                                       out_of_core, result_cache_dir)) as executor:
+        return list(executor.map(_run_worker_spec, specs, [output_dir] * len(specs)))
+
+
+def _init_worker(file_path: str, specs: list, columnar: bool, trace_path=None,
+                 out_of_core=False, result_cache_dir=None):
+    global _worker_sources
+    if trace_path is not None:
+        instrumentation.enable(trace_path=trace_path)
+    if result_cache_dir is not None:
+        result_cache.enable(result_cache_dir)
+    _worker_sources = load_sources(file_path, specs, columnar, out_of_core)
+
+
+def _run_worker_spec(spec: dict, output_dir) -> dict:
+    return run_spec(spec, _worker_sources, output_dir)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m src.wrangling.batch_runner',
+        description="Run the lung cancer analyses from a file of query specs.")
+    parser.add_argument('specs', help="JSON or JSON lines file of query specs")
+    parser.add_argument('--data', default='Data/lung_cancer_data.csv',
+                        help="CSV file to analyse (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="run the specs in this many worker processes")
+    parser.add_argument('--output-dir', default=None,
+                        help="directory the spec outputs are written to")
+    parser.add_argument('--columnar', action='store_true',
+                        help="hold the csv rows in a column store")
+    parser.add_argument('--out-of-core', action='store_true',
+                        help="aggregate the file a chunk at a time, for files larger than memory")
+    parser.add_argument('--trace', default=None,
+                        help="append a JSON line of timings and row counts per query to this file")
+    parser.add_argument('--profile', default=None,
+                        help="write a cProfile of the batch to this file, "
+                             "not including worker processes")
+    parser.add_argument('--memory', action='store_true',
+                        help="with --trace, also record the peak allocation of each span")
+    parser.add_argument('--result-cache', nargs='?', const='', default=None, metavar='DIR',
+                        help="keep the query results on disk and reuse them on later runs, "
+                             "in DIR or the data directory's cache")
+    args = parser.parse_args(argv)
+
+    specs = load_specs(args.specs)
+    result_cache_dir = None
+    if args.result_cache is not None:
+        result_cache_dir = args.result_cache or os.path.join(
+            os.path.dirname(args.data), CACHE_DIR, 'results')
+        result_cache.enable(result_cache_dir)
+    if args.trace or args.profile:
+        instrumentation.enable(memory=args.memory, profile=args.profile is not None,
+                               trace_path=args.trace)
+    start = time.perf_counter()
+    try:
+        results = run_batch(specs, args.data, args.workers, args.output_dir, args.columnar,
+                            args.trace, args.out_of_core, result_cache_dir)
+    finally:
+        instrumentation.disable()
+    if args.profile:
+        instrumentation.dump_profile(args.profile)
+
+    failed = 0
+    for result in results:
+        if result['error'] is not None:
+            failed += 1
+            print(f"{result['name']}: failed - {result['error']}", file=sys.stderr)
+        elif result['output'] is not None:
+            print(f"{result['name']}: written to {result['output']} "
+                  f"({result['seconds']:.3f} s)")
+        else:
+            print(result['text'], end='')
+    print(f"{len(results) - failed} of {len(results)} queries succeeded "
+          f"in {time.perf_counter() - start:.2f} s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
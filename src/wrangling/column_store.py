@@ -0,0 +1,239 @@
+from array import array
+
+from .schema import INTEGER_COLUMNS, FLOAT_COLUMNS, CATEGORY_COLUMNS
+
+INTEGER = 'int'
+FLOAT = 'float'
+CATEGORY = 'category'
+
+# narrowest array typecodes, tried in order, for compacting the columns
+_INTEGER_TYPECODES = ['b', 'h', 'i', 'q']
+_CODE_TYPECODES = ['B', 'H', 'I']
+
+
+class ColumnStore:
+    """
+    Typed, column oriented copy of the CSV data.
+
+    Numeric columns are held in typed arrays and label columns are
+    dictionary encoded: an array of small integer codes plus the list
+    of labels the codes refer to. The values are converted once, when
+    the store is built, rather than on every scan of the rows.
+
+    Columns not declared in the schema are inferred from their values:
+    integer, then float, otherwise a dictionary encoded label.
+    """
+
+    def __init__(self, patient_headers: dict):
+        """
+        Args:
+            patient_headers (dict): mapping of column headers to their
+                                    respective column index.
+        """
+        self.patient_headers = patient_headers
+        self.num_rows = 0
+        # column name -> typed array of values, or of category codes
+        self.columns = {}
+        # column name -> category labels, indexed by category code
+        self.labels = {}
+        # column name -> INTEGER, FLOAT or CATEGORY
+        self.kinds = {}
+        # column name -> {label: code}, used whilst building the store
+        self._codes = {}
+
+    @classmethod
+    def from_rows(cls, patient_headers: dict, csv_reader):
+        """
+        Build a store from rows of CSV strings.
+        The rows are consumed one at a time so a stream may be passed
+        without the raw text ever being held in memory as a whole.
+
+        Args:
+            patient_headers (dict): mapping of column headers to their
+                                    respective column index.
+            csv_reader (iterable): rows of data.
+
+        Returns:
+            ColumnStore: the compacted, typed columns.
+        """
+        store = cls(patient_headers)
+        for record in csv_reader:
+            store.append(record)
+        store.compact()
+        return store
+
+    def append(self, record: list):
+        """
+        Convert and append a single row of CSV strings.
+
+        Args:
+            record (list): a single row of data.
+        """
+        if not self.kinds:
+            self._set_kinds(record)
+        for name, index in self.patient_headers.items():
+            self._append_value(name, record[index])
+        self.num_rows += 1
+
+    def _set_kinds(self, record: list):
+        for name, index in self.patient_headers.items():
+            if name in INTEGER_COLUMNS:
+                kind = INTEGER
+            elif name in FLOAT_COLUMNS:
+                kind = FLOAT
+            elif name in CATEGORY_COLUMNS:
+                kind = CATEGORY
+            else:
+                kind = _infer_kind(record[index])
+            self._new_column(name, kind)
+
+    def _new_column(self, name: str, kind: str):
+        self.kinds[name] = kind
+        if kind == INTEGER:
+            self.columns[name] = array('q')
+        elif kind == FLOAT:
+            self.columns[name] = array('d')
+        else:
+            self.columns[name] = array('I')
+            self.labels[name] = []
+            self._codes[name] = {}
+
+    def _append_value(self, name: str, value: str):
+        kind = self.kinds[name]
+        if kind == INTEGER:
+            try:
+                self.columns[name].append(int(value))
+                return
+            except ValueError:
+                self._promote(name, FLOAT)
+                kind = FLOAT
+        if kind == FLOAT:
+            try:
+                self.columns[name].append(float(value))
+                return
+            except ValueError:
+                self._promote(name, CATEGORY)
+        codes = self._codes[name]
+        code = codes.get(value)
+        if code is None:
+            code = len(self.labels[name])
+            codes[value] = code
+            self.labels[name].append(value)
+        self.columns[name].append(code)
+
+    def _promote(self, name: str, kind: str):
+        """
+        Widen a column whose values no longer fit its type.
+        Numbers that are re-encoded as labels keep their Python
+        string form rather than the original CSV text.
+        """
+        values = self.columns[name]
+        if kind == FLOAT:
+            self.kinds[name] = FLOAT
+            self.columns[name] = array('d', values)
+            return
+        self._new_column(name, CATEGORY)
+        for value in values:
+            self._append_value(name, str(value))
+
+    def compact(self):
+        """
+        Narrow each column to the smallest array type that holds its values
+        and release the label lookup used whilst building.
+        """
+        for name, values in self.columns.items():
+            kind = self.kinds[name]
+            if kind == FLOAT or len(values) == 0:
+                continue
+            if kind == INTEGER:
+                low, high = min(values), max(values)
+                typecodes = _INTEGER_TYPECODES
+            else:
+                low, high = 0, len(self.labels[name]) - 1
+                typecodes = _CODE_TYPECODES
+            for typecode in typecodes:
+                try:
+                    array(typecode, [low, high])
+                except OverflowError:
+                    continue
+                if typecode != values.typecode:
+                    self.columns[name] = array(typecode, values)
+                break
+        self._codes = {}
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __iter__(self):
+        """ Decoded rows, in the original column order. """
+        for row in range(self.num_rows):
+            yield [self.value(name, row) for name in self.patient_headers]
+
+    def column(self, name: str) -> array:
+        """
+        Args:
+            name (str): column header.
+
+        Returns:
+            array: the typed values, or the category codes of a label column.
+        """
+        return self.columns[name]
+
+    def categories(self, name: str) -> list:
+        """
+        Args:
+            name (str): label column header.
+
+        Returns:
+            list: the labels, indexed by category code.
+        """
+        return self.labels[name]
+
+    def value(self, name: str, row: int):
+        """
+        Args:
+            name (str): column header.
+            row (int): row number.
+
+        Returns:
+            the decoded value of the column at the given row.
+        """
+        value = self.columns[name][row]
+        if self.kinds[name] == CATEGORY:
+            return self.labels[name][value]
+        return value
+
+    def extract(self, columns: list, row: int) -> dict:
+        """
+        The columnar equivalent of display_data.extract_data
+
+        Args:
+            columns (list): the specific columns to extract from the row.
+            row (int): row number.
+
+        Returns:
+            dict: of values mapped to keys from the specified columns.
+        """
+        return {column: self.value(column, row) for column in columns}
+
+    def nbytes(self) -> int:
+        """
+        Returns:
+            int: approximate memory footprint of the column data, in bytes.
+        """
+        total = 0
+        for values in self.columns.values():
+            total += values.itemsize * len(values)
+        for labels in self.labels.values():
+            total += sum(len(label) for label in labels)
+        return total
+
+
+def _infer_kind(value: str) -> str:
+    for kind, convert in [(INTEGER, int), (FLOAT, float)]:
+        try:
+            convert(value)
+        except ValueError:
+            continue
+        return kind
+    return CATEGORY
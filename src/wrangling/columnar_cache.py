@@ -0,0 +1,161 @@
+import os
+import pickle
+import shutil
+
+# directory, inside the data directory, where the cached copies are written
+CACHE_DIR = ".cache"
+
+
+def cache_file_path(file_path: str, extension: str, cache_dir=None) -> str:
+    """
+    Path of the cached copy of a source file.
+    The source's size and modification time are part of the name, so an
+    edited source no longer matches its old copy.
+    """
+    stat = os.stat(file_path)
+    directory, file_name = os.path.split(file_path)
+    if cache_dir is None:
+        cache_dir = os.path.join(directory, CACHE_DIR)
+    return os.path.join(cache_dir,
+                        f"{file_name}.{stat.st_size}-{stat.st_mtime_ns}.{extension}")
+
+
+def write_cache(cache_path: str, write):
+    """
+    Write a new cached copy, replacing any stale copies of the same source.
+    The copy is written to a temporary file first so that a reader never
+    sees a partially written cache. When several processes write the same
+    copy at once, the first to finish is kept and the others discard theirs.
+
+    Args:
+        cache_path (str): path of the new cached copy.
+        write (function): called with the temporary path to write to,
+                          which may be created as a file or a directory.
+    """
+    cache_dir, cache_name = os.path.split(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    source_name, _, extension = cache_name.rsplit('.', 2)
+    for old_name in os.listdir(cache_dir):
+        old_parts = old_name.rsplit('.', 2)
+        if len(old_parts) == 3 and old_parts[0] == source_name and \
+                old_parts[2] == extension and old_name != cache_name:
+            _remove_path(os.path.join(cache_dir, old_name))
+        elif len(old_parts) == 3 and old_parts[2] == 'tmp' and \
+                _is_abandoned(old_parts[0], old_parts[1], source_name, extension):
+            _remove_path(os.path.join(cache_dir, old_name))
+
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        write(temp_path)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        _remove_path(temp_path)
+        # a directory can not replace one another process has just written
+        if not os.path.exists(cache_path):
+            raise
+    except BaseException:
+        _remove_path(temp_path)
+        raise
+
+
+def _is_abandoned(temp_target: str, pid: str, source_name: str, extension: str) -> bool:
+    """ Whether a temporary copy of the source was left behind by a process that has exited. """
+    target_parts = temp_target.rsplit('.', 2)
+    if len(target_parts) != 3 or target_parts[0] != source_name or \
+            target_parts[2] != extension or not pid.isdigit():
+        return False
+    return not _process_running(int(pid))
+
+
+def _process_running(pid: int) -> bool:
+    if os.name != 'posix':
+        # without a portable check, another process's copy is left alone
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _remove_path(path: str):
+    """ Remove a cached copy, a file or a directory, that may already be gone. """
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def read_csv_cached(file_path: str, columns=None, cache_dir=None, **read_csv_kwargs):
+    """
+    Drop-in replacement for pd.read_csv that keeps a Feather copy of the file.
+
+    The first load parses the CSV and writes the copy; later loads read the
+    typed, columnar copy instead, only reading the requested columns.
+    If pyarrow is not installed the CSV is parsed every time.
+
+    Args:
+        file_path (str): path of the CSV file.
+        columns (list): optional columns to read, all columns when omitted.
+        cache_dir (str): where to keep the copy, defaults to a '.cache'
+                         directory alongside the CSV file.
+        read_csv_kwargs: passed to pd.read_csv on the first load.
+                         They are not part of the cache key.
+
+    Returns:
+        DataFrame: the CSV data.
+    """
+    import pandas as pd
+
+    try:
+        import pyarrow  # noqa: F401 - required by pandas for Feather files
+    except ImportError:
+        return pd.read_csv(file_path, usecols=columns, **read_csv_kwargs)
+
+    cache_path = cache_file_path(file_path, "feather", cache_dir)
+    if os.path.exists(cache_path):
+        return pd.read_feather(cache_path, columns=columns)
+
+    lung_cancer_df = pd.read_csv(file_path, **read_csv_kwargs)
+    write_cache(cache_path, lung_cancer_df.to_feather)
+    if columns is not None:
+        return lung_cancer_df.loc[:, columns]
+    return lung_cancer_df
+
+
+def load_column_store_cached(file_path: str, build, cache_dir=None):
+    """
+    Keep a binary copy of the ColumnStore built from a CSV file.
+    The store's typed arrays pickle as raw buffers, so reloading the copy
+    avoids parsing and converting the CSV text.
+
+    Args:
+        file_path (str): path of the CSV file.
+        build (function): called with no arguments on the first load,
+                          returns (patient_headers, ColumnStore)
+        cache_dir (str): where to keep the copy, defaults to a '.cache'
+                         directory alongside the CSV file.
+
+    Returns:
+        tuple: a dictionary of column headers mapped
+               to their respective column index.
+               the ColumnStore.
+    """
+    cache_path = cache_file_path(file_path, "columns", cache_dir)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as fp:
+            store = pickle.load(fp)
+        return store.patient_headers, store
+
+    patient_headers, store = build()
+    if store is not None:
+        def write(path):
+            with open(path, 'wb') as fp:
+                pickle.dump(store, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        write_cache(cache_path, write)
+    return patient_headers, store
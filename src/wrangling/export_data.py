@@ -0,0 +1,147 @@
+import csv
+import json
+import os
+from itertools import islice
+
+# formats that results can be exported to, by file extension
+EXPORT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.parquet': 'parquet'}
+
+# rows converted and written at a time
+CHUNK_ROWS = 65536
+
+# size of the write buffer of the text formats
+BUFFER_BYTES = 1 << 20
+
+
+def export_format(file_path: str, fmt=None) -> str:
+    """
+    Args:
+        file_path (str): path of the export file.
+        fmt (str): 'csv', 'jsonl' or 'parquet',
+                   taken from the file extension when omitted.
+
+    Returns:
+        str: the export format.
+    """
+    if fmt is None:
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension not in EXPORT_FORMATS:
+            raise ValueError(f"Export: cannot tell the format of '{file_path}', "
+                             f"expected one of {', '.join(EXPORT_FORMATS)}")
+        fmt = EXPORT_FORMATS[extension]
+    if fmt not in EXPORT_FORMATS.values():
+        raise ValueError(f"Export: format '{fmt}' not supported")
+    return fmt
+
+
+def export_rows(columns: list, rows, file_path: str, fmt=None, chunk_size=CHUNK_ROWS) -> int:
+    """
+    Write query results to a file, a chunk of rows at a time,
+    so the results never need to be held in memory.
+
+    Args:
+        columns (list): string names of the columns.
+        rows (iterable): a tuple of values per row in the order of the columns,
+                         or a dictionary of the columns per row.
+        file_path (str): path of the export file, replaced if it exists.
+        fmt (str): 'csv', 'jsonl' or 'parquet', see export_format.
+        chunk_size (int): number of rows per write.
+
+    Returns:
+        int: the number of rows written.
+    """
+    fmt = export_format(file_path, fmt)
+    rows = (row.values() if isinstance(row, dict) else row for row in rows)
+    chunks = iter(lambda: list(islice(rows, chunk_size)), [])
+
+    if fmt == 'parquet':
+        return _write_parquet(columns, chunks, file_path)
+
+    written = 0
+    with open(file_path, 'w', encoding='utf8', newline='', buffering=BUFFER_BYTES) as fp:
+        if fmt == 'csv':
+            writer = csv.writer(fp)
+            writer.writerow(columns)
+            for chunk in chunks:
+                writer.writerows(chunk)
+                written += len(chunk)
+        else:
+            encode = json.JSONEncoder(default=_json_default).encode
+            for chunk in chunks:
+                fp.write("".join([encode(dict(zip(columns, row))) + "\n" for row in chunk]))
+                written += len(chunk)
+    return written
+
+
+def export_frame(lung_cancer_df, file_path: str, fmt=None, chunk_size=CHUNK_ROWS,
+                 index=None) -> int:
+    """
+    Write a DataFrame, or Series, result to a file a chunk of rows at a time,
+    see export_rows.
+
+    Args:
+        lung_cancer_df (DataFrame): the result to export.
+        file_path (str): path of the export file, replaced if it exists.
+        fmt (str): 'csv', 'jsonl' or 'parquet', see export_format.
+        chunk_size (int): number of rows per write.
+        index (bool): write the index levels as columns, by default only
+                      when the index is not the plain row numbers, e.g. the
+                      group keys of an aggregate.
+
+    Returns:
+        int: the number of rows written.
+    """
+    import pandas as pd
+
+    if isinstance(lung_cancer_df, pd.Series):
+        lung_cancer_df = lung_cancer_df.to_frame()
+    if index is None:
+        index = not isinstance(lung_cancer_df.index, pd.RangeIndex)
+    if index:
+        lung_cancer_df = lung_cancer_df.reset_index()
+
+    columns = [str(column) for column in lung_cancer_df.columns]
+    return export_rows(columns, _frame_rows(lung_cancer_df, chunk_size),
+                       file_path, fmt, chunk_size)
+
+
+def _frame_rows(lung_cancer_df, chunk_size: int):
+    """ The rows of a frame as tuples of Python values, converted a chunk at a time. """
+    for start in range(0, len(lung_cancer_df), chunk_size):
+        chunk = lung_cancer_df.iloc[start:start + chunk_size].astype(object)
+        yield from chunk.itertuples(index=False, name=None)
+
+
+def _json_default(value):
+    # NumPy scalars, e.g. from a DataFrame, are not JSON serializable
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Export: {type(value).__name__} is not JSON serializable")
+
+
+def _write_parquet(columns: list, chunks, file_path: str) -> int:
+    """ Write each chunk of rows as a row group of a Parquet file. """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as error:
+        raise ImportError("Export: the parquet format requires pyarrow") from error
+
+    written = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pydict(
+                {column: list(values) for column, values in zip(columns, zip(*chunk))})
+            if writer is None:
+                writer = pq.ParquetWriter(file_path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+            written += len(chunk)
+        if writer is None:
+            # no rows, an empty file of string columns still records the columns
+            writer = pq.ParquetWriter(
+                file_path, pa.schema([(column, pa.string()) for column in columns]))
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
@@ -1,5 +1,16 @@
 import csv
+import os
+from itertools import islice
 
+from . import instrumentation
+from .column_store import ColumnStore
+from .columnar_cache import load_column_store_cached
+from .parallel_scan import SharedCsvSource
+from .partitioned_dataset import PartitionedDataset
+from .export_data import export_rows
+from .query_engine import Query, execute_rows, execute_store, execute_indexed_rows, \
+    index_rows, iter_rows, iter_store
+from .result_cache import cached_result, register_source
 from .userInterface.table.display_data import display_extracted_data, extract_data
 from .userInterface.user_selections import check_for_quit, check_for_quit
 
@@ -7,28 +18,112 @@ patient_headers = []
 csv_reader = None
 
 
-def get_csv_data(data_path: str, file_name: str) -> tuple:
+class CsvRows(list):
+    """
+        The rows of a CSV file. Unlike a plain list it can be weakly
+        referenced, so the result cache can register where it was read from.
+    """
+
+
+@instrumentation.traced('load.get_csv_data')
+def get_csv_data(data_path: str, file_name: str, stream=False, chunk_size=None,
+                 columnar=False, index_patients=False, cache=False, workers=None) -> tuple:
     """
         Provides CSV data and
         a mapping of column headings to index.
 
+        Args:
+        data_path (str): directory containing the dataset.
+        file_name (str): name of the CSV file (with extension).
+        stream (bool): lazily read the rows instead of loading
+                       the entire file into memory.
+        chunk_size (int): when streaming, yield lists of up to this
+                          many rows rather than single rows.
+        columnar (bool): convert the rows into a typed ColumnStore
+                         as they are read.
+        cache (bool): with columnar, keep a binary copy of the ColumnStore
+                      and reload it while the CSV file is unchanged.
+        workers (int): scan the file in parallel with this many processes,
+                       see parallel_scan.SharedCsvSource.
+                       A file_name with wildcards, e.g. 'lung_cancer_*.csv',
+                       loads every matching file as a PartitionedDataset.
+        index_patients (bool): also build and return a Patient_ID index,
+                               see build_patient_index.
+                               Not available when streaming.
+
         Returns:
             tuple: a list of the CSV data rows
+                   (a generator of rows/row batches when streaming,
+                   a ColumnStore when columnar,
+                   a SharedCsvSource with workers,
+                   or a PartitionedDataset for a file_name with wildcards)
                    a dictionary of column headers mapped
                    to their respective column index.
+                   the Patient_ID index, only when index_patients is set.
     """
+    if index_patients:
+        patient_headers, csv_reader = get_csv_data(
+            data_path, file_name, columnar=columnar, cache=cache)
+        if csv_reader is None:
+            return None, None, None
+        return patient_headers, csv_reader, build_patient_index(csv_reader, patient_headers)
+
     patient_headers = None
     csv_reader = None
 
     if check_for_quit(file_name):
         return None, None
+    if any(wildcard in file_name for wildcard in '*?['):
+        try:
+            csv_reader = PartitionedDataset(data_path, file_name, workers)
+        except FileNotFoundError as e:
+            print("Ensure the filename has been entered correctly")
+            print(e)
+            return None, None
+        print(f"\nDataset headers, {len(csv_reader.file_paths)} files matching {file_name}:")
+        print("----------------------------------")
+        print("\t\n".join(csv_reader.patient_headers))
+        return csv_reader.patient_headers, csv_reader
+    if workers:
+        try:
+            csv_reader = SharedCsvSource(data_path+file_name, workers)
+        except FileNotFoundError as e:
+            print("Ensure the filename has been entered correctly")
+            print(e)
+            return None, None
+        print(f"\nDataset headers, {file_name}:")
+        print("----------------------------------")
+        print("\t\n".join(csv_reader.patient_headers))
+        return csv_reader.patient_headers, csv_reader
+    if columnar and cache:
+        try:
+            patient_headers, csv_reader = load_column_store_cached(
+                data_path+file_name,
+                lambda: get_csv_data(data_path, file_name, columnar=True))
+        except FileNotFoundError as e:
+            print("Ensure the filename has been entered correctly")
+            print(e)
+            return None, None
+        if csv_reader is not None:
+            # typed values, kept apart from the results of the raw rows
+            register_source(csv_reader, [data_path+file_name], columnar=True)
+        return patient_headers, csv_reader
+    if columnar:
+        patient_headers, csv_reader = stream_csv_data(data_path, file_name)
+        if csv_reader is None:
+            return None, None
+        csv_reader = ColumnStore.from_rows(patient_headers, csv_reader)
+        register_source(csv_reader, [data_path+file_name], columnar=True)
+        return patient_headers, csv_reader
+    if stream or chunk_size:
+        return stream_csv_data(data_path, file_name, chunk_size)
     try:
         with open(data_path+file_name, 'r', encoding='utf8', newline='') as fp:
             ''' turn the csv reader into a list containing the entire dataset
                 so that we only have to open the file and use the file object
                 once.
             '''
-            csv_reader = list(csv.reader(fp.readlines(), delimiter=','))
+            csv_reader = CsvRows(csv.reader(fp.readlines(), delimiter=','))
             ''' using a list allows traversal as many times as needed.
                 Since this is no longer an iterator that is consumed once,
                 remove the header row from the list
@@ -38,6 +133,9 @@ def get_csv_data(data_path: str, file_name: str) -> tuple:
                 from the header row
             '''
             patient_headers = {v: i for i, v in enumerate(patient_headers)}
+            register_source(csv_reader, [data_path+file_name])
+            instrumentation.count('bytes_read', os.fstat(fp.fileno()).st_size)
+            instrumentation.count('rows_read', len(csv_reader))
 
             # development purposes only
             print(f"\nDataset headers, {file_name}:")
@@ -50,15 +148,274 @@ def get_csv_data(data_path: str, file_name: str) -> tuple:
         return patient_headers, csv_reader
 
 
-def demographic_info(patient_id: str, csv_reader: list, patient_headers: dict):
+def stream_csv_data(data_path: str, file_name: str, chunk_size=None) -> tuple:
+    """
+        Provides a lazy reader over the CSV data and
+        a mapping of column headings to index.
+
+        Only the header row is read up front. The rows are read from
+        the file as the generator is consumed, so at most one row
+        (or one chunk of rows) is held in memory at a time.
+        The generator can only be traversed once.
+
+        Args:
+        data_path (str): directory containing the dataset.
+        file_name (str): name of the CSV file (with extension).
+        chunk_size (int): yield lists of up to this many rows
+                          rather than single rows.
+
+        Returns:
+            tuple: a dictionary of column headers mapped
+                   to their respective column index.
+                   a generator of rows or row batches.
+    """
+    try:
+        fp = open(data_path+file_name, 'r', encoding='utf8', newline='')
+    except FileNotFoundError as e:
+        print("Ensure the filename has been entered correctly")
+        print(e)
+        return None, None
+
+    reader = csv.reader(fp, delimiter=',')
+    patient_headers = {v: i for i, v in enumerate(next(reader, []))}
+
+    print(f"\nDataset headers, {file_name}:")
+    print("----------------------------------")
+    print("\t\n".join(patient_headers))
+
+    return patient_headers, _read_rows(fp, reader, chunk_size)
+
+
+def _read_rows(fp, reader, chunk_size=None):
+    """
+        Generator over the remaining rows of an open CSV file.
+        The file is closed once the rows are exhausted
+        or the generator is discarded.
+
+        Args:
+        fp (file): the open CSV file.
+        reader (csv.reader): reader positioned after the header row.
+        chunk_size (int): yield lists of up to this many rows.
+    """
+    with fp:
+        try:
+            if not chunk_size:
+                yield from reader
+                return
+            while True:
+                chunk = list(islice(reader, chunk_size))
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            if instrumentation.enabled():
+                # the rows after the header, and the bytes the file has been read up to
+                instrumentation.count('rows_read', max(reader.line_num - 1, 0))
+                instrumentation.count('bytes_read', fp.buffer.tell())
+
+
+def _iter_records(csv_reader):
+    """
+        Iterate over single rows, regardless of whether csv_reader
+        is a list of rows, a stream of rows or a stream of row batches.
+
+        Args:
+        csv_reader (iterable): rows or batches of rows.
+    """
+    for item in csv_reader:
+        if item and isinstance(item[0], list):
+            # a batch of rows from a chunked stream
+            yield from item
+        else:
+            yield item
+
+
+def build_patient_index(csv_reader, patient_headers: dict) -> dict:
+    """
+        Map each Patient_ID to the position of its row, so that
+        a patient can be looked up without scanning the dataset.
+
+        Args:
+        csv_reader (list): rows of data, or a ColumnStore.
+        patient_headers (dict): mapping of column headers to their respective
+                                column index.
+
+        Returns:
+            dict: integer patient ID mapped to the row number.
+                  The first row is kept if an ID is repeated.
+    """
+    patient_index = {}
+    if isinstance(csv_reader, ColumnStore):
+        patient_ids = csv_reader.column('Patient_ID')
+    else:
+        id_column = patient_headers['Patient_ID']
+        patient_ids = (int(record[id_column]) for record in csv_reader)
+    for row, patient_id in enumerate(patient_ids):
+        patient_index.setdefault(patient_id, row)
+    return patient_index
+
+
+@instrumentation.traced('query.run_query')
+@cached_result('csv_reader', ignore=('patient_headers', 'indexes'))
+def run_query(query: Query, csv_reader, patient_headers: dict, indexes=None,
+              count=False):
+    """
+        Run a query over any of the supported data sources, using the
+        fastest path available: the secondary indexes when every condition
+        is indexed, otherwise a compiled scan of the rows.
+        Only the rows selected by the query's order and limit are extracted.
+        With the result cache enabled, the results of data loaded by
+        get_csv_data are kept between sessions, see result_cache.
+
+        Args:
+        query (Query): the columns, conditions, order and row limit.
+        csv_reader (iterable): rows of data, a stream of rows or row batches,
+                               a ColumnStore, a SharedCsvSource
+                               or a PartitionedDataset.
+        patient_headers (dict): mapping of column headers to their respective
+                                column index.
+        indexes (dict): optional secondary indexes from build_indexes.
+        count (bool): also return the number of matching rows, counted
+                      without extracting them.
+
+        Returns:
+            list: a dictionary of the query columns for each selected row,
+                  in the original row order unless the query has an order_by.
+            int: only when count is set, the number of matching rows.
+    """
+    if isinstance(csv_reader, (SharedCsvSource, PartitionedDataset)):
+        return csv_reader.scan(query, count)
+
+    rows = index_rows(query, indexes)
+    if isinstance(csv_reader, ColumnStore):
+        return execute_store(query, csv_reader, rows, count)
+    if rows is not None:
+        return execute_indexed_rows(query, rows, csv_reader, patient_headers, count)
+    return execute_rows(query, _iter_records(csv_reader), patient_headers, count)
+
+
+def iter_query(query: Query, csv_reader, patient_headers: dict, indexes=None):
+    """
+        Lazily run a query over any of the supported data sources, see run_query.
+        Without an order, and over a stream of rows, the results are
+        produced in constant memory. Over a SharedCsvSource or
+        PartitionedDataset they are produced a partition at a time.
+
+        Returns:
+            iterator: a tuple of the query column values for each selected row.
+    """
+    if isinstance(csv_reader, (SharedCsvSource, PartitionedDataset)):
+        return (tuple(record.values()) for record in csv_reader.iter_scan(query))
+
+    rows = index_rows(query, indexes)
+    if isinstance(csv_reader, ColumnStore):
+        return iter_store(query, csv_reader, rows)
+    if rows is not None:
+        return iter_rows(query, csv_reader, patient_headers, rows)
+    return iter_rows(query, _iter_records(csv_reader), patient_headers)
+
+
+@instrumentation.traced('export.export_query')
+def export_query(query: Query, csv_reader, patient_headers: dict, file_path: str,
+                 fmt=None, indexes=None) -> int:
+    """
+        Write the results of a query to a CSV, JSONL or Parquet file,
+        streamed from the data source a chunk at a time, see export_rows.
+
+        Args:
+        query (Query): the columns, conditions, order and row limit.
+        csv_reader (iterable): rows of data, a stream of rows or row batches,
+                               a ColumnStore, a SharedCsvSource
+                               or a PartitionedDataset.
+        patient_headers (dict): mapping of column headers to their respective
+                                column index.
+        file_path (str): path of the export file.
+        fmt (str): 'csv', 'jsonl' or 'parquet', taken from the file extension when omitted.
+        indexes (dict): optional secondary indexes from build_indexes.
+
+        Returns:
+            int: the number of rows written.
+    """
+    return export_rows(query.columns, iter_query(query, csv_reader, patient_headers, indexes),
+                       file_path, fmt)
+
+
+def _lookup_demographics(patient_ids, columns: list, csv_reader,
+                         patient_headers: dict, patient_index=None) -> dict:
+    """
+        Resolve patient IDs to their demographic records.
+        Uses the Patient_ID index when given, otherwise a single scan
+        of the rows which stops once every ID has been found.
+        Patient IDs are expected to be unique.
+
+        Returns:
+            dict: integer patient ID mapped to a record of the columns.
+                  IDs that were not found are left out.
+    """
+    wanted = {int(patient_id) for patient_id in patient_ids}
+    found = {}
+    if patient_index is not None:
+        for patient_id in wanted:
+            row = patient_index.get(patient_id)
+            if row is None:
+                continue
+            if isinstance(csv_reader, ColumnStore):
+                found[patient_id] = csv_reader.extract(columns, row)
+            else:
+                found[patient_id] = extract_data(
+                    columns, csv_reader[row], patient_headers)
+        return found
+
+    query = Query(['Patient_ID'] + columns,
+                  where=[('Patient_ID', 'in', wanted, 'int')], limit=len(wanted))
+    for record in run_query(query, csv_reader, patient_headers):
+        found.setdefault(int(record.pop('Patient_ID')), record)
+    return found
+
+
+@instrumentation.traced()
+def demographic_info_batch(patient_ids: list, csv_reader, patient_headers: dict,
+                           patient_index=None) -> dict:
+    """
+        Retrieve the demographic info for many patients in one call.
+
+        Args:
+        patient_ids (list): patient ID numbers.
+        csv_reader (iterable): rows of data, a stream of rows or row batches,
+                               a ColumnStore, a SharedCsvSource
+                               or a PartitionedDataset.
+        patient_headers (dict): mapping of column headers to their respective
+                                column index.
+        patient_index (dict): optional Patient_ID index from build_patient_index.
+
+        Returns:
+            dict: integer patient ID mapped to a dictionary of
+                  Age, Gender, Smoking_History and Ethnicity.
+                  IDs that were not found are left out.
+    """
+    columns = ['Age', 'Gender', 'Smoking_History', 'Ethnicity']
+    return _lookup_demographics(patient_ids, columns, csv_reader,
+                                patient_headers, patient_index)
+
+
+@instrumentation.traced()
+def demographic_info(patient_id: str, csv_reader: list, patient_headers: dict,
+                     patient_index=None):
     """
         Displays a table of data for a given patient ID.
 
         Args:
         patient_id (int): patient ID number.
-        csv_reader (list): rows of data
+        csv_reader (iterable): rows of data, a stream of rows or row batches,
+                               a ColumnStore, a SharedCsvSource
+                               or a PartitionedDataset.
         patient_headers (dict): mapping of column headers to their respective
                                 column index.
+        patient_index (dict): optional Patient_ID index from build_patient_index,
+                              avoids scanning the rows.
+
+        Returns:
+            str: a message when the patient ID is not found.
     """
     # contains the specific values from the columns, mapped to their respective key headings.
     demographic_info = {}
@@ -67,94 +424,148 @@ def demographic_info(patient_id: str, csv_reader: list, patient_headers: dict):
     if check_for_quit(patient_id):
         return
 
-    for record in csv_reader:
-        if int(record[patient_headers['Patient_ID']]) == int(patient_id):
-            for column in columns:
-                ''' look up the row index from the column heading string
-                    and assign the value in the row to the dictionary,
-                    providing the heading string as a key
-                '''
-                demographic_info[column] = record[patient_headers[column]]
-
-    if (len(demographic_info) > 0):
-        print(f"Demographic info for patient ID: {patient_id}")
-        display_extracted_data(columns, [demographic_info])
-    else:
-        print("Patient ID not found!")
+    found = _lookup_demographics([patient_id], columns, csv_reader,
+                                 patient_headers, patient_index)
+    if found:
+        demographic_info = found[int(patient_id)]
 
+    if not demographic_info:
+        return "Patient ID not found!"
+    print(f"Demographic info for patient ID: {patient_id}")
+    display_extracted_data(columns, [demographic_info])
 
-def medical_history(ethnicity: str, csv_reader: list, patient_headers: dict):
+
+@instrumentation.traced()
+def medical_history(ethnicity: str, csv_reader: list, patient_headers: dict,
+                    indexes=None, order_by=None, descending=False,
+                    export_path=None):
     """
         Displays a table of data for a given patient ethnicity.
 
         Args:
         ethnicity (string): patient ethnicity e.g 'asian'.
-        csv_reader (list): rows of data
+        csv_reader (iterable): rows of data, a stream of rows or row batches,
+                               a ColumnStore, a SharedCsvSource
+                               or a PartitionedDataset.
         patient_headers (dict): mapping of column headers to their respective
                                 column index.
+        indexes (dict): optional secondary indexes from build_indexes,
+                        used instead of scanning the rows.
+        order_by (str): optional column to show the top records by.
+        descending (bool): show the largest order_by values first.
+        export_path (str): write every matching record to this CSV, JSONL or
+                           Parquet file, instead of displaying them.
+
+        Returns:
+            str: a message when no patient is of the ethnicity.
     """
-    medical_history = []
     columns = ['Family_History', 'Comorbidity_Diabetes',
                'Comorbidity_Kidney_Disease', 'Haemoglobin_Level']
 
     if check_for_quit(ethnicity):
         return
 
-    for record in csv_reader:
-        if ethnicity in record[patient_headers['Ethnicity']].casefold():
-            medical_history.append(extract_data(
-                columns, record, patient_headers))
+    query = Query(columns, where=[('Ethnicity', 'contains', ethnicity, None)],
+                  limit=20, order_by=order_by, descending=descending)
+    if export_path is not None:
+        _export_all(query, csv_reader, patient_headers, export_path, indexes)
+        return
+    medical_history, total = run_query(query, csv_reader, patient_headers, indexes,
+                                       count=True)
+    if not total:
+        return f"Ethnicity: '{ethnicity.capitalize()}' not found"
+
     print(f"Records for patients of {ethnicity.capitalize()} ethnicity:")
     display_extracted_data(columns, medical_history, limit_rows=20)
+    _print_shown(medical_history, total)
 
 
-def survival_treatment_details(survival_months: int, csv_reader: list, patient_headers: dict):
+@instrumentation.traced()
+def survival_treatment_details(survival_months: int, csv_reader: list, patient_headers: dict,
+                               indexes=None, order_by=None, descending=False,
+                               export_path=None):
     """
         Displays a table of data for a given survival duration (months).
 
         Args:
         survival_months (int): patient survival.
-        csv_reader (list): rows of data
+        csv_reader (iterable): rows of data, a stream of rows or row batches,
+                               a ColumnStore, a SharedCsvSource
+                               or a PartitionedDataset.
         patient_headers (dict): mapping of column headers to their respective
                                 column index.
+        indexes (dict): optional secondary indexes from build_indexes,
+                        used instead of scanning the rows.
+        order_by (str): optional column to show the top records by.
+        descending (bool): show the largest order_by values first.
+        export_path (str): write every matching record to this CSV, JSONL or
+                           Parquet file, instead of displaying them.
     """
-    long_term = []
     columns = ['Age', 'Tumor_Size_mm', 'Tumor_Location', 'Stage']
 
-    for record in csv_reader:
-        if int(record[patient_headers['Survival_Months']]) > survival_months:
-            long_term.append(
-                extract_data(columns, record, patient_headers)
-            )
+    query = Query(columns, where=[('Survival_Months', '>', survival_months, 'int')],
+                  limit=50, order_by=order_by, descending=descending)
+    if export_path is not None:
+        _export_all(query, csv_reader, patient_headers, export_path, indexes)
+        return
+    long_term, total = run_query(query, csv_reader, patient_headers, indexes, count=True)
 
     print(
         f"Patient records for survival greater than {survival_months} months on treatment:\n")
     display_extracted_data(columns, long_term)
+    _print_shown(long_term, total)
 
 
-def hypertension_patients(diastolic_target: float, csv_reader: list, patient_headers: dict):
+@instrumentation.traced()
+def hypertension_patients(diastolic_target: float, csv_reader: list, patient_headers: dict,
+                          indexes=None, order_by=None, descending=False,
+                          export_path=None):
     """
         Displays a table of data for a hypertensive patients.
 
         Args:
         diastolic_target (float): any patient below this target will be filtered out.
-        csv_reader (list): rows of data
+        csv_reader (iterable): rows of data, a stream of rows or row batches,
+                               a ColumnStore, a SharedCsvSource
+                               or a PartitionedDataset.
         patient_headers (dict): mapping of column headers to their respective
                                 column index.
+        indexes (dict): optional secondary indexes from build_indexes,
+                        used instead of scanning the rows.
+        order_by (str): optional column to show the top records by.
+        descending (bool): show the largest order_by values first.
+        export_path (str): write every matching record to this CSV, JSONL or
+                           Parquet file, instead of displaying them.
     """
-    treatment_records = []
     columns = ['Treatment', 'Insurance_Type',
                'Performance_Status', 'Comorbidity_Chronic_Lung_Disease']
 
-    for record in csv_reader:
-        # is the patient hypertensive or blood pressure above 140
-        if record[patient_headers['Comorbidity_Hypertension']] or \
-                record[patient_headers['Blood_Pressure_Diastolic']] > diastolic_target:
-            treatment_records.append(
-                extract_data(columns, record, patient_headers)
-            )
+    # is the patient hypertensive or blood pressure above the target
+    query = Query(columns, where=[('Comorbidity_Hypertension', '==', 'Yes', None),
+                                  ('Blood_Pressure_Diastolic', '>', diastolic_target, 'float')],
+                  match='any', limit=50, order_by=order_by, descending=descending)
+    if export_path is not None:
+        _export_all(query, csv_reader, patient_headers, export_path, indexes)
+        return
+    treatment_records, total = run_query(query, csv_reader, patient_headers, indexes,
+                                         count=True)
 
     print(
         f"Treatment records for patients with diastolic blood pressure above {diastolic_target} target or hypertension:\n")
 
     display_extracted_data(columns, treatment_records)
+    _print_shown(treatment_records, total)
+
+
+def _export_all(query: Query, csv_reader, patient_headers: dict, export_path: str,
+                indexes=None):
+    """ Export every matching record, the display limit does not apply. """
+    query.limit = None
+    written = export_query(query, csv_reader, patient_headers, export_path, indexes=indexes)
+    print(f"{written} records exported to {export_path}")
+
+
+def _print_shown(records: list, total: int):
+    """ Tell the user when only some of the matching records were displayed. """
+    if len(records) < total:
+        print(f"Showing {len(records)} of {total} matching records.")
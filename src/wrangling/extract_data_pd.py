@@ -1,6 +1,18 @@
+import os
+from itertools import chain
+
 import pandas as pd
 import numpy as np
-from src.wrangling.userInterface.visualise.plot_data import plot_smoking_packs_cancer_stage
+from src.wrangling import instrumentation
+from src.wrangling.aggregate_cache import cached_aggregate
+from src.wrangling.approximate import CONFIDENCE, SAMPLE_SIZE, refine_means
+from src.wrangling.aggregate_cube import rollup, rollup_counts
+from src.wrangling.columnar_cache import read_csv_cached
+from src.wrangling.export_data import export_frame
+from src.wrangling.partitioned_dataset import PartitionedDataset
+from src.wrangling.result_cache import cached_result, register_source
+from src.wrangling.schema import INTEGER_COLUMNS, FLOAT_COLUMNS, CATEGORY_COLUMNS, \
+    BOOLEAN_PREFIX, BOOLEAN_VALUES
 from src.wrangling.userInterface.user_selections import check_for_quit
 
 
@@ -9,7 +21,110 @@ def _capitalise_input(user_value: str) -> str:
     return " ".join(word.capitalize() for word in value_split)
 
 
-def patient_long_survival(ethnicity: str, lung_cancer_df: pd.DataFrame):
+def optimise_dtypes(lung_cancer_df: pd.DataFrame, downcast_floats=False) -> pd.DataFrame:
+    """
+    Apply the declared schema to a DataFrame read with the default dtypes:
+        - label columns become categoricals.
+        - integer measurements are downcast to the smallest integer type.
+        - real measurements are downcast to float32, only with downcast_floats.
+        - the Comorbidity_* flags become booleans.
+
+    Columns missing from the frame, or not in the schema, are left as they are.
+
+    Args:
+        lung_cancer_df (DataFrame): lung cancer data frame.
+        downcast_floats (bool): float32 halves the memory of the real
+                                measurements, at the cost of precision:
+                                the averages then differ from those of
+                                the full precision values.
+
+    Returns:
+        DataFrame: a new frame with the optimised dtypes.
+    """
+    optimised = {}
+    for column in lung_cancer_df.columns:
+        values = lung_cancer_df[column]
+        if column in CATEGORY_COLUMNS:
+            values = values.astype('category')
+        elif column in INTEGER_COLUMNS and values.notna().all():
+            values = pd.to_numeric(values, downcast='integer')
+        elif column in FLOAT_COLUMNS and downcast_floats:
+            values = pd.to_numeric(values, downcast='float')
+        elif column.startswith(BOOLEAN_PREFIX) and values.isin(list(BOOLEAN_VALUES)).all():
+            values = values.map(BOOLEAN_VALUES).astype(bool)
+        optimised[column] = values
+    return pd.DataFrame(optimised)
+
+
+@instrumentation.traced('load.load_lung_cancer_data')
+def load_lung_cancer_data(file_path: str, downcast_floats=False, cached=False,
+                          report=True) -> pd.DataFrame:
+    """
+    The canonical way to load the lung cancer dataset,
+    with the declared schema applied, see optimise_dtypes.
+
+    Args:
+        file_path (str): path of the CSV file.
+        downcast_floats (bool): store the real measurements as float32,
+                                see optimise_dtypes.
+        cached (bool): load through the Feather cache, see read_csv_cached.
+        report (bool): print the memory used before and after optimising.
+
+    Returns:
+        DataFrame: lung cancer data frame. With the result cache enabled,
+                   the results of the analyses on it are kept between
+                   sessions, see result_cache.
+    """
+    if cached:
+        lung_cancer_df = read_csv_cached(file_path, encoding='utf8')
+    else:
+        lung_cancer_df = pd.read_csv(file_path, sep=',', encoding='utf8')
+        instrumentation.count('bytes_read', os.path.getsize(file_path))
+    instrumentation.count('rows_read', len(lung_cancer_df))
+
+    optimised_df = optimise_dtypes(lung_cancer_df, downcast_floats)
+    # results computed from the frame can be kept by the result cache
+    register_source(optimised_df, [file_path], downcast_floats=downcast_floats)
+
+    if report:
+        before = lung_cancer_df.memory_usage(deep=True).sum()
+        after = optimised_df.memory_usage(deep=True).sum()
+        print(f"Memory usage: {before / 1e6:.2f} MB -> {after / 1e6:.2f} MB "
+              f"({(before - after) / 1e6:.2f} MB saved, {(1 - after / before):.0%})")
+    return optimised_df
+
+
+@instrumentation.traced()
+@cached_result('lung_cancer_df', normalise=('ethnicity',))
+def long_survival_treatments(ethnicity: str, lung_cancer_df: pd.DataFrame,
+                             survival_months=100) -> pd.Series:
+    """
+    The top three treatments of long term survivors of a given ethnicity.
+
+    Args:
+        ethnicity (str): case-insensitive ethnic group.
+        lung_cancer_df (DataFrame): lung cancer Pandas DataFrame.
+        survival_months (int): only patients surviving longer than this are counted.
+
+    Returns:
+        Series: patient counts of the top three treatments.
+
+    Raises:
+        ValueError: when no patient of the ethnic group survived that long.
+    """
+    ethnicity = _capitalise_input(ethnicity)
+    # treatment counts of long term survivors, for every ethnic group at once
+    long_term_treatments = cached_aggregate(
+        lung_cancer_df, ['Ethnicity'], 'Treatment', 'value_counts',
+        where=('Survival_Months', '>', survival_months))
+
+    if ethnicity not in long_term_treatments.index.unique(level='Ethnicity'):
+        raise ValueError(f"Ethnicity: '{ethnicity}' not found")
+    return long_term_treatments.loc[ethnicity].head(3)
+
+
+@instrumentation.traced()
+def patient_long_survival(ethnicity: str, lung_cancer_df: pd.DataFrame, export_path=None):
     """
     Print the top three treatments for patients of a given
     ethnicity.
@@ -20,101 +135,346 @@ def patient_long_survival(ethnicity: str, lung_cancer_df: pd.DataFrame):
         ethnicity (str): case-insensitive ethnic group.
 
         lung_cancer_df (DataFrame): lung cancer Pandas DataFrame.
+        export_path (str): write the result to this CSV, JSONL or Parquet file
+                           instead of printing it.
     """
     if check_for_quit(ethnicity):
         return
-    ethnicity = _capitalise_input(ethnicity)
     survival_months = 100
-    long_term_df = lung_cancer_df.loc[lung_cancer_df.Survival_Months > survival_months, [
-        'Treatment', 'Survival_Months', 'Ethnicity']]
+    try:
+        top_treatments = long_survival_treatments(ethnicity, lung_cancer_df, survival_months)
+    except ValueError as error:
+        return str(error)
 
-    long_term_ethnic_groups = long_term_df.groupby('Ethnicity')
+    if export_path is not None:
+        _export_result(top_treatments, export_path)
+        return
 
     print(
-        f"Top three treatments for {ethnicity} group - Surival > {survival_months} months")
-    print(long_term_ethnic_groups.get_group(
-        ethnicity).Treatment.value_counts().head(3).to_markdown())
+        f"Top three treatments for {_capitalise_input(ethnicity)} group - Surival > {survival_months} months")
+    print(top_treatments.to_markdown())
 
 
-def treatment_white_blood_count(ethnicity: str, treatment: str, lung_cancer_df: pd.DataFrame):
+@instrumentation.traced()
+@cached_result('lung_cancer_df', normalise=('ethnicity', 'treatment'))
+def white_blood_count_mean(ethnicity: str, treatment: str, lung_cancer_df: pd.DataFrame) -> float:
     """
-    Print the average white blood cell count for each treatment type
-    given a certain ethnicity.
+    The average white blood cell count of a treatment in an ethnic group.
 
     Args:
         ethnicity (str): case-insensitive ethnic group.
+        treatment (str): case-insensitive treatment type.
         lung_cancer_df (DataFrame): lung cancer Pandas DataFrame.
+
+    Returns:
+        float: mean white blood cell count.
+
+    Raises:
+        ValueError: when the treatment, or the ethnic group, is not found.
     """
-    if check_for_quit(ethnicity):
-        return
-    treatments = lung_cancer_df.Treatment.unique().tolist()
+    treatments = cached_aggregate(
+        lung_cancer_df, ['Treatment'], None, 'size').index.tolist()
     ethnicity = _capitalise_input(ethnicity)
     treatment = _capitalise_input(treatment)
 
     if treatment not in treatments:
-        return f"Treatment: '{treatment}' not found."
+        raise ValueError(f"Treatment: '{treatment}' not found.")
+
+    white_blood_means = cached_aggregate(
+        lung_cancer_df, ['Ethnicity', 'Treatment'], 'White_Blood_Cell_Count', 'mean')
+    if (ethnicity, treatment) not in white_blood_means.index:
+        raise ValueError(f"Ethnicity: '{ethnicity}' not found.")
+    return float(white_blood_means.loc[(ethnicity, treatment)])
+
+
+@instrumentation.traced()
+def white_blood_count_estimate(ethnicity: str, treatment: str, lung_cancer_df,
+                               sample_size=SAMPLE_SIZE, confidence=CONFIDENCE, refine=False):
+    """
+    Estimate the average white blood cell count of a treatment in an ethnic
+    group from a sample of its patients, see approximate.refine_means.
+
+    Args:
+        ethnicity (str): case-insensitive ethnic group.
+        treatment (str): case-insensitive treatment type.
+        lung_cancer_df (DataFrame): lung cancer Pandas DataFrame, or a
+                                    StratifiedSample on Ethnicity and Treatment.
+        sample_size (int): patients sampled from the group.
+        confidence (float): confidence level of the interval.
+        refine (bool): estimate from successively larger samples, up to the exact mean.
 
-    white_blood_df = lung_cancer_df.groupby('Ethnicity')
-    ethnic_group_treatment = white_blood_df.get_group(
-        ethnicity).groupby('Treatment')
+    Returns:
+        Series: the estimated White_Blood_Cell_Count, the lower and upper
+                bounds of its confidence interval, the sample_size used and
+                the population of the group.
+                With refine, an iterator of such Series, the last of which is exact.
+
+    Raises:
+        ValueError: when the treatment, or the ethnic group, is not found.
+    """
+    ethnicity = _capitalise_input(ethnicity)
+    treatment = _capitalise_input(treatment)
+    estimates = refine_means(lung_cancer_df, ['Ethnicity', 'Treatment'], 'White_Blood_Cell_Count',
+                             sample_size=sample_size, confidence=confidence)
+    first = next(estimates)
+
+    if treatment not in first.index.unique(level='Treatment'):
+        raise ValueError(f"Treatment: '{treatment}' not found.")
+    if (ethnicity, treatment) not in first.index:
+        raise ValueError(f"Ethnicity: '{ethnicity}' not found.")
+    results = (estimate.loc[(ethnicity, treatment)] for estimate in chain([first], estimates))
+    return results if refine else next(results)
+
+
+@instrumentation.traced()
+def treatment_white_blood_count(ethnicity: str, treatment: str, lung_cancer_df: pd.DataFrame,
+                                sample_size=None, refine=False):
+    """
+    Print the average white blood cell count for each treatment type
+    given a certain ethnicity.
+
+    Args:
+        ethnicity (str): case-insensitive ethnic group.
+        lung_cancer_df (DataFrame): lung cancer Pandas DataFrame.
+        sample_size (int): print an estimate from this many sampled patients
+                           instead, see white_blood_count_estimate.
+        refine (bool): with a sample_size, print estimates from successively
+                       larger samples, up to the exact mean.
+    """
+    if check_for_quit(ethnicity):
+        return
+    try:
+        if sample_size is None:
+            white_blood_mean = white_blood_count_mean(ethnicity, treatment, lung_cancer_df)
+        else:
+            estimates = white_blood_count_estimate(ethnicity, treatment, lung_cancer_df,
+                                                   sample_size, refine=refine)
+    except ValueError as error:
+        return str(error)
 
     print(
-        f"Average white blood cell count for {treatment} in {ethnicity} ethnic group")
+        f"Average white blood cell count for {_capitalise_input(treatment)} in "
+        f"{_capitalise_input(ethnicity)} ethnic group")
 
-    print(ethnic_group_treatment.get_group(
-        treatment).White_Blood_Cell_Count.mean())
+    if sample_size is None:
+        print(white_blood_mean)
+        return
+    for estimate in (estimates if refine else [estimates]):
+        print(f"{estimate['White_Blood_Cell_Count']:.4f} ({CONFIDENCE:.0%} confidence interval "
+              f"{estimate['lower']:.4f} to {estimate['upper']:.4f}, "
+              f"{estimate['sample_size']:.0f} of {estimate['population']:.0f} patients)")
+
+
+@instrumentation.traced()
+@cached_result('lung_cancer_df', ignore=('indexes',))
+def lung_tumor_smoking(lung_cancer_df: pd.DataFrame, pulse: int, tumor_size_mm: float,
+                       indexes=None) -> pd.Series:
+    """
+    The average smoking pack years for each tumor location and
+    treatment, for patients over a pulse and under a tumor size.
 
+    Args:
+        lung_cancer_df (DataFrame): lung cancer Pandas DataFrame, or a PartitionedDataset
+                                    of which only the files that can hold such
+                                    patients are read.
+        pulse (int): only patients with a pulse above this are included.
+        tumor_size_mm (float): only patients with a tumor smaller than this are included.
+        indexes (dict): optional sorted indexes from build_frame_indexes,
+                        used instead of comparing every row.
 
-def lung_tumor_data(lung_cancer_df: pd.DataFrame, pulse: int, tumor_size_mm: float):
-    # Filter by pulse > 90 and tumor size < 15.0, keeping only the columns we need.
-    lung_tumor_df = lung_cancer_df.loc[(lung_cancer_df.Blood_Pressure_Pulse > pulse) & (lung_cancer_df.Tumor_Size_mm < tumor_size_mm),
-                                       ['Smoking_Pack_Years', 'Treatment', 'Tumor_Location']].reset_index()
+    Returns:
+        Series: mean smoking pack years indexed by tumor location and treatment.
+    """
+    columns = ['Smoking_Pack_Years', 'Treatment', 'Tumor_Location']
+    if isinstance(lung_cancer_df, PartitionedDataset):
+        lung_cancer_df = optimise_dtypes(lung_cancer_df.load_frame(
+            [('Blood_Pressure_Pulse', '>', pulse, 'float'),
+             ('Tumor_Size_mm', '<', tumor_size_mm, 'float')],
+            columns=columns + ['Blood_Pressure_Pulse', 'Tumor_Size_mm']))
+        indexes = None
+    if indexes and 'Blood_Pressure_Pulse' in indexes and 'Tumor_Size_mm' in indexes:
+        # intersect the row positions from both range lookups, keeping the original row order
+        high_pulse = np.zeros(len(lung_cancer_df), dtype=bool)
+        high_pulse[indexes['Blood_Pressure_Pulse'].greater_than(pulse)] = True
+        small_tumor = indexes['Tumor_Size_mm'].less_than(tumor_size_mm)
+        positions = np.sort(small_tumor[high_pulse[small_tumor]])
+        lung_tumor_df = lung_cancer_df.iloc[positions].loc[:, columns].reset_index()
+    else:
+        # Filter by pulse > 90 and tumor size < 15.0, keeping only the columns we need.
+        lung_tumor_df = lung_cancer_df.loc[(lung_cancer_df.Blood_Pressure_Pulse > pulse) & (lung_cancer_df.Tumor_Size_mm < tumor_size_mm),
+                                           columns].reset_index()
 
     # group by tumor location and treatment type, finding the average smoking packs for each group
-    lung_tumor_df = lung_tumor_df.groupby(["Tumor_Location", "Treatment"])\
+    return lung_tumor_df.groupby(["Tumor_Location", "Treatment"], observed=True)\
         .Smoking_Pack_Years.mean()
 
+
+@instrumentation.traced()
+def lung_tumor_smoking_estimate(lung_cancer_df, pulse: int, tumor_size_mm: float,
+                                sample_size=SAMPLE_SIZE, confidence=CONFIDENCE, refine=False):
+    """
+    Estimate the average smoking pack years for each tumor location and
+    treatment, for patients over a pulse and under a tumor size, from a
+    sample of each group, see approximate.refine_means.
+
+    Args:
+        lung_cancer_df (DataFrame): lung cancer Pandas DataFrame, or a
+                                    StratifiedSample on Tumor_Location and Treatment.
+        pulse (int): only patients with a pulse above this are included.
+        tumor_size_mm (float): only patients with a tumor smaller than this are included.
+        sample_size (int): patients sampled from each group, before filtering.
+        confidence (float): confidence level of the intervals.
+        refine (bool): estimate from successively larger samples, up to the exact means.
+
+    Returns:
+        DataFrame: indexed by tumor location and treatment, the estimated
+                   Smoking_Pack_Years, the lower and upper bounds of its
+                   confidence interval, the sample_size used and the
+                   population of the group.
+                   With refine, an iterator of such DataFrames, the last of which is exact.
+    """
+    estimates = refine_means(lung_cancer_df, ['Tumor_Location', 'Treatment'], 'Smoking_Pack_Years',
+                             [('Blood_Pressure_Pulse', '>', pulse),
+                              ('Tumor_Size_mm', '<', tumor_size_mm)],
+                             sample_size, confidence)
+    return estimates if refine else next(estimates)
+
+
+@instrumentation.traced()
+def lung_tumor_data(lung_cancer_df: pd.DataFrame, pulse: int, tumor_size_mm: float,
+                    indexes=None, export_path=None, sample_size=None, refine=False):
+    """
+    Print the average smoking pack years for each tumor location and
+    treatment, for patients over a pulse and under a tumor size.
+
+    Args:
+        lung_cancer_df (DataFrame): lung cancer Pandas DataFrame, or a PartitionedDataset.
+        pulse (int): only patients with a pulse above this are included.
+        tumor_size_mm (float): only patients with a tumor smaller than this are included.
+        indexes (dict): optional sorted indexes from build_frame_indexes,
+                        used instead of comparing every row.
+        export_path (str): write the result to this CSV, JSONL or Parquet file
+                           instead of printing it.
+        sample_size (int): print estimates from this many sampled patients
+                           of each group instead, see lung_tumor_smoking_estimate.
+                           Not available for a PartitionedDataset.
+        refine (bool): with a sample_size, print estimates from successively
+                       larger samples, up to the exact means.
+                       Only the last is exported.
+    """
+    if sample_size is not None:
+        if isinstance(lung_cancer_df, PartitionedDataset):
+            raise ValueError("Partition: estimates need a DataFrame, "
+                             "see approximate.StratifiedSample.from_csv")
+        estimates = lung_tumor_smoking_estimate(lung_cancer_df, pulse, tumor_size_mm,
+                                                sample_size, refine=refine)
+        for estimate in (estimates if refine else [estimates]):
+            if export_path is None:
+                print(f"Estimated average number of smoking packs for patients with pulse over "
+                      f"{pulse} and tumor size under {tumor_size_mm} mm, from up to "
+                      f"{estimate['sample_size'].max()} patients per group, with "
+                      f"{CONFIDENCE:.0%} confidence intervals")
+                print(estimate)
+        if export_path is not None:
+            _export_result(estimate, export_path)
+        return
+
+    lung_tumor_df = lung_tumor_smoking(lung_cancer_df, pulse, tumor_size_mm, indexes)
+    if export_path is not None:
+        _export_result(lung_tumor_df, export_path)
+        return
+
     print(
         f"Average numnber of smoking packs for patients with pulse over {pulse} and tumor size over {tumor_size_mm} mm")
     print(lung_tumor_df)
 
 
-def survival_blood_pressure(gender: str, lung_cancer_df: pd.DataFrame):
+@instrumentation.traced()
+@cached_result('lung_cancer_df', ignore=('cube',), normalise=('gender',))
+def gender_survival_blood_pressure(gender: str, lung_cancer_df: pd.DataFrame,
+                                   cube=None) -> pd.DataFrame:
     """
-    Pretty print average survival duration and blood pressure metrics
-    for each treatment at each cancer stage, based on gender.
+    Average survival duration and blood pressure metrics
+    for each treatment at each cancer stage, for a gender.
 
     Args:
-        gender (str): user-specified gender
+        gender (str): case-insensitive gender.
         lung_cancer_df (DataFrame): lung cancer data frame.
+        cube (DataFrame): optional aggregate cube from build_cube,
+                          rolled up instead of grouping the full table.
+
+    Returns:
+        DataFrame: a row of means for each treatment and stage.
+
+    Raises:
+        ValueError: when the gender is not found.
     """
-    if check_for_quit(gender):
-        return
     gender = _capitalise_input(gender)
-    if gender not in lung_cancer_df.Gender.unique():
-        return f"Gender: '{gender}' not found"
 
     ''' Group by gender, treatment, and cancer stage.
     Then, find the average survival duration and blood pressure levels
     for each cancer stage.
+    The aggregate for every gender is cached, so later calls
+    for other genders are a lookup.
+    '''
+    survival_columns = ['Survival_Months',
+                        'Blood_Pressure_Diastolic', 'Blood_Pressure_Systolic']
+    if cube is not None:
+        survival_cancer_df = rollup(
+            cube, ['Gender', 'Treatment', 'Stage'], survival_columns)
+    else:
+        survival_cancer_df = cached_aggregate(
+            lung_cancer_df, ['Gender', 'Treatment', 'Stage'], survival_columns, 'mean')
+
+    if gender not in survival_cancer_df.index.unique(level='Gender'):
+        raise ValueError(f"Gender: '{gender}' not found")
+
+    ''' select the rows for the specified gender, which also drops the gender level.
     Finally, reset the index to remove the Dataframe levels
     and provide a sequential index.
     '''
-    survival_cancer_df = lung_cancer_df.groupby(['Gender', 'Treatment', 'Stage'])[
-        ['Survival_Months', 'Blood_Pressure_Diastolic', 'Blood_Pressure_Systolic']].mean().reset_index()
+    return survival_cancer_df.loc[gender].reset_index()
 
-    # filter out rows for specified gender
-    survival_cancer_gender_df = survival_cancer_df.loc[survival_cancer_df.Gender == gender, :]
 
-    # drop the gender column
-    survival_cancer_gender_df.drop(["Gender"], inplace=True, axis=1)
+@instrumentation.traced()
+def survival_blood_pressure(gender: str, lung_cancer_df: pd.DataFrame, cube=None,
+                            export_path=None):
+    """
+    Pretty print average survival duration and blood pressure metrics
+    for each treatment at each cancer stage, based on gender.
+
+    Args:
+        gender (str): user-specified gender
+        lung_cancer_df (DataFrame): lung cancer data frame.
+        cube (DataFrame): optional aggregate cube from build_cube,
+                          rolled up instead of grouping the full table.
+        export_path (str): write the result to this CSV, JSONL or Parquet file
+                           instead of printing it.
+    """
+    if check_for_quit(gender):
+        return
+    try:
+        survival_cancer_gender_df = gender_survival_blood_pressure(gender, lung_cancer_df, cube)
+    except ValueError as error:
+        return str(error)
+
+    if export_path is not None:
+        _export_result(survival_cancer_gender_df, export_path)
+        return
 
     print(
-        f"average survival duration and blood pressure metrics for {gender}s")
+        f"average survival duration and blood pressure metrics for {_capitalise_input(gender)}s")
     # pretty print in markdown table style, remove the numerical index column
     print(survival_cancer_gender_df.to_markdown(index=False))
 
 
+def _export_result(result, export_path: str):
+    written = export_frame(result, export_path)
+    print(f"{written} rows exported to {export_path}")
+
+
+@instrumentation.traced()
+@cached_result('lung_cancer_df', normalise=('ethnicity',))
 def treatment_for_ethnicity(ethnicity: str, lung_cancer_df: pd.DataFrame) -> tuple:
     """
         Used to provide input to a pie chart.
@@ -126,81 +486,164 @@ def treatment_for_ethnicity(ethnicity: str, lung_cancer_df: pd.DataFrame) -> tup
         Returns:
             Series : a series of treatment counts
                       indexed by treatment type
+
+        Raises:
+            ValueError: when the ethnic group is not found.
     """
     if check_for_quit(ethnicity):
         return
 
     ethnicity = _capitalise_input(ethnicity)
-    grp = lung_cancer_df.groupby('Ethnicity')
-    grp = grp.get_group(ethnicity)
 
-    # create a Series of value counts of each treatment
-    treatment_counts_series = grp.Treatment.value_counts()
+    # value counts of each treatment, counted for every ethnic group at once
+    treatment_counts = cached_aggregate(
+        lung_cancer_df, ['Ethnicity'], 'Treatment', 'value_counts')
+    if ethnicity not in treatment_counts.index.unique(level='Ethnicity'):
+        raise ValueError(f"Ethnicity: '{ethnicity}' not found")
+
+    return treatment_counts.loc[ethnicity]
+
+
+@instrumentation.traced()
+@cached_result('lung_cancer_df', ignore=('cube',))
+def smoking_packs_by_stage(lung_cancer_df: pd.DataFrame, cube=None) -> pd.DataFrame:
+    """
+    The average smoking packs at each cancer stage for each ethnic group.
+
+    Args:
+        lung_cancer_df (DataFrame): DataFrame to wrangle, None with a cube.
+        cube (DataFrame): optional aggregate cube from build_cube,
+                          rolled up instead of grouping the full table.
+                          For files larger than memory, see build_cube_from_csv.
 
-    return treatment_counts_series
+    Returns:
+        DataFrame: average smoking pack for each cancer stage in each
+                   ethnic group.
+    """
+    if cube is not None:
+        smoking_consumption = rollup(
+            cube, ['Ethnicity', 'Stage'], ['Smoking_Pack_Years'])
+    else:
+        # get Stage, Smoking Pack and Ethnicity columns from the lung cancer DataFrame
+        smoking_consumption = lung_cancer_df.loc[:,
+                                                 ['Stage', 'Smoking_Pack_Years', 'Ethnicity']]
+
+        # in order to determine the average smoking for each cancer stage in each ethnic group
+        # the DataFrame must first be grouped by ethnicity and stage columns.
+        smoking_consumption = smoking_consumption.groupby(['Ethnicity', 'Stage'], observed=True)[
+            ['Smoking_Pack_Years']].mean()
+    return smoking_consumption.reset_index()
+
+
+@instrumentation.traced()
+def smoking_packs_estimate(lung_cancer_df, sample_size=SAMPLE_SIZE, confidence=CONFIDENCE,
+                           refine=False) -> pd.DataFrame:
+    """
+    Estimate the average smoking packs at each cancer stage for each ethnic
+    group from a sample of each group, see approximate.refine_means.
 
+    Args:
+        lung_cancer_df (DataFrame): DataFrame to wrangle, or a
+                                    StratifiedSample on Ethnicity and Stage.
+        sample_size (int): patients sampled from each group.
+        confidence (float): confidence level of the intervals.
+        refine (bool): estimate from successively larger samples, up to the exact means.
 
-def smoking_packs_cancer_stage(lung_cancer_df: pd.DataFrame, plot=True):
+    Returns:
+        DataFrame: the columns of smoking_packs_by_stage, with the lower and
+                   upper bounds of each confidence interval, the sample_size
+                   used and the population of the group.
+                   With refine, an iterator of such DataFrames, the last of which is exact.
+    """
+    estimates = (estimate.reset_index() for estimate in refine_means(
+        lung_cancer_df, ['Ethnicity', 'Stage'], 'Smoking_Pack_Years',
+        sample_size=sample_size, confidence=confidence))
+    return estimates if refine else next(estimates)
+
+
+@instrumentation.traced()
+def smoking_packs_cancer_stage(lung_cancer_df: pd.DataFrame, plot=True, cube=None,
+                               sample_size=None):
     """
     Obtain the average smoking packs at each cancer stage
-    for each ethnic group.
+    for each ethnic group, see smoking_packs_by_stage.
 
     Args:
-        lung_cancer_df (DataFrame): DataFrame to wrangle.
+        lung_cancer_df (DataFrame): DataFrame to wrangle, None with a cube.
         plot (bool): switch to determine whether or not to plot the
                      output data.
+        cube (DataFrame): optional aggregate cube from build_cube,
+                          rolled up instead of grouping the full table.
+        sample_size (int): estimate the averages from this many sampled
+                           patients of each group instead, see smoking_packs_estimate.
+                           The cube is exact, and used when there is no DataFrame.
 
     Returns:
         DataFrame: average smoking pack for each cancer stage in each
                    ethnic group.
     """
-    # get Stage, Smoking Pack and Ethnicity columns from the lung cancer DataFrame
-    smoking_consumption = lung_cancer_df.loc[:,
-                                             ['Stage', 'Smoking_Pack_Years', 'Ethnicity']]
-
-    # in order to determine the average smoking for each cancer stage in each ethnic group
-    # the DataFrame must first be grouped by ethnicity and stage columns.
-    smoking_consumption = smoking_consumption.groupby(['Ethnicity', 'Stage'])[
-        ['Smoking_Pack_Years']].mean()
-    smoking_consumption.reset_index(inplace=True)
+    if sample_size is not None and lung_cancer_df is not None:
+        smoking_consumption = smoking_packs_estimate(lung_cancer_df, sample_size)
+    else:
+        smoking_consumption = smoking_packs_by_stage(lung_cancer_df, cube)
 
     if plot:
+        # matplotlib is only imported once a plot is drawn
+        from src.wrangling.userInterface.visualise.plot_data import plot_smoking_packs_cancer_stage
         plot_smoking_packs_cancer_stage(
             smoking_consumption)
 
     return smoking_consumption
 
 
-def blood_pressure_treatment(lung_cancer_df: pd.DataFrame):
+@instrumentation.traced()
+@cached_result('lung_cancer_df', ignore=('cube',))
+def blood_pressure_treatment(lung_cancer_df: pd.DataFrame, cube=None):
     """
     Obtain the average blood pressure results for each treatment
 
     Args:
-        lung_cancer_df (DataFrame): lung cancer data frame
+        lung_cancer_df (DataFrame): lung cancer data frame, None with a cube.
+        cube (DataFrame): optional aggregate cube from build_cube,
+                          rolled up instead of grouping the full table.
+                          For files larger than memory, see build_cube_from_csv.
 
     Returns:
         DataFrame of extracted data
     """
+    blood_pressure_columns = ['Blood_Pressure_Systolic',
+                              'Blood_Pressure_Diastolic', 'Blood_Pressure_Pulse']
+    if cube is not None:
+        return rollup(cube, ['Treatment'], blood_pressure_columns)
+
     treatment_blood_press_df = lung_cancer_df.loc[:, [
-        'Treatment', 'Blood_Pressure_Systolic', 'Blood_Pressure_Diastolic', 'Blood_Pressure_Pulse']]
+        'Treatment'] + blood_pressure_columns]
 
-    treatment_blood_press_mean_df = treatment_blood_press_df.groupby('Treatment')[
-        ['Blood_Pressure_Systolic', 'Blood_Pressure_Diastolic', 'Blood_Pressure_Pulse']].mean()
+    treatment_blood_press_mean_df = treatment_blood_press_df.groupby('Treatment', observed=True)[
+        blood_pressure_columns].mean()
 
     return treatment_blood_press_mean_df
 
 
-def insurer_treatment_data(lung_cancer_df: pd.DataFrame):
+@instrumentation.traced()
+@cached_result('lung_cancer_df', ignore=('cube',))
+def insurer_treatment_data(lung_cancer_df: pd.DataFrame, cube=None):
     """
     Obtain the number of treatment types for each insurer
 
     Args:
-        lung_cancer_df (DataFrame): lung cancer data frame
+        lung_cancer_df (DataFrame): lung cancer data frame, None with a cube.
+        cube (DataFrame): optional aggregate cube from build_cube,
+                          rolled up instead of counting the full table.
+                          For files larger than memory, see build_cube_from_csv.
 
     Returns:
         dictionary of x axis range, x axis labels and
         y axis data for each treatment
     """
+    if cube is not None:
+        return rollup_counts(cube, ['Treatment', 'Insurance_Type']).sort_index().reset_index()
+
     treatment_provider_df = lung_cancer_df.loc[:, [
         'Treatment', 'Insurance_Type']]
 
@@ -210,18 +653,59 @@ def insurer_treatment_data(lung_cancer_df: pd.DataFrame):
         This also provides the value counts as column in the new DataFrame.
     """
     insurance_treatment_counts = treatment_provider_df.groupby(
-        ['Treatment']).Insurance_Type.value_counts().sort_index().reset_index()
+        ['Treatment'], observed=True).Insurance_Type.value_counts().sort_index()
+    # categorical columns also count the insurers that never appear with a treatment
+    insurance_treatment_counts = insurance_treatment_counts[insurance_treatment_counts > 0].reset_index()
 
     return insurance_treatment_counts
 
 
+@instrumentation.traced()
+def render_report_charts(lung_cancer_df: pd.DataFrame, output_dir: str, fmt='png',
+                         workers=None, cube=None) -> list:
+    """
+    Render every chart of the report to files, without a GUI:
+    a treatment pie chart for each ethnic group, the smoking packs,
+    blood pressure and insurer charts.
+    The data is aggregated here, the charts are drawn across a process pool,
+    see plot_data.render_charts.
+
+    Args:
+        lung_cancer_df (DataFrame): lung cancer data frame.
+        output_dir (str): directory the charts are written to, created if needed.
+        fmt (str): 'png', 'svg' or 'pdf'.
+        workers (int): number of processes drawing the charts.
+        cube (DataFrame): optional aggregate cube from build_cube.
+
+    Returns:
+        list: the file path of each chart.
+    """
+    # matplotlib is only imported once a chart is drawn
+    from src.wrangling.userInterface.visualise.plot_data import render_charts
+
+    def chart_path(name: str) -> str:
+        return os.path.join(output_dir, f"{name}.{fmt}")
+
+    jobs = []
+    for ethnicity in lung_cancer_df['Ethnicity'].dropna().unique():
+        jobs.append(('treatment_proportion_for_ethnicity',
+                     chart_path(f"treatment_{ethnicity.lower().replace(' ', '_')}"),
+                     (ethnicity, treatment_for_ethnicity(ethnicity, lung_cancer_df))))
+    jobs.append(('smoking_packs_cancer_stage', chart_path('smoking_packs_cancer_stage'),
+                 (smoking_packs_cancer_stage(lung_cancer_df, plot=False, cube=cube),)))
+    jobs.append(('blood_pressure_treatment', chart_path('blood_pressure_treatment'),
+                 (blood_pressure_treatment(lung_cancer_df, cube=cube),)))
+    jobs.append(('insurer_treatment_data', chart_path('insurer_treatment_data'),
+                 (insurer_treatment_data(lung_cancer_df, cube=cube),)))
+    return render_charts(jobs, workers)
+
+
 if __name__ == "__main__":
     """
     For testing independently of the top-level notebook
     This can be run like a standalone module with:
     python3 -m src.wrangling.extract_data_pd
     """
-    with open("Data/lung_cancer_data.csv", encoding='utf8') as fp:
-        lung_df = pd.read_csv(fp)
-        # smoking_packs_cancer_stage(lung_df, True)
-        insurer_treatment_data(lung_df)
+    lung_df = load_lung_cancer_data("Data/lung_cancer_data.csv", cached=True)
+    # smoking_packs_cancer_stage(lung_df, True)
+    insurer_treatment_data(lung_df)
@@ -0,0 +1,124 @@
+"""
+    Incremental ingestion of an append-only CSV file.
+
+    The dataset remembers how many bytes of the file it has ingested.
+    Each refresh parses only the rows appended since, and adds them to the
+    rows, the Patient_ID and secondary indexes, and the aggregate cube that
+    answers the grouped means and counts of extract_data_pd, so a refresh
+    costs time in proportion to the new rows rather than the whole file.
+
+    Usage:
+        dataset = IncrementalDataset('Data/lung_cancer_data.csv')
+        ... rows are appended to the file ...
+        dataset.refresh()
+        medical_history('asian', dataset.csv_reader, dataset.patient_headers,
+                        indexes=dataset.indexes)
+        blood_pressure_treatment(None, cube=dataset.cube)
+"""
+import csv
+import io
+import os
+
+from . import instrumentation
+from .secondary_index import build_indexes, extend_indexes
+
+
+class IncrementalDataset:
+    """
+    The rows of an append-only CSV file, with their indexes and aggregate
+    cube, kept up to date by refresh().
+
+    Only whole lines are ingested, a row still being written is picked up
+    by the next refresh. A file that shrinks, or whose header changes, is
+    taken to have been replaced and is ingested again from the start.
+    """
+
+    def __init__(self, file_path: str, indexes=True, cube=True):
+        """
+        Args:
+            file_path (str): path of the CSV file.
+            indexes (bool): keep the secondary indexes of build_indexes.
+            cube (bool): keep the aggregate cube of build_cube, requires pandas.
+        """
+        self.file_path = file_path
+        self.keep_indexes = indexes
+        self.keep_cube = cube
+        self._reset()
+        self.refresh()
+
+    def _reset(self):
+        # bytes of the file ingested so far, always at the start of a line
+        self.offset = 0
+        self.patient_headers = None
+        self.csv_reader = []
+        self.patient_index = {}
+        self.indexes = None
+        self.cube = None
+        self._header = None
+
+    def __len__(self) -> int:
+        return len(self.csv_reader)
+
+    @instrumentation.traced('load.incremental_refresh')
+    def refresh(self) -> int:
+        """
+        Ingest the rows appended to the file since the last refresh.
+
+        Returns:
+            int: the number of rows added.
+        """
+        with open(self.file_path, 'rb') as fp:
+            if self._header is not None:
+                size = os.fstat(fp.fileno()).st_size
+                if size < self.offset or fp.read(len(self._header)) != self._header:
+                    self._reset()
+                    fp.seek(0)
+
+            if self._header is None:
+                header = fp.readline()
+                if not header.endswith(b'\n'):
+                    # the header itself is still being written
+                    return 0
+                self._header = header
+                self.offset = len(header)
+                names = next(csv.reader([header.decode('utf8')]))
+                self.patient_headers = {name: position for position, name in enumerate(names)}
+
+            fp.seek(self.offset)
+            tail = fp.read()
+        tail = tail[:tail.rfind(b'\n') + 1]
+        if not tail:
+            return 0
+        instrumentation.count('bytes_read', len(tail))
+
+        records = [record for record in csv.reader(io.StringIO(tail.decode('utf8'), newline=''))
+                   if record]
+        instrumentation.count('rows_read', len(records))
+        first_row = len(self.csv_reader)
+        self.csv_reader.extend(records)
+
+        id_column = self.patient_headers['Patient_ID']
+        for row, record in enumerate(records, first_row):
+            self.patient_index.setdefault(int(record[id_column]), row)
+
+        if self.keep_indexes:
+            if self.indexes is None:
+                self.indexes = build_indexes(self.csv_reader, self.patient_headers)
+            else:
+                extend_indexes(self.indexes, records, self.patient_headers, first_row)
+
+        if self.keep_cube:
+            self._append_to_cube(tail)
+
+        self.offset += len(tail)
+        return len(records)
+
+    def _append_to_cube(self, tail: bytes):
+        # pandas is only imported when the cube is kept
+        import pandas as pd
+        from .aggregate_cube import CUBE_DIMENSIONS, CUBE_MEASURES, append_to_cube
+
+        appended = pd.read_csv(io.BytesIO(tail), sep=',', encoding='utf8', header=None,
+                               names=list(self.patient_headers),
+                               usecols=CUBE_DIMENSIONS + CUBE_MEASURES)
+        self.cube = append_to_cube(self.cube, appended)
@@ -0,0 +1,290 @@
+"""
+    Opt-in instrumentation of the load, query and render paths.
+
+    Disabled by default. While disabled, span() returns a shared no-op
+    context manager, count() returns straight away and counted() returns
+    its iterable unchanged, so the hot paths pay a flag check per call and
+    nothing per row.
+
+    Once enabled the instrumented functions record:
+        - timing spans, nested by call, e.g. a query inside an analysis.
+        - counters, e.g. rows_scanned, rows_matched and bytes_read,
+          attributed to the innermost open span and its parents.
+        - the peak traced allocation of each span, with memory=True.
+        - a cProfile of everything run while enabled, with profile=True.
+    Each finished top-level span can also be appended, with its children,
+    as a JSON line to a trace log.
+
+    Usage:
+        from src.wrangling import instrumentation
+        instrumentation.enable(memory=True, trace_path='trace.jsonl')
+        ... run queries ...
+        print(instrumentation.report())
+        instrumentation.disable()
+"""
+import functools
+import json
+import threading
+import time
+import tracemalloc
+
+_enabled = False
+_memory = False
+_profiler = None
+_trace_path = None
+
+# span name -> {'calls', 'seconds', 'max_seconds', 'peak_bytes'}
+_span_totals = {}
+# counter name -> total
+_counters = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class _NoSpan:
+    """ Returned by span() while disabled. """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Span:
+    """ A timed region of work, with the counters recorded while it was open. """
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.counters = {}
+        self.children = []
+        self.seconds = None
+        # the highest traced memory while open, and the traced memory on entry
+        self._peak = None
+        self._base = None
+        self._start = None
+
+    @property
+    def peak_bytes(self):
+        """ The peak memory allocated during the span, above what was allocated before it. """
+        if self._peak is None:
+            return None
+        return max(self._peak - self._base, 0)
+
+    def __enter__(self):
+        stack = _stack()
+        if _memory and tracemalloc.is_tracing():
+            # the peak is reset for this span, so fold the peak so far into the parent's
+            self._base, peak = tracemalloc.get_traced_memory()
+            if stack and stack[-1]._base is not None:
+                stack[-1]._peak = max(stack[-1]._peak or 0, peak)
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._start
+        stack = _stack()
+        stack.pop()
+        if self._base is not None and tracemalloc.is_tracing():
+            self._peak = max(self._peak or 0, tracemalloc.get_traced_memory()[1])
+        if stack:
+            parent = stack[-1]
+            parent.children.append(self)
+            if self._peak is not None and parent._base is not None:
+                parent._peak = max(parent._peak or 0, self._peak)
+
+        with _lock:
+            totals = _span_totals.setdefault(
+                self.name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'peak_bytes': None})
+            totals['calls'] += 1
+            totals['seconds'] += self.seconds
+            totals['max_seconds'] = max(totals['max_seconds'], self.seconds)
+            if self.peak_bytes is not None:
+                totals['peak_bytes'] = max(totals['peak_bytes'] or 0, self.peak_bytes)
+        if not stack and _trace_path is not None:
+            _write_trace(self)
+        return False
+
+    def as_dict(self) -> dict:
+        record = {'name': self.name, 'seconds': self.seconds}
+        if self.attributes:
+            record['attributes'] = self.attributes
+        if self.counters:
+            record['counters'] = self.counters
+        if self.peak_bytes is not None:
+            record['peak_bytes'] = self.peak_bytes
+        if self.children:
+            record['children'] = [child.as_dict() for child in self.children]
+        return record
+
+
+def _stack() -> list:
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _write_trace(span: Span):
+    line = json.dumps(span.as_dict(), default=str)
+    with _lock, open(_trace_path, 'a', encoding='utf8') as fp:
+        fp.write(line + "\n")
+
+
+def enable(memory=False, profile=False, trace_path=None):
+    """
+    Start recording.
+
+    Args:
+        memory (bool): record the peak traced allocation of each span,
+                       this starts tracemalloc which slows allocation heavy code.
+        profile (bool): run everything under cProfile until disabled,
+                        see dump_profile.
+        trace_path (str): append each finished top-level span as a JSON line to this file.
+    """
+    global _enabled, _memory, _profiler, _trace_path
+    _memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if profile and _profiler is None:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    _trace_path = trace_path
+    _enabled = True
+
+
+def disable():
+    """ Stop recording, the results so far are kept until reset(). """
+    global _enabled, _memory, _trace_path
+    _enabled = False
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _memory = False
+    _trace_path = None
+    if _profiler is not None:
+        _profiler.disable()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """ Discard the recorded spans, counters and profile. """
+    global _profiler
+    with _lock:
+        _span_totals.clear()
+        _counters.clear()
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler = None
+
+
+def span(name: str, /, **attributes):
+    """
+    Args:
+        name (str): name of the region, e.g. 'query.run_query'.
+        attributes: extra JSON compatible details for the trace log.
+
+    Returns:
+        a context manager timing the region while enabled.
+    """
+    if not _enabled:
+        return _NO_SPAN
+    return Span(name, attributes)
+
+
+def count(name: str, value=1):
+    """
+    Add to a counter, and to the same counter of each open span.
+
+    Args:
+        name (str): name of the counter, e.g. 'rows_scanned'.
+        value (int): amount to add.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    for open_span in _stack():
+        open_span.counters[name] = open_span.counters.get(name, 0) + value
+
+
+def counted(iterable, name: str):
+    """
+    Count the items drawn from an iterable, added to the counter once
+    the iteration ends or is abandoned.
+
+    Args:
+        iterable (iterable): the items.
+        name (str): name of the counter.
+
+    Returns:
+        iterable: the iterable itself while disabled.
+    """
+    if not _enabled:
+        return iterable
+    return _counting(iterable, name)
+
+
+def _counting(iterable, name: str):
+    items = 0
+    try:
+        for item in iterable:
+            items += 1
+            yield item
+    finally:
+        count(name, items)
+
+
+def traced(name=None):
+    """
+    Decorator recording a span around each call of a function.
+
+    Args:
+        name (str): name of the span, defaults to the module and function name.
+    """
+    def decorator(function):
+        span_name = name or f"{function.__module__.rsplit('.', 1)[-1]}.{function.__name__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Span(span_name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report() -> dict:
+    """
+    Returns:
+        dict: 'spans', each span name mapped to its number of calls, total
+              and longest time and peak allocation, and 'counters', the total
+              of each counter.
+    """
+    with _lock:
+        return {'spans': {name: dict(totals) for name, totals in _span_totals.items()},
+                'counters': dict(_counters)}
+
+
+def dump_profile(file_path: str):
+    """
+    Write the cProfile statistics, recorded with enable(profile=True),
+    in the pstats format, e.g. for snakeviz or python -m pstats.
+
+    Args:
+        file_path (str): path of the stats file.
+    """
+    if _profiler is None:
+        raise RuntimeError("Instrumentation: enable(profile=True) to record a profile")
+    _profiler.create_stats()
+    _profiler.dump_stats(file_path)
@@ -0,0 +1,102 @@
+import json
+import os
+
+from .columnar_cache import cache_file_path, write_cache, read_csv_cached
+from .schema import INTEGER_COLUMNS, FLOAT_COLUMNS
+
+# numeric columns kept in the sidecar and mapped, rather than read, into memory
+MAPPED_COLUMNS = INTEGER_COLUMNS + FLOAT_COLUMNS
+
+# name of the file, inside the sidecar directory, describing the mapped columns
+MANIFEST = "manifest.json"
+
+
+def _write_sidecar(file_path: str, sidecar_path: str, columns: list, chunk_size: int):
+    """
+    Convert the numeric columns of a CSV file into one raw binary
+    file per column. The CSV is read in chunks, so the whole file
+    is never held in memory.
+    """
+    import numpy as np
+    import pandas as pd
+
+    def write(temp_path):
+        os.makedirs(temp_path)
+        headers = pd.read_csv(file_path, nrows=0).columns.tolist()
+        mapped = [column for column in columns if column in headers]
+        dtypes = {column: 'int64' if column in INTEGER_COLUMNS else 'float64'
+                  for column in mapped}
+
+        files = {column: open(os.path.join(temp_path, f"{column}.bin"), 'wb')
+                 for column in mapped}
+        num_rows = 0
+        try:
+            for chunk in pd.read_csv(file_path, usecols=mapped, chunksize=chunk_size):
+                for column in mapped:
+                    np.ascontiguousarray(
+                        chunk[column].to_numpy(dtypes[column])).tofile(files[column])
+                num_rows += len(chunk)
+        finally:
+            for fp in files.values():
+                fp.close()
+
+        with open(os.path.join(temp_path, MANIFEST), 'w', encoding='utf8') as fp:
+            json.dump({'rows': num_rows, 'headers': headers, 'dtypes': dtypes}, fp)
+
+    write_cache(sidecar_path, write)
+
+
+def load_mapped_frame(file_path: str, columns=MAPPED_COLUMNS, cache_dir=None,
+                      chunk_size=100_000):
+    """
+    Load the dataset with its numeric columns memory-mapped from a binary
+    sidecar, written alongside the Feather cache on first load.
+
+    The numeric columns are read-only views of the page cache rather than
+    copies in process memory, so several processes loading the same file
+    share one copy of the data. The label columns are loaded normally.
+    The returned frame works with every extract_data_pd function; any
+    operation that modifies a mapped column makes its own copy.
+
+    Args:
+        file_path (str): path of the CSV file.
+        columns (list): numeric columns to map, columns not in the file are ignored.
+                        Integer columns must not have missing values.
+        cache_dir (str): where to keep the sidecar, defaults to a '.cache'
+                         directory alongside the CSV file.
+        chunk_size (int): rows read at a time whilst writing the sidecar.
+
+    Returns:
+        DataFrame: the CSV data, in the original column order.
+    """
+    import numpy as np
+    import pandas as pd
+
+    sidecar_path = cache_file_path(file_path, "mmap", cache_dir)
+    if not os.path.exists(sidecar_path):
+        _write_sidecar(file_path, sidecar_path, columns, chunk_size)
+
+    with open(os.path.join(sidecar_path, MANIFEST), encoding='utf8') as fp:
+        manifest = json.load(fp)
+
+    mapped = {}
+    for column, dtype in manifest['dtypes'].items():
+        column_path = os.path.join(sidecar_path, f"{column}.bin")
+        if manifest['rows'] == 0:
+            # an empty file can not be mapped
+            mapped[column] = np.empty(0, dtype=dtype)
+        else:
+            mapped[column] = np.memmap(column_path, dtype=dtype, mode='r',
+                                       shape=(manifest['rows'],))
+
+    label_columns = [column for column in manifest['headers'] if column not in mapped]
+    labels_df = read_csv_cached(file_path, columns=label_columns, cache_dir=cache_dir)
+
+    frame_columns = {}
+    for column in manifest['headers']:
+        if column in mapped:
+            frame_columns[column] = mapped[column]
+        else:
+            frame_columns[column] = labels_df[column]
+    # copy=False keeps each mapped column as its own block, viewing the file
+    return pd.DataFrame(frame_columns, copy=False)
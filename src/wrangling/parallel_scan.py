@@ -0,0 +1,246 @@
+import copy
+import csv
+import os
+import weakref
+from collections import deque
+from itertools import islice
+
+from .query_engine import Query, execute_rows, order_conversion, select
+from .result_cache import register_source
+
+# partitions per worker, more than one evens out uneven partitions
+_PARTITIONS_PER_WORKER = 4
+
+
+class SharedCsvSource:
+    """
+    A CSV file copied once into shared memory and scanned by a pool of
+    worker processes.
+
+    Each worker attaches to the shared block by name and parses its own
+    byte range of rows, so the rows are never pickled to the workers.
+    Only the query is sent, and only the columns of the matching rows
+    are sent back.
+
+    Rows are partitioned on line breaks, so quoted values must not contain
+    line breaks. Call close() (or use a with block) to release the shared
+    memory and the worker processes.
+    """
+
+    def __init__(self, file_path: str, workers=None):
+        """
+        Args:
+            file_path (str): path of the CSV file.
+            workers (int): number of worker processes, defaults to the CPU count.
+        """
+        # process pools and shared memory are slow to import, so only when first used
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing.shared_memory import SharedMemory
+
+        with open(file_path, 'rb') as fp:
+            data = fp.read()
+
+        self.workers = workers or os.cpu_count()
+        self.shared = SharedMemory(create=True, size=max(len(data), 1))
+        self.shared.buf[:len(data)] = data
+        self.size = len(data)
+        self._finalizer = weakref.finalize(self, _release, self.shared)
+
+        header_end = data.find(b'\n') + 1 or len(data)
+        header = next(csv.reader([data[:header_end].decode('utf8')]), [])
+        self.patient_headers = {v: i for i, v in enumerate(header)}
+        self.partitions = _partition(
+            data, header_end, self.workers * _PARTITIONS_PER_WORKER)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        register_source(self, [file_path])
+
+    def scan(self, query: Query, count=False):
+        """
+        Run the query on every partition in parallel.
+
+        Each partition applies the order and limit itself, so at most
+        limit rows are sent back per partition, and the partial results
+        are merged in partition order. Without an order, partitions after
+        those that already hold enough rows are not scanned.
+
+        Args:
+            query (Query): the columns, conditions, order and row limit.
+            count (bool): also return the number of matching rows,
+                          every partition is then scanned.
+
+        Returns:
+            list: a dictionary of the query columns for each selected row.
+            int: only when count is set, the number of matching rows.
+        """
+        partial_query = worker_query(query)
+        futures = [self.executor.submit(_scan_partition, self.shared.name, start, end,
+                                        self.patient_headers, partial_query, count)
+                   for start, end in self.partitions]
+        return merge_scans(query, partial_query, futures, count)
+
+    def iter_scan(self, query: Query):
+        """
+        Lazily run the query, see iter_scans.
+
+        Returns:
+            iterator: a dictionary of the query columns for each selected row.
+        """
+        if query.order_by is not None:
+            return iter(self.scan(query))
+        return iter_scans(query, lambda partition: self.executor.submit(
+            _scan_partition, self.shared.name, *partition, self.patient_headers, query),
+            self.partitions, self.workers)
+
+    def close(self):
+        self.executor.shutdown()
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def worker_query(query: Query) -> Query:
+    """
+    The query sent to the workers of a parallel scan: when ordered by a column
+    that is not returned, the order column is returned too, for the merge.
+    """
+    if query.order_by is None or query.order_by in query.columns:
+        return query
+    partial_query = copy.copy(query)
+    partial_query.columns = query.columns + [query.order_by]
+    return partial_query
+
+
+def merge_scans(query: Query, partial_query: Query, futures: list, count=False):
+    """
+    Merge the partial results of a parallel scan in partition order,
+    see SharedCsvSource.scan.
+
+    Args:
+        query (Query): the query.
+        partial_query (Query): the query the partitions were scanned with, see worker_query.
+        futures (list): a future per partition, in partition order, of the
+                        selected records and, when counted, the number of
+                        matching rows.
+        count (bool): also return the number of matching rows.
+
+    Returns:
+        list: a dictionary of the query columns for each selected row.
+        int: only when count is set, the number of matching rows.
+    """
+    order_by = query.order_by
+    records = []
+    total = 0
+    for future in futures:
+        if (not count and order_by is None and query.limit is not None
+                and len(records) >= query.limit):
+            # the earlier partitions already hold enough rows
+            future.cancel()
+            continue
+        partial, matched = future.result()
+        records.extend(partial)
+        if count:
+            total += matched
+
+    order_key = None
+    if order_by is not None:
+        convert = order_conversion(order_by)
+        order_key = lambda record: convert(record[order_by])
+    records = select(query, records, order_key)
+    if partial_query is not query:
+        for record in records:
+            del record[order_by]
+    if count:
+        return records, total
+    return records
+
+
+def iter_scans(query: Query, submit, tasks: list, window: int):
+    """
+    Yield the selected rows of a parallel scan without an order, a partition
+    at a time in partition order, as each partition's scan completes.
+    At most window partitions are scanned ahead, so only their results are
+    held in memory, and once the limit is reached no more are scanned.
+
+    Args:
+        query (Query): the query, without an order_by.
+        submit (function): called with a task, returns a future of the
+                           selected records of its partition, see merge_scans.
+        tasks (list): a task per partition, in partition order.
+        window (int): number of partitions scanned at once.
+
+    Yields:
+        dict: the query columns of each selected row.
+    """
+    tasks = iter(tasks)
+    pending = deque(submit(task) for task in islice(tasks, window))
+    remaining = query.limit
+    try:
+        while pending:
+            records, _ = pending.popleft().result()
+            for task in islice(tasks, 1):
+                pending.append(submit(task))
+            if remaining is not None:
+                records = records[:remaining]
+                remaining -= len(records)
+            yield from records
+            if remaining == 0:
+                return
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _release(shared):
+    shared.close()
+    shared.unlink()
+
+
+def _partition(data: bytes, start: int, count: int) -> list:
+    """
+    Split the bytes after the header into about count ranges,
+    each ending on a line break.
+
+    Returns:
+        list: (start, end) byte offsets of each range.
+    """
+    partitions = []
+    step = max((len(data) - start) // max(count, 1), 1)
+    while start < len(data):
+        end = data.find(b'\n', min(start + step, len(data) - 1))
+        end = len(data) if end == -1 else end + 1
+        partitions.append((start, end))
+        start = end
+    return partitions
+
+
+def _scan_partition(shared_name: str, start: int, end: int, patient_headers: dict,
+                    query: Query, count=False) -> tuple:
+    """
+    Worker: parse and query one byte range of the shared CSV data.
+
+    Args:
+        count (bool): count every matching row, without an order the scan
+                      otherwise stops as soon as the limit is reached.
+
+    Returns:
+        list: a dictionary of the query columns for each selected row.
+        int: the number of matching rows in the range, None unless counted.
+    """
+    from multiprocessing.shared_memory import SharedMemory
+
+    shared = SharedMemory(name=shared_name)
+    try:
+        text = bytes(shared.buf[start:end]).decode('utf8')
+    finally:
+        shared.close()
+
+    # split on line feeds alone, as the partitions are, where splitlines would
+    # also split values holding e.g. a carriage return or a '\u2028'
+    rows = (record for record in csv.reader(text.split('\n')) if record)
+    if count:
+        return execute_rows(query, rows, patient_headers, count=True)
+    return execute_rows(query, rows, patient_headers), None
@@ -0,0 +1,235 @@
+"""
+    A dataset made of many CSV files, e.g. one per site or per month,
+    queried as if it were a single file.
+
+    Each file keeps a zone map: the lowest and highest value of every
+    numeric column and the distinct values of every label column. A query
+    only reads the files whose zone maps show they could hold matching rows,
+    and scans them in parallel, one worker process per file at a time.
+    The zone maps are kept in the '.cache' directory alongside the files,
+    and rebuilt when a file changes.
+
+    Usage:
+        with PartitionedDataset('Data/', 'lung_cancer_*.csv') as dataset:
+            survival_treatment_details(100, dataset, dataset.patient_headers)
+"""
+import csv
+import glob
+import json
+import os
+
+from .columnar_cache import cache_file_path, write_cache
+from .parallel_scan import iter_scans, merge_scans, worker_query
+from .query_engine import Query, execute_rows, zone_may_match
+from .result_cache import register_source
+from .schema import INTEGER_COLUMNS, FLOAT_COLUMNS
+
+# label columns with more distinct values than this are not kept in the zone map
+MAX_ZONE_VALUES = 256
+
+
+class PartitionedDataset:
+    """
+    The CSV files of a directory matching a pattern, with a zone map per file.
+    Every file must have the same columns, in any order.
+
+    Call close() (or use a with block) to release the worker processes.
+    """
+
+    def __init__(self, data_path: str, pattern='*.csv', workers=None):
+        """
+        Args:
+            data_path (str): directory containing the files.
+            pattern (str): glob pattern of the file names, e.g. 'lung_cancer_*.csv'
+            workers (int): number of worker processes, defaults to the CPU count.
+        """
+        # process pools are slow to import, so only when first used
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.file_paths = sorted(glob.glob(os.path.join(data_path, pattern)))
+        if not self.file_paths:
+            raise FileNotFoundError(f"No files matching '{pattern}' in '{data_path}'")
+        self.workers = min(workers or os.cpu_count(), len(self.file_paths))
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        # the zone maps missing from the cache are built in parallel
+        self.zone_maps = [_cached_zone_map(file_path) for file_path in self.file_paths]
+        missing = [n for n, zone_map in enumerate(self.zone_maps) if zone_map is None]
+        for n, zone_map in zip(missing, self.executor.map(
+                build_zone_map, [self.file_paths[n] for n in missing])):
+            self.zone_maps[n] = zone_map
+
+        headers = self.zone_maps[0]['headers']
+        for file_path, zone_map in zip(self.file_paths, self.zone_maps):
+            if sorted(zone_map['headers']) != sorted(headers):
+                raise ValueError(f"Partition: '{file_path}' does not have the columns of "
+                                 f"'{self.file_paths[0]}'")
+        self.patient_headers = {name: position for position, name in enumerate(headers)}
+        register_source(self, self.file_paths)
+
+    def __len__(self) -> int:
+        return sum(zone_map['rows'] for zone_map in self.zone_maps)
+
+    def partitions(self, query: Query) -> list:
+        """
+        Args:
+            query (Query): the query.
+
+        Returns:
+            list: the paths of the files that could hold rows matching the query.
+        """
+        return [file_path for file_path, zone_map in zip(self.file_paths, self.zone_maps)
+                if zone_may_match(query, zone_map)]
+
+    def scan(self, query: Query, count=False):
+        """
+        Run the query on the files that could match, in parallel,
+        see parallel_scan.SharedCsvSource.scan.
+
+        Args:
+            query (Query): the columns, conditions, order and row limit.
+            count (bool): also return the number of matching rows.
+
+        Returns:
+            list: a dictionary of the query columns for each selected row,
+                  in file order unless the query has an order_by.
+            int: only when count is set, the number of matching rows.
+        """
+        partial_query = worker_query(query)
+        futures = [self.executor.submit(_scan_file, file_path, partial_query, count)
+                   for file_path in self.partitions(query)]
+        return merge_scans(query, partial_query, futures, count)
+
+    def iter_scan(self, query: Query):
+        """
+        Lazily run the query on the files that could match, see parallel_scan.iter_scans.
+
+        Returns:
+            iterator: a dictionary of the query columns for each selected row.
+        """
+        if query.order_by is not None:
+            return iter(self.scan(query))
+        return iter_scans(query, lambda file_path: self.executor.submit(
+            _scan_file, file_path, query), self.partitions(query), self.workers)
+
+    def load_frame(self, where=None, match='all', columns=None):
+        """
+        Load the files that could hold rows matching the conditions into one
+        DataFrame, read in parallel. The rows are not filtered.
+
+        Args:
+            where (list): query conditions, see Query, every file when omitted.
+            match (str): 'all' or 'any' of the conditions must hold.
+            columns (list): the columns to read, all when omitted.
+
+        Returns:
+            DataFrame: the rows of the files, in file order.
+        """
+        import pandas as pd
+
+        file_paths = self.partitions(Query(columns or [], where, match))
+        frames = list(self.executor.map(_read_frame, file_paths, [columns] * len(file_paths)))
+        if not frames:
+            return pd.DataFrame(columns=columns or list(self.patient_headers))
+        return pd.concat(frames, ignore_index=True)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def build_zone_map(file_path: str) -> dict:
+    """
+    Read a CSV file once to describe its values, and cache the description.
+
+    Args:
+        file_path (str): path of the CSV file.
+
+    Returns:
+        dict: 'headers', the column headers in file order, 'rows', the number
+              of rows, 'ranges', each numeric column mapped to its
+              [lowest, highest] value, and 'values', each label column
+              mapped to its distinct values.
+    """
+    with open(file_path, 'r', encoding='utf8', newline='') as fp:
+        reader = csv.reader(fp, delimiter=',')
+        headers = next(reader, [])
+        numeric = {position for position, name in enumerate(headers)
+                   if name in INTEGER_COLUMNS or name in FLOAT_COLUMNS}
+        lows = {}
+        highs = {}
+        distinct = {position: set() for position in range(len(headers))
+                    if position not in numeric}
+        rows = 0
+        for record in reader:
+            if not record:
+                continue
+            rows += 1
+            for position in list(numeric):
+                try:
+                    value = float(record[position])
+                except ValueError:
+                    # a value that is not a number, the column can not be pruned on
+                    numeric.discard(position)
+                    continue
+                if position not in lows or value < lows[position]:
+                    lows[position] = value
+                if position not in highs or value > highs[position]:
+                    highs[position] = value
+            for position, values in list(distinct.items()):
+                values.add(record[position])
+                if len(values) > MAX_ZONE_VALUES:
+                    del distinct[position]
+
+    zone_map = {'headers': headers, 'rows': rows,
+                'ranges': {headers[position]: [lows[position], highs[position]]
+                           for position in numeric if position in lows},
+                'values': {headers[position]: sorted(values)
+                           for position, values in distinct.items()}}
+
+    def write(temp_path):
+        with open(temp_path, 'w', encoding='utf8') as fp:
+            json.dump(zone_map, fp)
+    write_cache(cache_file_path(file_path, "zonemap"), write)
+    return zone_map
+
+
+def _cached_zone_map(file_path: str):
+    cache_path = cache_file_path(file_path, "zonemap")
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path, encoding='utf8') as fp:
+        return json.load(fp)
+
+
+def _scan_file(file_path: str, query: Query, count=False) -> tuple:
+    """
+    Worker: query one file of the dataset.
+
+    Args:
+        count (bool): count every matching row, without an order the scan
+                      otherwise stops as soon as the limit is reached.
+
+    Returns:
+        list: a dictionary of the query columns for each selected row.
+        int: the number of matching rows in the file, None unless counted.
+    """
+    with open(file_path, 'r', encoding='utf8', newline='') as fp:
+        reader = csv.reader(fp, delimiter=',')
+        # each file is read with its own column order
+        patient_headers = {name: position for position, name in enumerate(next(reader, []))}
+        rows = (record for record in reader if record)
+        if count:
+            return execute_rows(query, rows, patient_headers, count=True)
+        return execute_rows(query, rows, patient_headers), None
+
+
+def _read_frame(file_path: str, columns):
+    """ Worker: read one file of the dataset into a DataFrame. """
+    import pandas as pd
+    return pd.read_csv(file_path, sep=',', encoding='utf8', usecols=columns)
@@ -0,0 +1,515 @@
+import heapq
+import operator
+from itertools import islice
+from operator import itemgetter
+
+from .column_store import ColumnStore, CATEGORY
+from .instrumentation import counted, enabled
+from .schema import INTEGER_COLUMNS, FLOAT_COLUMNS
+from .secondary_index import SortedIndex, BitmapIndex, bitmap_rows, rows_bitmap
+
+# conversions that may be applied to a raw CSV value before it is compared
+CONVERSIONS = {'int': int, 'float': float, 'str': str}
+
+''' comparisons available to the query conditions,
+    as templates of Python expressions so that a query can be
+    compiled into a single function.
+'''
+_COMPARISONS = {'>': "{value} > {target}",
+                '>=': "{value} >= {target}",
+                '<': "{value} < {target}",
+                '<=': "{value} <= {target}",
+                '==': "{value} == {target}",
+                '!=': "{value} != {target}",
+                'in': "{value} in {target}",
+                # case-insensitive substring, the target is expected to be casefolded
+                'contains': "{target} in {value}.casefold()",
+                'truthy': "bool({value})"}
+
+# the ordering comparisons, applied column-wise to a DataFrame
+_FRAME_COMPARISONS = {'>': operator.gt, '>=': operator.ge,
+                      '<': operator.lt, '<=': operator.le,
+                      '==': operator.eq, '!=': operator.ne}
+
+
+class Query:
+    """
+    Declarative description of a query over the CSV data:
+    which rows to keep (where), which columns to return (columns),
+    the order to return them in (order_by) and how many rows
+    to return at most (limit).
+
+    Each condition is a tuple of
+        (column, comparison, target, conversion)
+    e.g. ('Survival_Months', '>', 100, 'int')
+    where conversion is applied to the raw CSV string before comparing,
+    or None to compare the string itself.
+    Typed sources, such as a ColumnStore, ignore the conversion.
+
+    Without order_by the matching rows keep their original order and the
+    scan stops once the limit is reached. With order_by and a limit only
+    the top rows are kept, in a heap bounded by the limit.
+    """
+
+    def __init__(self, columns: list, where=None, match='all', limit=None,
+                 order_by=None, descending=False):
+        """
+        Args:
+            columns (list): the columns to extract from each matching row.
+            where (list): conditions, every row matches when omitted.
+            match (str): 'all' or 'any' of the conditions must hold.
+            limit (int): return at most this many rows.
+            order_by (str): column to order the matching rows by. Raw CSV values
+                            of numeric schema columns are compared as numbers.
+            descending (bool): largest values first.
+        """
+        self.columns = list(columns)
+        self.where = list(where or [])
+        self.match = match
+        self.limit = limit
+        self.order_by = order_by
+        self.descending = descending
+        for column, comparison, target, conversion in self.where:
+            if comparison not in _COMPARISONS:
+                raise ValueError(f"Comparison: '{comparison}' not supported")
+            if conversion is not None and conversion not in CONVERSIONS:
+                raise ValueError(f"Conversion: '{conversion}' not supported")
+        if match not in ('all', 'any'):
+            raise ValueError(f"Match: '{match}' should be 'all' or 'any'")
+
+
+def _compile(terms: list, match: str, env: dict, argument: str):
+    """ Join the condition expressions into one compiled function. """
+    if not terms:
+        terms = ["True"]
+    joiner = " and " if match == 'all' else " or "
+    # only indexes, whitelisted names and the templates above reach the source
+    return eval(f"lambda {argument}: {joiner.join(terms)}", env)
+
+
+def _compile_label_check(comparison: str, target):
+    """ Predicate over a single label, for conditions evaluated once per category. """
+    return _compile([_COMPARISONS[comparison].format(value="label", target="target")],
+                    'all', {'target': target}, "label")
+
+
+def compile_rows(query: Query, patient_headers: dict):
+    """
+    Compile the query conditions into a predicate over raw CSV rows.
+
+    Args:
+        query (Query): the query.
+        patient_headers (dict): mapping of column headers to their respective
+                                column index.
+
+    Returns:
+        function: called with a row, returns True when the row matches.
+    """
+    env = dict(CONVERSIONS)
+    terms = []
+    for n, (column, comparison, target, conversion) in enumerate(query.where):
+        value = f"record[{int(patient_headers[column])}]"
+        if conversion is not None:
+            value = f"{conversion}({value})"
+        env[f"target{n}"] = target
+        terms.append(_COMPARISONS[comparison].format(value=value, target=f"target{n}"))
+    return _compile(terms, query.match, env, "record")
+
+
+def compile_store(query: Query, store: ColumnStore):
+    """
+    Compile the query conditions into a predicate over the row numbers
+    of a ColumnStore. Conditions on label columns are evaluated once per
+    category, so each row only needs a lookup of its category code.
+
+    Args:
+        query (Query): the query.
+        store (ColumnStore): the typed columns.
+
+    Returns:
+        function: called with a row number, returns True when the row matches.
+    """
+    env = {}
+    terms = []
+    for n, (column, comparison, target, conversion) in enumerate(query.where):
+        env[f"column{n}"] = store.column(column)
+        if store.kinds[column] == CATEGORY:
+            check = _compile_label_check(comparison, target)
+            env[f"codes{n}"] = {code for code, label in enumerate(store.categories(column))
+                                if check(label)}
+            terms.append(f"column{n}[row] in codes{n}")
+        else:
+            env[f"target{n}"] = target
+            terms.append(_COMPARISONS[comparison].format(
+                value=f"column{n}[row]", target=f"target{n}"))
+    return _compile(terms, query.match, env, "row")
+
+
+def compile_mask(query: Query, lung_cancer_df):
+    """
+    Evaluate the query conditions on a DataFrame as a vectorized mask.
+
+    Args:
+        query (Query): the query.
+        lung_cancer_df (DataFrame): lung cancer data frame.
+
+    Returns:
+        Series: boolean mask of the matching rows.
+    """
+    masks = []
+    for column, comparison, target, conversion in query.where:
+        values = lung_cancer_df[column]
+        if comparison == 'in':
+            masks.append(values.isin(list(target)))
+        elif comparison == 'contains':
+            masks.append(values.astype(str).str.casefold().str.contains(target, regex=False))
+        elif comparison == 'truthy':
+            masks.append(values.astype(bool))
+        else:
+            masks.append(_FRAME_COMPARISONS[comparison](values, target))
+
+    mask = None
+    for condition_mask in masks:
+        if mask is None:
+            mask = condition_mask
+        elif query.match == 'all':
+            mask = mask & condition_mask
+        else:
+            mask = mask | condition_mask
+    if mask is None:
+        return lung_cancer_df.index == lung_cancer_df.index
+    return mask
+
+
+def index_rows(query: Query, indexes: dict):
+    """
+    Answer the query conditions from secondary indexes, if they all can be.
+
+    Args:
+        query (Query): the query.
+        indexes (dict): column header mapped to its SortedIndex or BitmapIndex.
+
+    Returns:
+        list: matching row numbers in ascending order,
+              or None when a condition has no usable index.
+    """
+    if not indexes or not query.where:
+        return None
+    bitmaps = []
+    for column, comparison, target, conversion in query.where:
+        index = indexes.get(column)
+        if isinstance(index, BitmapIndex):
+            bitmaps.append(index.matching(_compile_label_check(comparison, target)))
+        elif isinstance(index, SortedIndex) and comparison in ('>', '>=', '<', '<='):
+            bitmaps.append(rows_bitmap(_sorted_rows(index, comparison, target)))
+        else:
+            return None
+
+    bitmap = bitmaps[0]
+    for other in bitmaps[1:]:
+        bitmap = bitmap & other if query.match == 'all' else bitmap | other
+    return bitmap_rows(bitmap)
+
+
+def zone_may_match(query: Query, zone_map: dict) -> bool:
+    """
+    Decide from the statistics of a partition whether any of its rows could
+    match the query conditions, so that partitions that can not are skipped.
+
+    Args:
+        query (Query): the query.
+        zone_map (dict): 'rows', the number of rows, 'ranges', numeric column
+                         headers mapped to their [lowest, highest] value, and
+                         'values', label column headers mapped to their distinct
+                         raw CSV values. Columns left out are assumed to match.
+
+    Returns:
+        bool: False only when no row of the partition can match.
+    """
+    if not zone_map['rows']:
+        return False
+    if not query.where:
+        return True
+    matches = (_zone_condition_may_match(zone_map, *condition) for condition in query.where)
+    return all(matches) if query.match == 'all' else any(matches)
+
+
+def _zone_condition_may_match(zone_map: dict, column: str, comparison: str, target,
+                              conversion) -> bool:
+    values = zone_map['values'].get(column)
+    if values is not None:
+        # checked on each distinct value, converted as the raw rows would be
+        check = _compile_label_check(comparison, target)
+        convert = CONVERSIONS[conversion] if conversion is not None else str
+        try:
+            return any(check(convert(value)) for value in values)
+        except ValueError:
+            return True
+
+    bounds = zone_map['ranges'].get(column)
+    if bounds is None or conversion not in ('int', 'float'):
+        # string comparisons of numbers do not follow the numeric range
+        return True
+    low, high = bounds
+    if comparison == '>':
+        return high > target
+    if comparison == '>=':
+        return high >= target
+    if comparison == '<':
+        return low < target
+    if comparison == '<=':
+        return low <= target
+    if comparison == '==':
+        return low <= target <= high
+    if comparison == '!=':
+        return not low == high == target
+    if comparison == 'in':
+        return any(low <= value <= high for value in target)
+    return True
+
+
+def _sorted_rows(index: SortedIndex, comparison: str, target):
+    if comparison == '>':
+        return index.greater_than(target)
+    if comparison == '>=':
+        return index.at_least(target)
+    if comparison == '<':
+        return index.less_than(target)
+    return index.at_most(target)
+
+
+def _projector(query: Query, positions: list):
+    """ Function returning the projected values of a row as a tuple. """
+    if len(positions) == 1:
+        return lambda record: (record[positions[0]],)
+    return itemgetter(*positions)
+
+
+def _counting(matches, tally: list):
+    """ Pass the matches through, adding up how many there were in tally[0]. """
+    for match in matches:
+        tally[0] += 1
+        yield match
+
+
+def _scanned(predicate, records):
+    """ Filter the records, counting those scanned and matched while instrumented. """
+    return counted(filter(predicate, counted(records, 'rows_scanned')), 'rows_matched')
+
+
+def _finish(matches):
+    """
+    Close the counting of an abandoned scan, e.g. one stopped at the limit,
+    so that its counts are added while the caller's span is still open.
+    """
+    if enabled() and hasattr(matches, 'close'):
+        matches.close()
+
+
+def _select(query: Query, matches, order_key=None, count=False) -> tuple:
+    """
+    Apply the query's order and limit to an iterator of matches.
+
+    Returns:
+        tuple: the selected matches,
+               the total number of matches when count is set, otherwise None.
+    """
+    if query.order_by is None:
+        selected = list(islice(matches, query.limit))
+        # counting the rest of the matches does not materialise them
+        total = len(selected) + sum(1 for _ in matches) if count else None
+        return selected, total
+
+    tally = [0]
+    matches = _counting(matches, tally)
+    if query.limit is None:
+        selected = sorted(matches, key=order_key, reverse=query.descending)
+    elif query.descending:
+        selected = heapq.nlargest(query.limit, matches, key=order_key)
+    else:
+        selected = heapq.nsmallest(query.limit, matches, key=order_key)
+    return selected, tally[0] if count else None
+
+
+def _result(records: list, total, count: bool):
+    if count:
+        return records, total
+    return records
+
+
+def order_conversion(column: str):
+    """ Conversion applied to a raw CSV value of the column before ordering by it. """
+    if column in INTEGER_COLUMNS:
+        return int
+    if column in FLOAT_COLUMNS:
+        return float
+    return str
+
+
+def row_order_key(query: Query, patient_headers: dict):
+    """
+    Args:
+        query (Query): the query.
+        patient_headers (dict): mapping of column headers to their respective
+                                column index.
+
+    Returns:
+        function: the query's order_by value of a raw CSV row, or None.
+    """
+    if query.order_by is None:
+        return None
+    position = patient_headers[query.order_by]
+    convert = order_conversion(query.order_by)
+    return lambda record: convert(record[position])
+
+
+def select(query: Query, matches, order_key=None, count=False):
+    """
+    Apply the query's order and limit to already matching items,
+    e.g. to merge the results of several partial scans.
+
+    Args:
+        query (Query): the query.
+        matches (iterable): the matching items, in their original order.
+        order_key (function): the order_by value of an item.
+        count (bool): also return the number of matching items.
+
+    Returns:
+        list: the selected items.
+        int: only when count is set, the number of matching items.
+    """
+    selected, total = _select(query, iter(matches), order_key, count)
+    return _result(selected, total, count)
+
+
+def execute_rows(query: Query, csv_reader, patient_headers: dict, count=False):
+    """
+    Run the query over rows of CSV strings.
+    Without an order the scan stops as soon as the limit is reached,
+    unless the total is being counted.
+
+    Args:
+        query (Query): the query.
+        csv_reader (iterable): rows of data.
+        patient_headers (dict): mapping of column headers to their respective
+                                column index.
+        count (bool): also count every matching row.
+
+    Returns:
+        list: a dictionary of the query columns for each selected row.
+        int: only when count is set, the number of matching rows.
+    """
+    predicate = compile_rows(query, patient_headers)
+    project = _projector(query, [patient_headers[column] for column in query.columns])
+    columns = query.columns
+    matches = _scanned(predicate, csv_reader)
+    selected, total = _select(query, matches, row_order_key(query, patient_headers), count)
+    _finish(matches)
+    return _result([dict(zip(columns, project(record))) for record in selected],
+                   total, count)
+
+
+def execute_store(query: Query, store: ColumnStore, rows=None, count=False):
+    """
+    Run the query over a ColumnStore, see execute_rows.
+
+    Args:
+        query (Query): the query.
+        store (ColumnStore): the typed columns.
+        rows (list): row numbers already known to match, e.g. from index_rows,
+                     the conditions are evaluated on every row when omitted.
+        count (bool): also count every matching row.
+
+    Returns:
+        list: a dictionary of the query columns for each selected row.
+        int: only when count is set, the number of matching rows.
+    """
+    if rows is None:
+        rows = _scanned(compile_store(query, store), range(len(store)))
+    else:
+        rows = counted(rows, 'rows_matched')
+    order_key = None
+    if query.order_by is not None:
+        order_key = lambda row: store.value(query.order_by, row)
+    selected, total = _select(query, iter(rows), order_key, count)
+    _finish(rows)
+    return _result([store.extract(query.columns, row) for row in selected],
+                   total, count)
+
+
+def execute_indexed_rows(query: Query, rows: list, csv_reader: list,
+                         patient_headers: dict, count=False):
+    """
+    Select and extract rows of CSV strings already known to match,
+    e.g. from index_rows, see execute_rows.
+
+    Args:
+        query (Query): the query.
+        rows (list): matching row numbers.
+        csv_reader (list): rows of data.
+        patient_headers (dict): mapping of column headers to their respective
+                                column index.
+        count (bool): also return the number of matching rows.
+
+    Returns:
+        list: a dictionary of the query columns for each selected row.
+        int: only when count is set, the number of matching rows.
+    """
+    order_key = row_order_key(query, patient_headers)
+    if order_key is not None:
+        row_key = order_key
+        order_key = lambda row: row_key(csv_reader[row])
+    rows = counted(rows, 'rows_matched')
+    selected, total = _select(query, iter(rows), order_key, count)
+    _finish(rows)
+    project = _projector(query, [patient_headers[column] for column in query.columns])
+    return _result([dict(zip(query.columns, project(csv_reader[row]))) for row in selected],
+                   total, count)
+
+
+def iter_rows(query: Query, csv_reader, patient_headers: dict, rows=None):
+    """
+    Lazily run the query over rows of CSV strings, for results too large
+    to hold in memory. Without an order only one row is held at a time.
+
+    Args:
+        query (Query): the query.
+        csv_reader (iterable): rows of data, a list when rows is given.
+        patient_headers (dict): mapping of column headers to their respective
+                                column index.
+        rows (list): row numbers already known to match, e.g. from index_rows.
+
+    Returns:
+        iterator: a tuple of the query column values for each selected row.
+    """
+    if rows is None:
+        matches = _scanned(compile_rows(query, patient_headers), csv_reader)
+    else:
+        matches = map(csv_reader.__getitem__, counted(rows, 'rows_matched'))
+    if query.order_by is None:
+        matches = islice(matches, query.limit)
+    else:
+        matches, _ = _select(query, matches, row_order_key(query, patient_headers))
+    project = _projector(query, [patient_headers[column] for column in query.columns])
+    return map(project, matches)
+
+
+def iter_store(query: Query, store: ColumnStore, rows=None):
+    """
+    Lazily run the query over a ColumnStore, see iter_rows.
+
+    Returns:
+        iterator: a tuple of the query column values for each selected row.
+    """
+    if rows is None:
+        rows = _scanned(compile_store(query, store), range(len(store)))
+    else:
+        rows = counted(rows, 'rows_matched')
+    if query.order_by is None:
+        rows = islice(rows, query.limit)
+    else:
+        rows, _ = _select(query, iter(rows),
+                          lambda row: store.value(query.order_by, row))
+    columns = query.columns
+    value = store.value
+    return (tuple(value(column, row) for column in columns) for row in rows)
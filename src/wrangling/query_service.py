@@ -0,0 +1,344 @@
+"""
+    Local HTTP/JSON service answering the pandas analyses for many
+    concurrent users from one preloaded copy of the dataset.
+
+    The DataFrame, its aggregate cube and indexes are loaded once, before
+    the worker processes are started, so workers forked from the server
+    share them. Workers started another way load them once each. The
+    workers are started before any request is served.
+    Aggregations run in the worker pool, so the event loop keeps accepting
+    requests. Identical requests in flight at the same time are answered by
+    a single computation, and responses are cached.
+
+    Endpoints:
+        GET  /health     -> {"status": "ok"}
+        GET  /analyses   -> the analyses and their arguments
+        POST /query      <- {"analysis": "survival_blood_pressure", "args": {"gender": "male"}}
+                         -> {"analysis": ..., "args": ..., "result": [...]}
+
+    Usage:
+        python -m src.wrangling.query_service --data Data/lung_cancer_data.csv --port 8765
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from . import extract_data_pd
+from .aggregate_cube import build_cube
+from .result_cache import NORMALISED_ARGUMENTS, normalise_argument
+from .secondary_index import build_frame_indexes
+
+# analysis name -> function of extract_data_pd returning data rather than printing it
+ANALYSES = {'patient_long_survival': extract_data_pd.long_survival_treatments,
+            'treatment_white_blood_count': extract_data_pd.white_blood_count_mean,
+            'lung_tumor_data': extract_data_pd.lung_tumor_smoking,
+            'survival_blood_pressure': extract_data_pd.gender_survival_blood_pressure,
+            'treatment_for_ethnicity': extract_data_pd.treatment_for_ethnicity,
+            'smoking_packs_cancer_stage': extract_data_pd.smoking_packs_cancer_stage,
+            'blood_pressure_treatment': extract_data_pd.blood_pressure_treatment,
+            'insurer_treatment_data': extract_data_pd.insurer_treatment_data}
+
+# arguments supplied by the service rather than the request
+_SHARED_ARGUMENTS = {'lung_cancer_df', 'cube', 'indexes', 'plot'}
+
+# largest request body accepted, in bytes
+MAX_BODY_BYTES = 1 << 16
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 413: 'Payload Too Large',
+            500: 'Internal Server Error'}
+
+# the loaded dataset, shared by the worker processes, see load_dataset
+_dataset = None
+
+
+class QueryError(Exception):
+    """ A request that cannot be answered, with the HTTP status to answer it with. """
+
+    def __init__(self, status: int, message: str):
+        # both arguments are kept in args, so the error survives pickling back from a worker
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+    def __str__(self) -> str:
+        return self.message
+
+
+def load_dataset(file_path: str) -> dict:
+    """
+    Load the dataset for the service, once per process.
+
+    Args:
+        file_path (str): path of the CSV file.
+
+    Returns:
+        dict: the DataFrame, its aggregate cube and sorted indexes,
+              keyed by the argument name the analyses use.
+    """
+    global _dataset
+    if _dataset is None or _dataset['file_path'] != file_path:
+        lung_cancer_df = extract_data_pd.load_lung_cancer_data(
+            file_path, cached=True, report=False)
+        _dataset = {'file_path': file_path,
+                    'lung_cancer_df': lung_cancer_df,
+                    'cube': build_cube(lung_cancer_df),
+                    'indexes': build_frame_indexes(lung_cancer_df),
+                    'plot': False}
+    return _dataset
+
+
+def run_analysis(file_path: str, analysis: str, args: dict):
+    """
+    Worker: run one analysis on the loaded dataset.
+
+    Args:
+        file_path (str): path of the CSV file.
+        analysis (str): name of the analysis, see ANALYSES.
+        args (dict): keyword arguments of the analysis.
+
+    Returns:
+        the result converted to JSON compatible values, see to_json_data.
+    """
+    dataset = load_dataset(file_path)
+    function = ANALYSES[analysis]
+    parameters = inspect.signature(function).parameters
+    kwargs = dict(args)
+    kwargs.update({name: dataset[name] for name in _SHARED_ARGUMENTS
+                   if name in parameters})
+    try:
+        result = function(**kwargs)
+    except ValueError as error:
+        # the analyses raise ValueError for values that are not in the data
+        raise QueryError(404, str(error)) from None
+    if result is None:
+        # and return nothing for values they do not answer at all, e.g. 'q' to quit
+        name = next((name for name in NORMALISED_ARGUMENTS if name in args), None)
+        if name is None:
+            raise QueryError(404, f"Analysis: '{analysis}' has no result")
+        raise QueryError(404, f"{name.capitalize()}: '{args[name]}' not found")
+    return to_json_data(result)
+
+
+def to_json_data(result):
+    """
+    Convert an analysis result into values that can be serialised as JSON.
+
+    Args:
+        result: a DataFrame, Series, NumPy or Python scalar.
+
+    Returns:
+        list or scalar: a dictionary per row for frames and series,
+                        with the group keys of an aggregate as columns.
+    """
+    if hasattr(result, 'to_frame'):
+        result = result.to_frame()
+    if hasattr(result, 'reset_index'):
+        if result.index.names != [None]:
+            result = result.reset_index()
+        result = result.astype(object).where(result.notna(), None)
+        return result.to_dict(orient='records')
+    if hasattr(result, 'item'):
+        return result.item()
+    return result
+
+
+class QueryService:
+    """
+    Answers query requests from a worker pool, caching the responses and
+    coalescing identical requests in flight at the same time.
+    """
+
+    def __init__(self, file_path: str, workers=None, cache_entries=256):
+        """
+        Args:
+            file_path (str): path of the CSV file.
+            workers (int): number of worker processes, defaults to the CPU count.
+            cache_entries (int): number of responses cached before the least
+                                 recently used is evicted.
+        """
+        self.file_path = file_path
+        # loaded before the workers start, so forked workers share the parent's copy
+        load_dataset(file_path)
+        context = None
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        workers = workers or os.cpu_count()
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                            initializer=load_dataset, initargs=(file_path,))
+        # started now, before serving, as a worker forked while a connection is open
+        # inherits its socket, and the client would never see the connection close
+        for future in [self.executor.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+        self.cache_entries = cache_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._responses = OrderedDict()
+        self._in_flight = {}
+
+    async def query(self, analysis: str, args: dict):
+        """
+        Args:
+            analysis (str): name of the analysis, see ANALYSES.
+            args (dict): keyword arguments of the analysis.
+
+        Returns:
+            the JSON compatible result of the analysis.
+        """
+        if not isinstance(analysis, str) or analysis not in ANALYSES:
+            raise QueryError(404, f"Analysis: '{analysis}' not found")
+        if not isinstance(args, dict):
+            raise QueryError(400, "Args: expected an object of keyword arguments")
+        parameters = inspect.signature(ANALYSES[analysis]).parameters
+        for name in args:
+            if name not in parameters or name in _SHARED_ARGUMENTS:
+                raise QueryError(400, f"Args: '{name}' is not an argument of {analysis}")
+
+        # e.g. 'male' and 'Male' share a cached response and a computation
+        key = (analysis, json.dumps({name: normalise_argument(value)
+                                     if name in NORMALISED_ARGUMENTS else value
+                                     for name, value in args.items()}, sort_keys=True))
+        if key in self._responses:
+            self.hits += 1
+            self._responses.move_to_end(key)
+            return self._responses[key]
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            in_flight = self._in_flight[key] = asyncio.ensure_future(
+                self._compute(key, analysis, args))
+        # a waiter that disconnects must not cancel the computation shared with the others
+        return await asyncio.shield(in_flight)
+
+    async def _compute(self, key: tuple, analysis: str, args: dict):
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self.executor, run_analysis,
+                                                self.file_path, analysis, args)
+        except TypeError as error:
+            # e.g. a missing argument
+            raise QueryError(400, str(error)) from None
+        finally:
+            del self._in_flight[key]
+
+        self._responses[key] = result
+        if len(self._responses) > self.cache_entries:
+            self._responses.popitem(last=False)
+        return result
+
+    def describe(self) -> dict:
+        """ The analyses served and the arguments each one takes. """
+        return {analysis: [name for name in inspect.signature(function).parameters
+                           if name not in _SHARED_ARGUMENTS]
+                for analysis, function in ANALYSES.items()}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """ Answer a single HTTP request on a connection. """
+        status, body = 200, None
+        try:
+            method, path, payload = await _read_request(reader)
+            if path == '/health':
+                body = {'status': 'ok', 'cache_hits': self.hits,
+                        'cache_misses': self.misses, 'coalesced': self.coalesced}
+            elif path == '/analyses':
+                body = self.describe()
+            elif path == '/query':
+                if method != 'POST':
+                    raise QueryError(405, "Query: use POST")
+                try:
+                    request = json.loads(payload or b'{}')
+                except ValueError:
+                    raise QueryError(400, "Query: the body is not valid JSON") from None
+                if not isinstance(request, dict):
+                    raise QueryError(400, "Query: expected a JSON object")
+                args = request.get('args', {})
+                result = await self.query(request.get('analysis'), args)
+                body = {'analysis': request.get('analysis'), 'args': args, 'result': result}
+            else:
+                raise QueryError(404, f"Path: '{path}' not found")
+        except QueryError as error:
+            status, body = error.status, {'error': str(error)}
+        except Exception as error:
+            status, body = 500, {'error': f"{type(error).__name__}: {error}"}
+
+        content = json.dumps(body).encode('utf8')
+        writer.write(f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                     f"Content-Type: application/json\r\n"
+                     f"Content-Length: {len(content)}\r\n"
+                     f"Connection: close\r\n\r\n".encode('latin-1') + content)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        """ Serve requests until cancelled. """
+        server = await asyncio.start_server(self.handle, host, port)
+        addresses = ', '.join(str(sock.getsockname()) for sock in server.sockets)
+        print(f"Serving {len(ANALYSES)} analyses of {self.file_path} on {addresses}")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown()
+
+
+async def _read_request(reader: asyncio.StreamReader) -> tuple:
+    """
+    Returns:
+        tuple: the method, the path without its query string and the body.
+    """
+    request_line = (await reader.readline()).decode('latin-1').split()
+    if len(request_line) != 3:
+        raise QueryError(400, "Request: malformed request line")
+    method, target, _ = request_line
+
+    content_length = 0
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        if name.strip().lower() == 'content-length':
+            try:
+                content_length = int(value)
+            except ValueError:
+                raise QueryError(400, "Request: invalid Content-Length") from None
+    if content_length > MAX_BODY_BYTES:
+        raise QueryError(413, "Request: body too large")
+    payload = await reader.readexactly(content_length) if content_length else b''
+    return method.upper(), target.split('?', 1)[0], payload
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m src.wrangling.query_service',
+        description="Serve the lung cancer analyses over HTTP/JSON.")
+    parser.add_argument('--data', default='Data/lung_cancer_data.csv',
+                        help="CSV file to analyse (default: %(default)s)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    service = QueryService(args.data, args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
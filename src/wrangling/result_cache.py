@@ -0,0 +1,364 @@
+"""
+    Persistent cache of analysis results, kept on disk between sessions,
+    so that re-running a notebook or report in a fresh kernel reads the
+    results instead of computing them again.
+
+    A result is keyed by a content hash of the file(s) the data was loaded
+    from, the name of the function and its arguments. The arguments an
+    analysis itself normalises, e.g. an ethnicity, are normalised the same
+    way, so 'asian' and 'Asian ' share an entry, the rest are kept verbatim.
+    Only data returned by the package's loaders is cached. The loaders
+    register the files it came from, see register_source. Like the in-memory
+    aggregate cache, a loaded frame edited in place is not detected.
+
+    Disabled until enable() is called. The least recently used entries are
+    evicted once the cache grows past its size limit.
+
+    Usage:
+        from src.wrangling import result_cache
+        result_cache.enable()
+        python -m src.wrangling.result_cache            # list the entries
+        python -m src.wrangling.result_cache --clear
+"""
+import argparse
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+import weakref
+
+from . import instrumentation
+from .columnar_cache import CACHE_DIR, cache_file_path, write_cache
+
+# largest total size of the cached results, in bytes
+DEFAULT_MAX_BYTES = 256 << 20
+
+# extension of the cached result files
+_ENTRY_EXTENSION = ".result"
+
+_cache_dir = None
+_max_bytes = DEFAULT_MAX_BYTES
+
+# id of a loaded object -> (the (path, size, mtime) of each source file, load options)
+_sources = {}
+# (path, size, mtime) of a file -> its content hash, for this process
+_file_hashes = {}
+
+
+def default_cache_dir() -> str:
+    """ The 'results' directory of the cache directory inside the data directory. """
+    # imported here, as user_selections is part of the interactive interface
+    from .userInterface.user_selections import data_path
+    return os.path.join(data_path, CACHE_DIR, "results")
+
+
+def enable(cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Start reading and writing cached results.
+
+    Args:
+        cache_dir (str): where the results are kept, see default_cache_dir.
+        max_bytes (int): total size of the results kept before the least
+                         recently used are evicted.
+    """
+    global _cache_dir, _max_bytes
+    _cache_dir = cache_dir or default_cache_dir()
+    _max_bytes = max_bytes
+    os.makedirs(_cache_dir, exist_ok=True)
+
+
+def disable():
+    """ Stop using the cache, the cached results are kept on disk. """
+    global _cache_dir
+    _cache_dir = None
+
+
+def enabled() -> bool:
+    return _cache_dir is not None
+
+
+def _stamp(file_path: str) -> tuple:
+    stat = os.stat(file_path)
+    return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+
+def register_source(data, file_paths: list, **options):
+    """
+    Record which files a loaded object was read from, so results computed
+    from it can be cached. Called by the loaders.
+
+    Args:
+        data: the loaded rows, ColumnStore, DataFrame or dataset.
+        file_paths (list): paths of the files it was read from.
+        options: load options that change the results, e.g. columnar or downcast_floats.
+    """
+    key = id(data)
+    _sources[key] = (tuple(_stamp(file_path) for file_path in file_paths), options)
+    weakref.finalize(data, _sources.pop, key, None)
+
+
+def file_hash(file_path: str) -> str:
+    """
+    Args:
+        file_path (str): path of a source file.
+
+    Returns:
+        str: SHA-256 hash of the file's content, kept alongside the file's
+             other cached copies while the file is unchanged.
+    """
+    stamp = _stamp(file_path)
+    digest = _file_hashes.get(stamp)
+    if digest is not None:
+        return digest
+
+    hash_path = cache_file_path(file_path, "sha256")
+    if os.path.exists(hash_path):
+        with open(hash_path, encoding='utf8') as fp:
+            digest = fp.read().strip()
+    else:
+        content_hash = hashlib.sha256()
+        with open(file_path, 'rb') as fp:
+            for block in iter(lambda: fp.read(1 << 20), b''):
+                content_hash.update(block)
+        digest = content_hash.hexdigest()
+
+        def write(temp_path):
+            with open(temp_path, 'w', encoding='utf8') as fp:
+                fp.write(digest)
+        write_cache(hash_path, write)
+    _file_hashes[stamp] = digest
+    return digest
+
+
+def _source_fingerprint(data):
+    """ Content hashes and load options of a registered object, None if not cacheable. """
+    source = _sources.get(id(data))
+    if source is None:
+        return None
+    stamps, options = source
+    hashes = []
+    for stamp in stamps:
+        try:
+            if _stamp(stamp[0]) != stamp:
+                # the file has changed since the data was loaded
+                return None
+        except FileNotFoundError:
+            return None
+        hashes.append(file_hash(stamp[0]))
+    return hashes, options
+
+
+# the text arguments of the analyses, entered at the prompts and matched case-insensitively
+NORMALISED_ARGUMENTS = ('ethnicity', 'treatment', 'gender')
+
+
+def normalise_argument(value):
+    """
+    Text is compared as the analyses compare it, after _capitalise_input
+    and casefolding, other values are kept as they are.
+    """
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    return value
+
+
+def _key_data(value):
+    """ A JSON compatible, canonical form of an argument, e.g. of a Query. """
+    if isinstance(value, (set, frozenset)):
+        return sorted((_key_data(item) for item in value), key=repr)
+    if isinstance(value, (list, tuple)):
+        return [_key_data(item) for item in value]
+    if isinstance(value, dict):
+        return {str(name): _key_data(item) for name, item in value.items()}
+    if hasattr(value, '__dict__'):
+        return {'type': type(value).__name__, **_key_data(vars(value))}
+    return value
+
+
+def cached_result(source: str, ignore=(), normalise=()):
+    """
+    Decorator keeping the results of an analysis in the cache, while enabled.
+
+    Args:
+        source (str): name of the argument holding the loaded data.
+        ignore (tuple): names of arguments that do not change the result,
+                        e.g. indexes or an aggregate cube of the same data.
+        normalise (tuple): names of the text arguments the analysis matches
+                           case-insensitively, see normalise_argument.
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+        function_name = f"{function.__module__.rsplit('.', 1)[-1]}.{function.__name__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _cache_dir is None:
+                return function(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            fingerprint = _source_fingerprint(bound.arguments[source])
+            if fingerprint is None:
+                return function(*args, **kwargs)
+
+            arguments = _key_data({name: normalise_argument(value) if name in normalise else value
+                                   for name, value in bound.arguments.items()
+                                   if name != source and name not in ignore})
+            key = hashlib.sha256(json.dumps([function_name, fingerprint, arguments],
+                                            sort_keys=True, default=repr).encode('utf8'))
+            entry_path = os.path.join(_cache_dir, key.hexdigest() + _ENTRY_EXTENSION)
+
+            found, result = _read_entry(entry_path)
+            if found:
+                instrumentation.count('result_cache_hits')
+                return result
+            instrumentation.count('result_cache_misses')
+            result = function(*args, **kwargs)
+            _write_entry(entry_path, {'function': function_name, 'arguments': arguments,
+                                      'created': time.time()}, result)
+            return result
+        return wrapper
+    return decorator
+
+
+def _read_entry(entry_path: str) -> tuple:
+    """
+    Returns:
+        tuple: whether the entry was found, and the cached result.
+    """
+    try:
+        with open(entry_path, 'rb') as fp:
+            pickle.load(fp)
+            result = pickle.load(fp)
+    except FileNotFoundError:
+        return False, None
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        # unreadable, e.g. written by an incompatible version, so computed again
+        _remove(entry_path)
+        return False, None
+    # the modification time records when the entry was last used, for eviction
+    os.utime(entry_path)
+    return True, result
+
+
+def _write_entry(entry_path: str, metadata: dict, result):
+    # the metadata is pickled first, so entries can be listed without loading the results
+    temp_path = f"{entry_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as fp:
+            pickle.dump(metadata, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(result, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, entry_path)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError):
+        # results that can not be stored are simply not cached
+        _remove(temp_path)
+        return
+    _evict(_cache_dir, _max_bytes)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _entry_paths(cache_dir: str) -> list:
+    try:
+        names = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(cache_dir, name) for name in names if name.endswith(_ENTRY_EXTENSION)]
+
+
+def _evict(cache_dir: str, max_bytes: int):
+    """ Remove the least recently used entries until the cache fits in max_bytes. """
+    entries = []
+    for entry_path in _entry_paths(cache_dir):
+        try:
+            stat = os.stat(entry_path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, entry_path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove(entry_path)
+        total -= size
+
+
+def cache_entries(cache_dir=None) -> list:
+    """
+    Args:
+        cache_dir (str): the cache directory, defaults to the enabled one.
+
+    Returns:
+        list: a dictionary per cached result, of its function, arguments,
+              size in bytes, creation time and last use, most recent first.
+    """
+    cache_dir = cache_dir or _cache_dir or default_cache_dir()
+    entries = []
+    for entry_path in _entry_paths(cache_dir):
+        try:
+            with open(entry_path, 'rb') as fp:
+                metadata = pickle.load(fp)
+            stat = os.stat(entry_path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            continue
+        entries.append({**metadata, 'path': entry_path, 'bytes': stat.st_size,
+                        'last_used': stat.st_mtime})
+    return sorted(entries, key=lambda entry: entry['last_used'], reverse=True)
+
+
+def clear(cache_dir=None, function=None) -> int:
+    """
+    Remove cached results.
+
+    Args:
+        cache_dir (str): the cache directory, defaults to the enabled one.
+        function (str): only the results of this function, e.g.
+                        'extract_data_pd.gender_survival_blood_pressure' or
+                        just 'gender_survival_blood_pressure'.
+
+    Returns:
+        int: the number of results removed.
+    """
+    cache_dir = cache_dir or _cache_dir or default_cache_dir()
+    if function is None:
+        entry_paths = _entry_paths(cache_dir)
+    else:
+        entry_paths = [entry['path'] for entry in cache_entries(cache_dir)
+                       if function in (entry['function'], entry['function'].rsplit('.', 1)[-1])]
+    for entry_path in entry_paths:
+        _remove(entry_path)
+    return len(entry_paths)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m src.wrangling.result_cache',
+                                     description="List or clear the cached analysis results.")
+    parser.add_argument('--dir', default=None,
+                        help="the cache directory (default: the data directory's cache)")
+    parser.add_argument('--clear', action='store_true', help="remove the cached results")
+    parser.add_argument('--function', default=None,
+                        help="only the results of this function")
+    args = parser.parse_args(argv)
+
+    if args.clear:
+        print(f"{clear(args.dir, args.function)} cached results removed")
+        return 0
+    entries = [entry for entry in cache_entries(args.dir) if args.function is None
+               or args.function in (entry['function'], entry['function'].rsplit('.', 1)[-1])]
+    for entry in entries:
+        print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used']))}  "
+              f"{entry['bytes']:>10}  {entry['function']}  {json.dumps(entry['arguments'])}")
+    print(f"{len(entries)} cached results, {sum(entry['bytes'] for entry in entries)} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
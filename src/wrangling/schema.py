@@ -0,0 +1,30 @@
+"""
+    Declared column types of the lung cancer dataset.
+
+    Shared by the loaders so that every path interprets
+    the raw CSV text in the same way.
+"""
+
+# whole number measurements
+INTEGER_COLUMNS = ['Patient_ID', 'Age', 'Survival_Months', 'Performance_Status',
+                   'Blood_Pressure_Systolic', 'Blood_Pressure_Diastolic',
+                   'Blood_Pressure_Pulse']
+
+# real number measurements
+FLOAT_COLUMNS = ['Tumor_Size_mm', 'Haemoglobin_Level',
+                 'White_Blood_Cell_Count', 'Smoking_Pack_Years',
+                 # blood test results
+                 'Platelet_Count', 'Albumin_Level', 'Alkaline_Phosphatase_Level',
+                 'Alanine_Aminotransferase_Level', 'Aspartate_Aminotransferase_Level',
+                 'Creatinine_Level', 'LDH_Level', 'Calcium_Level', 'Phosphorus_Level',
+                 'Glucose_Level', 'Potassium_Level', 'Sodium_Level']
+
+# labels taken from a small, fixed set of values
+CATEGORY_COLUMNS = ['Gender', 'Ethnicity', 'Treatment', 'Stage',
+                    'Tumor_Location', 'Insurance_Type', 'Smoking_History']
+
+# every column starting with this prefix is a yes/no flag
+BOOLEAN_PREFIX = 'Comorbidity_'
+
+# how the yes/no flags are written in the CSV file
+BOOLEAN_VALUES = {'Yes': True, 'No': False}
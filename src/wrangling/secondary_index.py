@@ -0,0 +1,313 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain
+
+from .column_store import ColumnStore, CATEGORY
+
+# columns filtered on by range predicates in the query functions
+SORTED_COLUMNS = ['Survival_Months', 'Blood_Pressure_Diastolic']
+# columns filtered on by category predicates in the query functions
+BITMAP_COLUMNS = ['Ethnicity', 'Comorbidity_Hypertension']
+# DataFrame columns filtered on by range predicates
+FRAME_SORTED_COLUMNS = ['Blood_Pressure_Pulse', 'Tumor_Size_mm']
+
+
+class SortedIndex:
+    """
+    The values of a numeric column in ascending order, alongside the row
+    each value came from. Range predicates become a binary search and
+    a slice of the row numbers, rather than a scan of every row.
+
+    The row numbers returned are in value order, not row order.
+    """
+
+    def __init__(self, values, rows):
+        """
+        Args:
+            values (sequence): column values, sorted ascending.
+            rows (sequence): row number of each sorted value.
+        """
+        self.values = values
+        self.rows = rows
+        # a second, smaller index of the rows added by extend
+        self._appended_values = []
+        self._appended_rows = array('q')
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        Args:
+            values (sequence): column values, in row order.
+
+        Returns:
+            SortedIndex: index over the values.
+        """
+        order = sorted(range(len(values)), key=values.__getitem__)
+        return cls([values[row] for row in order], array('q', order))
+
+    def extend(self, values, first_row: int):
+        """
+        Add the values of rows appended to the data, for indexes built by
+        build_indexes. The appended rows are kept in a second index, which is
+        merged into this one once it grows past an eighth of its size, so
+        on average an append costs time in proportion to the rows appended.
+
+        Args:
+            values (sequence): column values of the appended rows, in row order.
+            first_row (int): row number of the first appended row.
+        """
+        # sorting the pairs merges the already sorted runs, in C
+        appended = sorted(chain(zip(self._appended_values, self._appended_rows),
+                                zip(values, range(first_row, first_row + len(values)))))
+        if len(appended) * 8 > len(self.values):
+            appended = sorted(chain(zip(self.values, self.rows), appended))
+            self.values = [value for value, _ in appended]
+            self.rows = array('q', [row for _, row in appended])
+            appended = []
+        self._appended_values = [value for value, _ in appended]
+        self._appended_rows = array('q', [row for _, row in appended])
+
+    def greater_than(self, value):
+        return self._slice(lambda values: bisect_right(values, value), None)
+
+    def at_least(self, value):
+        return self._slice(lambda values: bisect_left(values, value), None)
+
+    def less_than(self, value):
+        return self._slice(None, lambda values: bisect_left(values, value))
+
+    def at_most(self, value):
+        return self._slice(None, lambda values: bisect_right(values, value))
+
+    def between(self, low, high):
+        """ Rows where low < value < high. """
+        return self._slice(lambda values: bisect_right(values, low),
+                           lambda values: bisect_left(values, high))
+
+    def _slice(self, start, stop):
+        """
+        Args:
+            start (function): position of the first row in a list of sorted values,
+                              None from the smallest value.
+            stop (function): position after the last row, None to the largest value.
+        """
+        rows = self.rows[start(self.values) if start else None:
+                         stop(self.values) if stop else None]
+        if self._appended_values:
+            values = self._appended_values
+            rows = rows + self._appended_rows[start(values) if start else None:
+                                              stop(values) if stop else None]
+        return rows
+
+
+class BitmapIndex:
+    """
+    One bitmap per distinct value of a label column, held as a Python int
+    where bit n is set when row n has that value. Category predicates
+    are answered by OR-ing the bitmaps of the matching values.
+    """
+
+    def __init__(self, bitmaps: dict, num_rows: int):
+        """
+        Args:
+            bitmaps (dict): column value mapped to its bitmap.
+            num_rows (int): number of rows covered by the bitmaps.
+        """
+        self._bitmaps = bitmaps
+        self.num_rows = num_rows
+        # (first row, value -> bitmap) of the rows added by each extend, not yet merged
+        self._segments = []
+
+    @property
+    def bitmaps(self) -> dict:
+        """ Column value mapped to its bitmap, of every row including those appended. """
+        if self._segments:
+            self._merge_segments()
+        return self._bitmaps
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        Args:
+            values (iterable): column values, in row order.
+
+        Returns:
+            BitmapIndex: index over the values.
+        """
+        positions = {}
+        num_rows = 0
+        for row, value in enumerate(values):
+            positions.setdefault(value, []).append(row)
+            num_rows = row + 1
+
+        ''' set the bits in a byte buffer and convert once,
+            OR-ing into a growing int for each row is quadratic.
+        '''
+        bitmaps = {}
+        for value, rows in positions.items():
+            bits = bytearray((num_rows + 7) // 8)
+            for row in rows:
+                bits[row >> 3] |= 1 << (row & 7)
+            bitmaps[value] = int.from_bytes(bits, 'little')
+        return cls(bitmaps, num_rows)
+
+    def extend(self, values):
+        """
+        Add the values of rows appended to the data, numbered on from num_rows.
+        The bitmaps of the appended rows are kept as a separate segment, in
+        time proportional to the rows appended, and only shifted into place
+        when the bitmaps are next read, at a cost similar to the read itself.
+
+        Args:
+            values (iterable): column values of the appended rows, in row order.
+        """
+        appended = BitmapIndex.from_values(values)
+        if appended.num_rows:
+            self._segments.append((self.num_rows, appended._bitmaps))
+            self.num_rows += appended.num_rows
+
+    def _merge_segments(self):
+        """ Shift the segments of the appended rows into the bitmaps, all at once. """
+        first_row = self._segments[0][0]
+        # the segments are merged with each other first, so each bitmap is shifted once
+        appended = {}
+        for segment_row, bitmaps in self._segments:
+            for value, bitmap in bitmaps.items():
+                appended[value] = appended.get(value, 0) | bitmap << (segment_row - first_row)
+        for value, bitmap in appended.items():
+            self._bitmaps[value] = self._bitmaps.get(value, 0) | bitmap << first_row
+        self._segments = []
+
+    def labels(self) -> list:
+        return list(self.bitmaps)
+
+    def bitmap(self, value) -> int:
+        return self.bitmaps.get(value, 0)
+
+    def matching(self, predicate) -> int:
+        """
+        Args:
+            predicate (function): called with each distinct column value.
+
+        Returns:
+            int: bitmap of the rows whose value satisfies the predicate.
+        """
+        bitmap = 0
+        for value, value_bitmap in self.bitmaps.items():
+            if predicate(value):
+                bitmap |= value_bitmap
+        return bitmap
+
+
+def bitmap_rows(bitmap: int) -> list:
+    """
+    Args:
+        bitmap (int): bitmap of rows.
+
+    Returns:
+        list: the row numbers of the set bits, in ascending order.
+    """
+    # least significant bit first, so the string position is the row number
+    bits = bin(bitmap)[:1:-1]
+    rows = []
+    row = bits.find('1')
+    while row != -1:
+        rows.append(row)
+        row = bits.find('1', row + 1)
+    return rows
+
+
+def rows_bitmap(rows) -> int:
+    """
+    Args:
+        rows (iterable): row numbers.
+
+    Returns:
+        int: bitmap with the bit of each row set.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    bits = bytearray(max(rows) // 8 + 1)
+    for row in rows:
+        bits[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def build_indexes(csv_reader, patient_headers: dict, sorted_columns=SORTED_COLUMNS,
+                  bitmap_columns=BITMAP_COLUMNS) -> dict:
+    """
+    Build the secondary indexes used by the csv query functions.
+    Intended to be called once, straight after loading the data.
+    The indexes describe the rows as loaded and must be rebuilt
+    if the rows change, or extended with extend_indexes
+    when rows are appended.
+
+    Args:
+        csv_reader (list): rows of data, or a ColumnStore.
+        patient_headers (dict): mapping of column headers to their respective
+                                column index.
+        sorted_columns (list): numeric columns to index for range predicates.
+        bitmap_columns (list): label columns to index for category predicates.
+
+    Returns:
+        dict: column header mapped to its SortedIndex or BitmapIndex.
+    """
+    indexes = {}
+    for column in sorted_columns:
+        if isinstance(csv_reader, ColumnStore):
+            values = csv_reader.column(column)
+        else:
+            values = [float(record[patient_headers[column]])
+                      for record in csv_reader]
+        indexes[column] = SortedIndex.from_values(values)
+
+    for column in bitmap_columns:
+        if isinstance(csv_reader, ColumnStore):
+            values = csv_reader.column(column)
+            if csv_reader.kinds[column] == CATEGORY:
+                labels = csv_reader.categories(column)
+                values = (labels[code] for code in values)
+        else:
+            values = (record[patient_headers[column]] for record in csv_reader)
+        indexes[column] = BitmapIndex.from_values(values)
+    return indexes
+
+
+def extend_indexes(indexes: dict, records: list, patient_headers: dict, first_row: int):
+    """
+    Update the indexes from build_indexes with rows appended to the data.
+
+    Args:
+        indexes (dict): column header mapped to its SortedIndex or BitmapIndex.
+        records (list): the appended rows of data.
+        patient_headers (dict): mapping of column headers to their respective
+                                column index.
+        first_row (int): row number of the first appended row.
+    """
+    for column, index in indexes.items():
+        position = patient_headers[column]
+        if isinstance(index, SortedIndex):
+            index.extend([float(record[position]) for record in records], first_row)
+        else:
+            index.extend(record[position] for record in records)
+
+
+def build_frame_indexes(lung_cancer_df, sorted_columns=FRAME_SORTED_COLUMNS) -> dict:
+    """
+    Build sorted indexes over DataFrame columns, see build_indexes.
+    Row numbers are positions, for use with DataFrame.iloc
+
+    Args:
+        lung_cancer_df (DataFrame): lung cancer data frame.
+        sorted_columns (list): numeric columns to index for range predicates.
+
+    Returns:
+        dict: column header mapped to its SortedIndex.
+    """
+    indexes = {}
+    for column in sorted_columns:
+        values = lung_cancer_df[column].to_numpy()
+        order = values.argsort(kind='stable')
+        indexes[column] = SortedIndex(values[order], order)
+    return indexes
@@ -1,5 +1,78 @@
+import sys
+from itertools import islice
 
-def display_extracted_data(columns: list, records: list, limit_rows=50):
+from ...instrumentation import count, traced
+
+# rows formatted and written to the sink at a time
+BATCH_ROWS = 1000
+
+
+@traced('render.render_table')
+def render_table(columns: list, rows, sink=None, limit_rows=None, batch_size=BATCH_ROWS,
+                 widths=None) -> int:
+    """
+    Write rows to a sink as a pretty, tabular text table, a batch at a time,
+    so that tables of any length are written in constant memory.
+
+    Each column is as wide as its header or its longest value in the first
+    batch of rows, whichever is wider. Longer values further down are not
+    cut short, they only push out the rest of their own line.
+
+    Args:
+        columns (list): string names of the columns.
+        rows (iterable): a tuple, or other sequence, of values per row,
+                         in the order of the columns.
+        sink (file): any object with a write method, defaults to sys.stdout.
+        limit_rows (int): stop after this many rows, all rows when omitted.
+        batch_size (int): number of rows formatted per write.
+        widths (list): fixed column widths, skips measuring the first batch.
+
+    Returns:
+        int: the number of rows written.
+    """
+    if sink is None:
+        sink = sys.stdout
+    rows = iter(rows if limit_rows is None else islice(rows, limit_rows))
+    batch = list(islice(rows, batch_size))
+    if widths is None:
+        widths = [len(col) for col in columns]
+        for row in batch:
+            for n, value in enumerate(row):
+                if len(str(value)) > widths[n]:
+                    widths[n] = len(str(value))
+
+    # a single format string per table, so each row is formatted in one step
+    row_format = "|" + "".join(f" %-{width}s |" for width in widths) + "\n"
+    header_row = row_format % tuple(columns)
+    sink.write(f"{header_row}{'-' * (len(header_row) - 1)}\n")
+
+    written = 0
+    while batch:
+        sink.write("".join([row_format % tuple(row) for row in batch]))
+        written += len(batch)
+        batch = list(islice(rows, batch_size))
+    count('rows_rendered', written)
+    return written
+
+
+def render_columns(columns: list, arrays: list, sink=None, limit_rows=None,
+                   batch_size=BATCH_ROWS, widths=None) -> int:
+    """
+    Write column arrays, e.g. the typed columns of a ColumnStore or the
+    arrays of a DataFrame, as a table without building a record per row.
+    See render_table.
+
+    Args:
+        columns (list): string names of the columns.
+        arrays (list): one sequence of values per column, of equal length.
+
+    Returns:
+        int: the number of rows written.
+    """
+    return render_table(columns, zip(*arrays), sink, limit_rows, batch_size, widths)
+
+
+def display_extracted_data(columns: list, records: list, limit_rows=50, sink=None):
     """
     Print the data extract in a pretty, tablular style
 
@@ -8,50 +81,22 @@ def display_extracted_data(columns: list, records: list, limit_rows=50):
                         the records passed to the function.
 
         records (list): a list of dictionaries containing 
-                        the relevant data to be displayed
+                        the relevant data to be displayed,
+                        or a tuple of values per row.
+        limit_rows (int): the most rows to display.
+        sink (file): where to write the table, defaults to sys.stdout.
     """
+    if sink is None:
+        sink = sys.stdout
     # Base case - if no records where found, tell the user
     if len(records) == 0:
-        print("No records found!")
+        print("No records found!", file=sink)
         return
 
-    ''' find the longest header name which will be used to
-        specific the header width for all columns. '''
-    column_width = max([len(col) for col in columns])
-    separator = '|'
-    formatted_cols = [separator]
-    for col in columns:
-        # left-align by, at most, the maximum desired column width
-        formatted_cols.append(f" {col:<{column_width}} |")
-
-    # This tightly joins each header to the adjacent separator.
-    header_row = "".join(formatted_cols)
-    # underline the table header and print both
-    print(f"{header_row}\n{'-' * len(header_row)}")
-
-    item_cols = ['|']
-    count = 0
-    limit_reached = False
-    for record in records:
-        if limit_reached:
-            break
-        for value in record.values():
-            item_cols.append(f" {value:<{column_width}} |")
-            count += 1
-            if count == len(columns):
-                # place the next set of data on the next line
-                item_cols.append('\n')
-                item_cols.append(separator)
-                limit_rows -= 1
-                count = 0
-            if limit_rows == 0:
-                limit_reached = True
-                break
-
-    # get rid of the trailing separator which appears on a new line at the end of the table
-    item_cols.pop(-1)
-    # display each row of data, formatted to align to the table display
-    print("".join(item_cols))
+    rows = (record.values() if isinstance(record, dict) else record
+            for record in records)
+    render_table(columns, (tuple(row) for row in rows), sink, limit_rows)
+    sink.write("\n")
 
 
 def extract_data(columns: list, record: list, patient_headers: dict) -> list:
@@ -73,11 +118,4 @@ def extract_data(columns: list, record: list, patient_headers: dict) -> list:
     Returns:
         dict: of values mapped to keys from the specified columns.
     """
-    records = {}
-    for column in columns:
-        records.update(
-            {
-                column: record[patient_headers[column]]
-            }
-        )
-    return records
+    return {column: record[patient_headers[column]] for column in columns}
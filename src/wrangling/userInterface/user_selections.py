@@ -2,20 +2,39 @@ import os
 
 # constant - directory where the datasets are stored
 data_path = "Data/"
-# list all files in the dataset directory
-data_files = os.listdir(data_path)
+
+
+def list_data_files() -> list:
+    """
+    List the CSV files in the dataset directory, when they are asked for
+    rather than on import, so that importing does not need the directory.
+    Hidden entries, such as the '.cache' directory of cached copies, are
+    left out.
+
+    Returns:
+        list: names of the .csv files in the dataset directory, which
+              set_user_file accepts, empty if the directory does not exist.
+    """
+    try:
+        names = os.listdir(data_path)
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names
+                  if not name.startswith('.') and name.endswith('.csv')
+                  and os.path.isfile(os.path.join(data_path, name)))
 
 
 def set_user_file():
     """
-    Select the .csv file from the user's input
+    Select the .csv file from the user's input, or a pattern
+    such as 'site_*.csv' to analyse every matching file together.
 
     Returns:
         string: file name (with extension)
     """
     print(
         f"The available files to analyse, in the '{data_path[:-1]}' directory:")
-    print("\t\n".join(data_files))
+    print("\t\n".join(list_data_files()))
     while True:
         file_name = input(
             "Enter the name of the CSV file from the Data directory or 'quit' ('q') to quit...")
@@ -1,9 +1,53 @@
-import matplotlib.pyplot as plt
-import pandas as pd
-import numpy as np
+from __future__ import annotations
 
+import os
+from typing import TYPE_CHECKING
 
-def plot_treatment_proportion_for_ethnicity(ethnicity: str, treatment_count_series: pd.Series):
+if TYPE_CHECKING:
+    import pandas as pd
+
+# file extensions the charts can be rendered to
+CHART_FORMATS = {'.png', '.svg', '.pdf'}
+
+# figure size -> figure reused by every chart of that size rendered to a file, per process
+_figures = {}
+
+
+def _chart_axes(figsize: tuple, file_path=None, ax=None):
+    """
+        The axes a chart is drawn on: the given axes, a cleared figure
+        reused between charts rendered to a file, or else a new pyplot
+        figure to be shown.
+    """
+    if ax is not None:
+        return ax
+    if file_path is None:
+        import matplotlib.pyplot as plt
+        return plt.figure(figsize=figsize).add_subplot()
+
+    figure = _figures.get(figsize)
+    if figure is None:
+        # not managed by pyplot, so rendering never starts a GUI event loop
+        from matplotlib.figure import Figure
+        figure = _figures[figsize] = Figure(figsize=figsize)
+    figure.clear()
+    return figure.add_subplot()
+
+
+def _finish_chart(ax, file_path=None, show=True):
+    """
+        Write the chart to a file, its format taken from the extension,
+        or show it when no file is given.
+    """
+    if file_path is not None:
+        ax.figure.savefig(file_path)
+    elif show:
+        import matplotlib.pyplot as plt
+        plt.show()
+
+
+def plot_treatment_proportion_for_ethnicity(ethnicity: str, treatment_count_series: pd.Series,
+                                            file_path=None, ax=None):
     """
         Plot a pie chart of the proportion of treatments
         for a given ethnic group.
@@ -12,28 +56,31 @@ def plot_treatment_proportion_for_ethnicity(ethnicity: str, treatment_count_seri
             ethnicity (str): user-specified ethnic group
             treatment_count_series (Series): a series of treatment counts
                                              indexed by treatment type
+            file_path (str): write the chart to this PNG, SVG or PDF file
+                             instead of showing it.
+            ax (Axes): draw onto these axes instead of a new figure.
     """
-
     # retrieve the index lables from the Series and put them into a list
     treatment_labels = treatment_count_series.index.to_list()
     # get the values of the Series and put into a list
     treatment_count = treatment_count_series.to_list()
 
     # create a figure
-    plt.figure(figsize=(10, 6))
+    chart = _chart_axes((10, 6), file_path, ax)
 
     # plot a pie chart
-    plt.pie(treatment_count, labels=treatment_labels, autopct='%1.1f%%')
+    chart.pie(treatment_count, labels=treatment_labels, autopct='%1.1f%%')
 
     # set a plot title and legend
-    plt.title(f"Pie Chart: Cancer treatment for {ethnicity} ethnic group")
-    plt.legend(loc="upper left", bbox_to_anchor=(0.9, 1))
+    chart.set_title(f"Pie Chart: Cancer treatment for {ethnicity} ethnic group")
+    chart.legend(loc="upper left", bbox_to_anchor=(0.9, 1))
 
     # show the chart
-    plt.show()
+    _finish_chart(chart, file_path, show=ax is None)
 
 
-def plot_smoking_packs_cancer_stage(ethnic_grp_cancer_stage_df: pd.DataFrame):
+def plot_smoking_packs_cancer_stage(ethnic_grp_cancer_stage_df: pd.DataFrame,
+                                    file_path=None, ax=None):
     """
     Create a line chat to plot the trend of average smoking packs against
     cancer stage.
@@ -43,21 +90,24 @@ def plot_smoking_packs_cancer_stage(ethnic_grp_cancer_stage_df: pd.DataFrame):
         ethnic_grp_cancer_stage_df (DataFrame): mean smoking pack years
                                                 for each cancer stage and
                                                 ethnic group
+        file_path (str): write the chart to this file instead of showing it.
+        ax (Axes): draw onto these axes instead of a new figure.
     """
-    plt.figure(figsize=(20, 10))
-    for ethnicity, group in ethnic_grp_cancer_stage_df.groupby('Ethnicity'):
-        plt.plot(group['Stage'], group['Smoking_Pack_Years'],
-                 label=ethnicity)
+    chart = _chart_axes((20, 10), file_path, ax)
+    for ethnicity, group in ethnic_grp_cancer_stage_df.groupby('Ethnicity', observed=True):
+        chart.plot(group['Stage'], group['Smoking_Pack_Years'],
+                   label=ethnicity)
 
-    plt.xlabel("Cancer Stage")
-    plt.ylabel("Average (mean) Smoking Pack Years")
-    plt.title(
+    chart.set_xlabel("Cancer Stage")
+    chart.set_ylabel("Average (mean) Smoking Pack Years")
+    chart.set_title(
         "Ethnic Group Average Smoking Pack Consumption Accross Each Cancer Stage")
-    plt.legend()
-    plt.show()
+    chart.legend()
+    _finish_chart(chart, file_path, show=ax is None)
 
 
-def plot_blood_pressure_treatment(treatment_blood_pressure_df: pd.DataFrame):
+def plot_blood_pressure_treatment(treatment_blood_pressure_df: pd.DataFrame,
+                                  file_path=None, ax=None):
     """
     plot the average blood pressure readings
     gathered from each treatment
@@ -66,40 +116,43 @@ def plot_blood_pressure_treatment(treatment_blood_pressure_df: pd.DataFrame):
     Args:
         blood_pressure_data (DataFrame): columns, mean blood pressure readings.
                                          rows, treatment.
+        file_path (str): write the chart to this file instead of showing it.
+        ax (Axes): draw onto these axes instead of a new figure.
     """
+    import numpy as np
 
     x_treatment = treatment_blood_pressure_df.index.to_list()
     # in order to divide a bar into three, a numpy array is required to offset the bar
     x_axis = np.arange(len(x_treatment))
 
-    plt.figure(figsize=(10, 8))
+    chart = _chart_axes((10, 8), file_path, ax)
 
     blood_pressure_bars = []
-    blood_pressure_bars.append(plt.bar(
+    blood_pressure_bars.append(chart.bar(
         x_axis-0.3, treatment_blood_pressure_df['Blood_Pressure_Systolic'], width=0.3,
         label=treatment_blood_pressure_df['Blood_Pressure_Systolic'].name))
 
-    blood_pressure_bars.append(plt.bar(
+    blood_pressure_bars.append(chart.bar(
         x_axis, treatment_blood_pressure_df['Blood_Pressure_Diastolic'], width=0.3,
         label=treatment_blood_pressure_df['Blood_Pressure_Diastolic'].name))
 
-    blood_pressure_bars.append(plt.bar(
+    blood_pressure_bars.append(chart.bar(
         x_axis+0.3, treatment_blood_pressure_df['Blood_Pressure_Pulse'], width=0.3,
         label=treatment_blood_pressure_df['Blood_Pressure_Pulse'].name))
 
     for bar in blood_pressure_bars:
-        plt.bar_label(bar, fmt="%.2f")
+        chart.bar_label(bar, fmt="%.2f")
 
-    plt.xticks(x_axis, x_treatment)
-    plt.xlabel("Treatment Type")
-    plt.ylabel("Blood Pressure")
-    plt.ylim((70, 140))
-    plt.legend()
-    plt.title("Average Blood Pressure For Each Treatment Type")
-    plt.show()
+    chart.set_xticks(x_axis, x_treatment)
+    chart.set_xlabel("Treatment Type")
+    chart.set_ylabel("Blood Pressure")
+    chart.set_ylim((70, 140))
+    chart.legend()
+    chart.set_title("Average Blood Pressure For Each Treatment Type")
+    _finish_chart(chart, file_path, show=ax is None)
 
 
-def plot_insurer_treatment_data(insurer_treatment_df: pd.DataFrame):
+def plot_insurer_treatment_data(insurer_treatment_df: pd.DataFrame, file_path=None, ax=None):
     """
     Plot a bar chart of counts of different treatment for each insurer
 
@@ -111,9 +164,13 @@ def plot_insurer_treatment_data(insurer_treatment_df: pd.DataFrame):
                             'targeted': (list),
                             'x_axis': np.arange(len(labels)),
                             'labels': (list)}
+        file_path (str): write the chart to this file instead of showing it.
+        ax (Axes): draw onto these axes instead of a new figure.
     """
+    import numpy as np
+
     # in order to get the count of each treatment, the DataFrame must me grouped by Treatment
-    treatment_groups_df = insurer_treatment_df.groupby('Treatment')
+    treatment_groups_df = insurer_treatment_df.groupby('Treatment', observed=True)
     # x axis
     labels = insurer_treatment_df['Insurance_Type'].unique()
     x_axis = np.arange(len(labels))
@@ -123,29 +180,86 @@ def plot_insurer_treatment_data(insurer_treatment_df: pd.DataFrame):
     y_radio = treatment_groups_df.get_group('Radiation Therapy')
     y_targeted = treatment_groups_df.get_group('Targeted Therapy')
 
-    plt.figure(figsize=(15, 10))
+    chart = _chart_axes((15, 10), file_path, ax)
 
     treatment_bars = []
     bar_width = 0.2
     treatment_bars.append(
-        plt.bar(x_axis-0.4, y_chemo['count'], width=bar_width,
-                label=y_chemo['Treatment'].unique()[0]))
+        chart.bar(x_axis-0.4, y_chemo['count'], width=bar_width,
+                  label=y_chemo['Treatment'].unique()[0]))
     treatment_bars.append(
-        plt.bar(x_axis-0.2, y_surgery['count'], width=bar_width,
-                label=y_surgery['Treatment'].unique()[0]))
+        chart.bar(x_axis-0.2, y_surgery['count'], width=bar_width,
+                  label=y_surgery['Treatment'].unique()[0]))
     treatment_bars.append(
-        plt.bar(x_axis, y_radio['count'],
-                width=bar_width, label=y_radio['Treatment'].unique()[0]))
+        chart.bar(x_axis, y_radio['count'],
+                  width=bar_width, label=y_radio['Treatment'].unique()[0]))
     treatment_bars.append(
-        plt.bar(x_axis+0.2, y_targeted['count'],
-                width=bar_width, label=y_targeted['Treatment'].unique()[0]))
+        chart.bar(x_axis+0.2, y_targeted['count'],
+                  width=bar_width, label=y_targeted['Treatment'].unique()[0]))
 
     for bar in treatment_bars:
-        plt.bar_label(bar)
-    plt.xticks(x_axis, labels)
-    plt.xlabel("Insurance Type")
-    plt.ylabel("Treatment Counts")
-    plt.ylim(bottom=1000)
-    plt.legend()
-    plt.title("Treatment Counts For Each Insurance Type")
-    plt.show()
+        chart.bar_label(bar)
+    chart.set_xticks(x_axis, labels)
+    chart.set_xlabel("Insurance Type")
+    chart.set_ylabel("Treatment Counts")
+    chart.set_ylim(bottom=1000)
+    chart.legend()
+    chart.set_title("Treatment Counts For Each Insurance Type")
+    _finish_chart(chart, file_path, show=ax is None)
+
+
+# chart name -> function drawing it, see render_charts
+CHARTS = {'treatment_proportion_for_ethnicity': plot_treatment_proportion_for_ethnicity,
+          'smoking_packs_cancer_stage': plot_smoking_packs_cancer_stage,
+          'blood_pressure_treatment': plot_blood_pressure_treatment,
+          'insurer_treatment_data': plot_insurer_treatment_data}
+
+
+def render_chart(chart: str, file_path: str, *args) -> str:
+    """
+    Render a single chart to a file, without a GUI.
+
+    Args:
+        chart (str): name of the chart, see CHARTS.
+        file_path (str): PNG, SVG or PDF file, created along with its directory.
+        args: the data arguments of the chart's plot function.
+
+    Returns:
+        str: the file path.
+    """
+    if os.path.splitext(file_path)[1].lower() not in CHART_FORMATS:
+        raise ValueError(f"Chart: '{file_path}' is not one of {', '.join(sorted(CHART_FORMATS))}")
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    CHARTS[chart](*args, file_path=file_path)
+    return file_path
+
+
+def _render_job(job: tuple) -> str:
+    chart, file_path, args = job
+    return render_chart(chart, file_path, *args)
+
+
+def render_charts(jobs: list, workers=None) -> list:
+    """
+    Render a batch of charts to files, shared out between worker processes.
+    Each process reuses its figures from one chart to the next.
+
+    Args:
+        jobs (list): a (chart name, file path, tuple of data arguments)
+                     tuple per chart, see render_chart.
+        workers (int): number of worker processes, the charts are
+                       rendered one after another in this process when omitted.
+
+    Returns:
+        list: the file path of each chart, in the order of the jobs.
+    """
+    if not workers or workers < 2 or len(jobs) < 2:
+        return [_render_job(job) for job in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # batches of jobs per task, so that each worker reuses its figures
+        chunk_size = max(1, len(jobs) // (workers * 4))
+        return list(executor.map(_render_job, jobs, chunksize=chunk_size))
@@ -0,0 +1,96 @@
+"""
+    End-to-end tests of the query service, over real HTTP connections.
+
+    Usage, from the repository root:
+        python -m pytest tests
+"""
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from benchmarks.synthetic_data import generate_csv
+from src.wrangling.query_service import QueryService
+
+# seconds to wait for a response, far longer than any query of the test data takes
+TIMEOUT = 30
+
+
+def http_request(port: int, method: str, path: str, body=None) -> tuple:
+    """
+    Send one request and read the response until the server closes the connection.
+
+    Returns:
+        tuple: the status code and the decoded JSON body.
+    """
+    content = json.dumps(body).encode('utf8') if body is not None else b''
+    with socket.create_connection(('127.0.0.1', port), timeout=TIMEOUT) as connection:
+        connection.sendall(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+                           f"Content-Length: {len(content)}\r\n\r\n".encode('latin-1') + content)
+        response = b''
+        # raises socket.timeout if the connection is never closed
+        while chunk := connection.recv(1 << 16):
+            response += chunk
+    head, _, payload = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(payload)
+
+
+class QueryServiceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        file_path = os.path.join(cls.temp_dir.name, 'lung_cancer_data.csv')
+        generate_csv(file_path, 2000)
+        cls.service = QueryService(file_path, workers=2)
+
+        cls.loop = asyncio.new_event_loop()
+        cls.server = cls.loop.run_until_complete(
+            asyncio.start_server(cls.service.handle, '127.0.0.1', 0))
+        cls.port = cls.server.sockets[0].getsockname()[1]
+        cls.thread = threading.Thread(target=cls.loop.run_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.thread.join()
+        cls.server.close()
+        cls.loop.run_until_complete(cls.server.wait_closed())
+        cls.loop.close()
+        cls.service.close()
+        cls.temp_dir.cleanup()
+
+    def test_first_query_connection_is_closed(self):
+        status, body = http_request(self.port, 'POST', '/query',
+                                    {'analysis': 'survival_blood_pressure',
+                                     'args': {'gender': 'male'}})
+        self.assertEqual(status, 200)
+        self.assertTrue(body['result'])
+
+    def test_unknown_ethnicity_is_not_found(self):
+        for analysis in ('patient_long_survival', 'treatment_for_ethnicity'):
+            for ethnicity in ('Martian', 'q'):
+                with self.subTest(analysis=analysis, ethnicity=ethnicity):
+                    status, body = http_request(self.port, 'POST', '/query',
+                                                {'analysis': analysis,
+                                                 'args': {'ethnicity': ethnicity}})
+                    self.assertEqual(status, 404)
+                    # the analyses capitalise the value they did not find
+                    self.assertIn(f"'{ethnicity.casefold()}'", body['error'].casefold())
+
+    def test_known_ethnicity_in_any_case(self):
+        results = [http_request(self.port, 'POST', '/query',
+                                {'analysis': 'treatment_for_ethnicity',
+                                 'args': {'ethnicity': ethnicity}})
+                   for ethnicity in ('asian', ' ASIAN ')]
+        self.assertEqual(results[0][0], 200)
+        self.assertTrue(results[0][1]['result'])
+        self.assertEqual(results[0][1]['result'], results[1][1]['result'])
+
+
+if __name__ == "__main__":
+    unittest.main()